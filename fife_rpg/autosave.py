@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Writes snapshots of entities to files in a background thread
+
+The snapshot is taken on the main thread and does not share any mutable
+values with the entities, so the game can continue while the snapshot is
+serialized, compressed and written.
+
+.. module:: autosave
+    :synopsis: Writes snapshots of entities in a background thread
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from builtins import object
+import gzip
+import os
+import threading
+from queue import Empty, Queue
+
+import yaml
+from bGrease import Entity
+from fife.fife import DoublePoint, DoublePoint3D
+
+from fife_rpg import binary_entities
+from fife_rpg.helpers import (DoublePointYaml, DoublePoint3DYaml,
+                              replace_file)
+
+PROGRESS_INTERVAL = 500
+
+
+def snapshot_value(value, entity_to_dict):
+    """Returns a copy of a field value that shares no mutable data with the
+    original value
+
+    Args:
+        value: The value to copy
+
+        entity_to_dict: Function that creates the snapshot dictionary of
+        entities that are stored in the value
+
+    Returns:
+        The copied value. Entities are replaced by
+        :class:`fife_rpg.binary_entities.EntityData` instances.
+    """
+    if isinstance(value, Entity):
+        return binary_entities.EntityData(entity_to_dict(value))
+    elif isinstance(value, DoublePoint3D):
+        return DoublePoint3DYaml(value)
+    elif isinstance(value, DoublePoint):
+        return DoublePointYaml(value)
+    elif isinstance(value, dict):
+        return dict((snapshot_value(key, entity_to_dict),
+                     snapshot_value(item, entity_to_dict))
+                    for key, item in value.items())
+    elif isinstance(value, list):
+        return [snapshot_value(item, entity_to_dict) for item in value]
+    elif isinstance(value, (tuple, set, frozenset)):
+        return type(value)(snapshot_value(item, entity_to_dict)
+                           for item in value)
+    return value
+
+
+class AutosaveThread(threading.Thread):
+
+    """Thread that writes entity dictionaries to a file
+
+    The data is first written to a temporary file, which replaces the
+    actual file once everything is written.
+
+    Properties:
+        filename: The path of the file
+
+        entity_dicts: The entity dictionaries to write
+
+        binary: Whether the binary format is used instead of yaml
+
+        compress: Whether the file is compressed with gzip
+
+        events: Queue with the progress and completion events of the
+        thread
+    """
+
+    def __init__(self, entity_dicts, filename, binary=True, compress=False):
+        threading.Thread.__init__(self, name="Autosave")
+        self.filename = filename
+        self.entity_dicts = entity_dicts
+        self.binary = binary
+        self.compress = compress
+        self.events = Queue()
+
+    def __entities(self):
+        """Yields the entity dictionaries and reports the progress"""
+        total = len(self.entity_dicts)
+        for saved, entity_dict in enumerate(self.entity_dicts):
+            if saved % PROGRESS_INTERVAL == 0:
+                self.events.put(("progress", saved, total))
+            yield entity_dict
+        self.events.put(("progress", total, total))
+
+    def run(self):
+        temp_filename = self.filename + ".tmp"
+        try:
+            directory = os.path.dirname(self.filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            if self.compress:
+                save_file = gzip.open(temp_filename, "wb")
+            else:
+                save_file = open(temp_filename, "wb")
+            with save_file:
+                if self.binary:
+                    binary_entities.dump_entities(self.__entities(),
+                                                  save_file)
+                else:
+                    yaml.dump_all(
+                        (binary_entities.EntityData(entity_dict)
+                         for entity_dict in self.__entities()),
+                        save_file, Dumper=binary_entities.EntityDataDumper,
+                        indent=4, encoding="utf-8")
+            replace_file(temp_filename, self.filename)
+        except Exception as error:  # pylint: disable=broad-except
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            self.events.put(("done", error))
+        else:
+            self.events.put(("done", None))
+
+
+class Autosaver(object):
+
+    """Runs autosave threads and passes their events to callbacks
+
+    The callbacks are only called from :meth:`step` and :meth:`wait`, so
+    they run on the thread of the game loop.
+
+    Properties:
+        is_saving: Whether an autosave is running
+    """
+
+    def __init__(self):
+        self.__thread = None
+        self.__progress_callback = None
+        self.__done_callback = None
+
+    @property
+    def is_saving(self):
+        """Returns whether an autosave is running"""
+        return self.__thread is not None
+
+    def save(self, entity_dicts, filename, binary=True, compress=False,
+             progress_callback=None, done_callback=None):
+        """Starts writing entity dictionaries in a background thread
+
+        Args:
+            entity_dicts: A list of entity dictionaries, that may not be
+            changed while they are written
+
+            filename: The path of the file
+
+            binary: Whether to use the binary format instead of yaml
+
+            compress: Whether to compress the file with gzip
+
+            progress_callback: Called with the number of written entities
+            and the total number of entities
+
+            done_callback: Called with the filename and the raised
+            exception, or None if the file was written
+
+        Returns:
+            True if the autosave was started, False if another autosave is
+            still running
+        """
+        if self.is_saving:
+            return False
+        self.__progress_callback = progress_callback
+        self.__done_callback = done_callback
+        self.__thread = AutosaveThread(entity_dicts, filename, binary,
+                                       compress)
+        self.__thread.start()
+        return True
+
+    def step(self):
+        """Calls the callbacks for the events of the running autosave"""
+        thread = self.__thread
+        if thread is None:
+            return
+        while True:
+            try:
+                event = thread.events.get_nowait()
+            except Empty:
+                break
+            if event[0] == "progress":
+                if self.__progress_callback:
+                    self.__progress_callback(*event[1:])
+                continue
+            thread.join()
+            self.__thread = None
+            if self.__done_callback:
+                self.__done_callback(thread.filename, event[1])
+            break
+
+    def wait(self):
+        """Waits for the running autosave to finish and calls its
+        callbacks"""
+        if self.__thread is not None:
+            self.__thread.join()
+            self.step()
@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compact binary format for entity dumps
+
+A file starts with a header and is followed by records. Every record
+starts with its kind and the length of its data. Name records define the
+names of components, fields and dictionary keys, which are afterwards
+only referenced by their number. Entity records contain the same
+dictionaries that are written as !Entity documents in yaml entity files.
+
+.. module:: binary_entities
+    :synopsis: Compact binary format for entity dumps
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from builtins import object
+import numbers
+import struct
+
+import yaml
+from bGrease import Entity
+from fife.fife import DoublePoint, DoublePoint3D
+
+from fife_rpg import helpers
+
+HEADER = b"FRPGENT"
+FORMAT_VERSION = 1
+
+RECORD_NAME = b"n"
+RECORD_ENTITY = b"e"
+
+_RECORD = struct.Struct("<cI")
+_UINT = struct.Struct("<I")
+_INT = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+_POINT = struct.Struct("<dd")
+_POINT_3D = struct.Struct("<ddd")
+_VERSION = struct.Struct("<H")
+
+_NONE = b"N"
+_TRUE = b"T"
+_FALSE = b"F"
+_INTEGER = b"i"
+_BIG_INTEGER = b"I"
+_FLOAT = b"d"
+_STRING = b"s"
+_NAME = b"k"
+_LIST = b"l"
+_TUPLE = b"t"
+_DICT = b"D"
+_SET = b"S"
+_DOUBLE_POINT = b"p"
+_DOUBLE_POINT_3D = b"P"
+_ENTITY = b"E"
+
+_MIN_INT = -2 ** 63
+_MAX_INT = 2 ** 63 - 1
+
+try:
+    # Python 2: text is unicode, native strings are bytes in UTF-8
+    _STRING_TYPES = (unicode, bytes)  # pylint: disable=undefined-variable
+except NameError:
+    _STRING_TYPES = (str,)
+
+
+class BinaryFormatError(Exception):
+
+    """Raised when data can not be read or written in the binary format"""
+
+
+class EntityData(dict):
+
+    """The dictionary of an entity that was read without a world"""
+
+
+def entity_data_representer(dumper, data):
+    """Represent EntityData as an !Entity node"""
+    return dumper.represent_mapping(u"!Entity", dict(data))
+
+
+def entity_data_constructor(loader, node):
+    """Construct EntityData from an !Entity node"""
+    return EntityData(loader.construct_mapping(node, deep=True))
+
+
+class EntityDataLoader(helpers.YamlLoader):
+
+    """Loader that reads !Entity nodes as EntityData"""
+
+
+class EntityDataDumper(helpers.FRPGDumper):
+
+    """Dumper that writes EntityData as !Entity nodes"""
+
+
+yaml.add_constructor("!Entity", entity_data_constructor, EntityDataLoader)
+yaml.add_constructor("!DoublePoint", helpers.double_point_constructor,
+                     EntityDataLoader)
+yaml.add_constructor("!DoublePoint3D", helpers.double_point_3d_constructor,
+                     EntityDataLoader)
+yaml.add_representer(EntityData, entity_data_representer, EntityDataDumper)
+yaml.add_representer(helpers.VersionedDict,
+                     helpers.versioned_dict_representer, EntityDataDumper)
+yaml.add_representer(helpers.DoublePointYaml,
+                     helpers.double_point_representer, EntityDataDumper)
+yaml.add_representer(helpers.DoublePoint3DYaml,
+                     helpers.double_point_3d_representer, EntityDataDumper)
+
+
+def _encode_utf8(value):
+    """Returns a string as UTF-8 encoded bytes. Native strings of Python 2
+    are bytes already and are returned unchanged."""
+    if isinstance(value, bytes):
+        return value
+    return value.encode("utf-8")
+
+
+class BinaryEntityWriter(object):
+
+    """Writes entity dictionaries to a stream in the binary format
+
+    Properties:
+        stream: The stream the data is written to
+    """
+
+    def __init__(self, stream, entity_to_dict=None):
+        """Args:
+
+            stream: A file like object opened in binary mode
+
+            entity_to_dict: Function that creates the dictionary of an
+            entity that is stored in a field of another entity. Needed if
+            such values are written.
+        """
+        self.stream = stream
+        self.__entity_to_dict = entity_to_dict
+        self.__names = {}
+        stream.write(HEADER + _VERSION.pack(FORMAT_VERSION))
+
+    def __write_record(self, kind, data):
+        """Writes a record to the stream"""
+        self.stream.write(_RECORD.pack(kind, len(data)))
+        self.stream.write(data)
+
+    def __name_id(self, name):
+        """Returns the number of a name, and writes a name record if
+        the name was not used before"""
+        try:
+            return self.__names[name]
+        except KeyError:
+            pass
+        name_id = len(self.__names)
+        self.__names[name] = name_id
+        self.__write_record(RECORD_NAME, _encode_utf8(name))
+        return name_id
+
+    def __encode(self, value, out):
+        """Appends the encoded value to the out list"""
+        if value is None:
+            out.append(_NONE)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, numbers.Integral):
+            if _MIN_INT <= value <= _MAX_INT:
+                out.append(_INTEGER + _INT.pack(value))
+            else:
+                self.__encode_string(_BIG_INTEGER, str(value), out)
+        elif isinstance(value, numbers.Real):
+            out.append(_FLOAT + _DOUBLE.pack(value))
+        elif isinstance(value, _STRING_TYPES):
+            self.__encode_string(_STRING, value, out)
+        elif isinstance(value, DoublePoint3D):
+            out.append(_DOUBLE_POINT_3D +
+                       _POINT_3D.pack(value.x, value.y, value.z))
+        elif isinstance(value, DoublePoint):
+            out.append(_DOUBLE_POINT + _POINT.pack(value.x, value.y))
+        elif isinstance(value, dict):
+            out.append(_ENTITY if isinstance(value, EntityData) else _DICT)
+            self.__encode_dict(value, out)
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            if isinstance(value, list):
+                out.append(_LIST)
+            elif isinstance(value, tuple):
+                out.append(_TUPLE)
+            else:
+                out.append(_SET)
+            out.append(_UINT.pack(len(value)))
+            for item in value:
+                self.__encode(item, out)
+        elif isinstance(value, Entity) and self.__entity_to_dict:
+            out.append(_ENTITY)
+            self.__encode_dict(self.__entity_to_dict(value), out)
+        else:
+            raise BinaryFormatError("Can't write values of type %s" %
+                                    type(value).__name__)
+
+    def __encode_string(self, tag, value, out):
+        """Appends an encoded string with the given tag to the out list"""
+        data = _encode_utf8(value)
+        out.append(tag + _UINT.pack(len(data)))
+        out.append(data)
+
+    def __encode_dict(self, value, out):
+        """Appends the items of a dictionary to the out list. String keys
+        are written as names."""
+        out.append(_UINT.pack(len(value)))
+        for key, item in value.items():
+            if isinstance(key, _STRING_TYPES):
+                out.append(_NAME + _UINT.pack(self.__name_id(key)))
+            else:
+                self.__encode(key, out)
+            self.__encode(item, out)
+
+    def write(self, entity_dict):
+        """Writes an entity record
+
+        Args:
+            entity_dict: The dictionary of the entity, as returned by
+            :meth:`fife_rpg.world.RPGWorld.create_entity_dictionary`
+        """
+        out = []
+        self.__encode_dict(entity_dict, out)
+        self.__write_record(RECORD_ENTITY, b"".join(out))
+
+
+class BinaryEntityReader(object):
+
+    """Reads entity dictionaries from a stream in the binary format
+
+    Properties:
+        stream: The stream the data is read from
+    """
+
+    def __init__(self, stream, create_entity=None):
+        """Args:
+
+            stream: A file like object opened in binary mode
+
+            create_entity: Function that is called with the dictionary of
+            an entity that is stored in a field of another entity. If not
+            set the values will be EntityData instances.
+
+        Raises:
+            BinaryFormatError if the stream does not start with a valid
+            header
+        """
+        self.stream = stream
+        self.__create_entity = create_entity or EntityData
+        self.__names = []
+        header = stream.read(len(HEADER) + _VERSION.size)
+        if header[:len(HEADER)] != HEADER:
+            raise BinaryFormatError("Not a binary entity file")
+        version = _VERSION.unpack(header[len(HEADER):])[0]
+        if version > FORMAT_VERSION:
+            raise BinaryFormatError("Unsupported format version %d" %
+                                    version)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """Returns the dictionary of the next entity record
+
+        Raises:
+            StopIteration at the end of the stream
+        """
+        while True:
+            record = self.stream.read(_RECORD.size)
+            if not record:
+                raise StopIteration
+            if len(record) < _RECORD.size:
+                raise BinaryFormatError("Truncated record")
+            kind, length = _RECORD.unpack(record)
+            data = self.stream.read(length)
+            if len(data) < length:
+                raise BinaryFormatError("Truncated record")
+            if kind == RECORD_NAME:
+                self.__names.append(data.decode("utf-8"))
+            elif kind == RECORD_ENTITY:
+                entity_dict, _ = self.__decode_dict(data, 0)
+                return entity_dict
+            else:
+                raise BinaryFormatError("Unknown record kind %r" % kind)
+
+    def __decode(self, data, offset):
+        """Decodes the value at the offset. Returns the value and the
+        offset after it."""
+        tag = data[offset:offset + 1]
+        offset += 1
+        if tag == _NONE:
+            return None, offset
+        elif tag == _TRUE:
+            return True, offset
+        elif tag == _FALSE:
+            return False, offset
+        elif tag == _INTEGER:
+            return _INT.unpack_from(data, offset)[0], offset + _INT.size
+        elif tag == _FLOAT:
+            return _DOUBLE.unpack_from(data, offset)[0], offset + _DOUBLE.size
+        elif tag in (_STRING, _BIG_INTEGER):
+            length = _UINT.unpack_from(data, offset)[0]
+            offset += _UINT.size
+            value = data[offset:offset + length].decode("utf-8")
+            if tag == _BIG_INTEGER:
+                value = int(value)
+            return value, offset + length
+        elif tag == _NAME:
+            name_id = _UINT.unpack_from(data, offset)[0]
+            return self.__names[name_id], offset + _UINT.size
+        elif tag == _DOUBLE_POINT:
+            pos = _POINT.unpack_from(data, offset)
+            return helpers.DoublePointYaml(*pos), offset + _POINT.size
+        elif tag == _DOUBLE_POINT_3D:
+            pos = _POINT_3D.unpack_from(data, offset)
+            return helpers.DoublePoint3DYaml(*pos), offset + _POINT_3D.size
+        elif tag == _DICT:
+            return self.__decode_dict(data, offset)
+        elif tag == _ENTITY:
+            entity_dict, offset = self.__decode_dict(data, offset)
+            return self.__create_entity(entity_dict), offset
+        elif tag in (_LIST, _TUPLE, _SET):
+            length = _UINT.unpack_from(data, offset)[0]
+            offset += _UINT.size
+            items = []
+            for _ in range(length):
+                item, offset = self.__decode(data, offset)
+                items.append(item)
+            if tag == _TUPLE:
+                return tuple(items), offset
+            elif tag == _SET:
+                return set(items), offset
+            return items, offset
+        raise BinaryFormatError("Unknown value tag %r" % tag)
+
+    def __decode_dict(self, data, offset):
+        """Decodes a dictionary at the offset. Returns the dictionary and
+        the offset after it."""
+        length = _UINT.unpack_from(data, offset)[0]
+        offset += _UINT.size
+        value = {}
+        for _ in range(length):
+            key, offset = self.__decode(data, offset)
+            item, offset = self.__decode(data, offset)
+            value[key] = item
+        return value, offset
+
+
+def dump_entities(entity_dicts, stream, entity_to_dict=None):
+    """Writes entity dictionaries to a stream in the binary format
+
+    Args:
+        entity_dicts: An iterable of entity dictionaries
+
+        stream: A file like object opened in binary mode
+
+        entity_to_dict: Function that creates the dictionary of an entity
+        that is stored in a field of another entity.
+    """
+    writer = BinaryEntityWriter(stream, entity_to_dict)
+    for entity_dict in entity_dicts:
+        writer.write(entity_dict)
+
+
+def load_entities(stream, create_entity=None):
+    """Reads entity dictionaries from a stream in the binary format
+
+    Args:
+        stream: A file like object opened in binary mode
+
+        create_entity: Function that is called with the dictionary of an
+        entity that is stored in a field of another entity.
+
+    Returns:
+        An iterator over the entity dictionaries
+    """
+    return BinaryEntityReader(stream, create_entity)
+
+
+def yaml_to_binary(yaml_stream, binary_stream):
+    """Converts a yaml entity file to the binary format
+
+    Args:
+        yaml_stream: A string or file like object with the yaml data
+
+        binary_stream: A file like object opened in binary mode
+    """
+    documents = yaml.load_all(yaml_stream, Loader=EntityDataLoader)
+    dump_entities((document for document in documents if document),
+                  binary_stream)
+
+
+def binary_to_yaml(binary_stream, yaml_stream=None):
+    """Converts an entity file in the binary format to yaml
+
+    Args:
+        binary_stream: A file like object opened in binary mode
+
+        yaml_stream: A file like object the yaml data is written to. If
+        this is None the yaml data is returned as text.
+
+    Returns:
+        The yaml data, if yaml_stream is None
+    """
+    entities = (EntityData(entity_dict)
+                for entity_dict in load_entities(binary_stream))
+    if yaml_stream is None:
+        # Without an encoding yaml returns unicode on Python 2 as well
+        return yaml.dump_all(entities, Dumper=EntityDataDumper, indent=4,
+                             encoding=None)
+    yaml.dump_all(entities, yaml_stream, Dumper=EntityDataDumper, indent=4)
+    return None
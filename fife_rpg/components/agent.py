@@ -61,6 +61,8 @@ class Agent(Base):
         knows: What the agent knows about
     """
 
+    indexed_fields = ["map"]
+
     def __init__(self):
         Base.__init__(self, gfx=str, namespace=str, map=str, new_map=object,
                       layer=str, new_layer=object, type=str,
@@ -25,13 +25,37 @@ import inspect
 
 import bGrease
 from bGrease.component import Component
+from bGrease.component.general import Data
 
 from fife_rpg.components import ComponentManager
 from fife_rpg.exceptions import AlreadyRegisteredError, NotRegisteredError
-from fife_rpg.helpers import ClassProperty, DoublePoint3DYaml, DoublePointYaml
+from fife_rpg.helpers import (ClassProperty, DoublePoint3DYaml,
+                              DoublePointYaml, VersionedDict)
 
 bGrease.component.field.types[DoublePoint3DYaml] = DoublePoint3DYaml
 bGrease.component.field.types[DoublePointYaml] = DoublePointYaml
+bGrease.component.field.types[VersionedDict] = VersionedDict
+
+
+class ComponentData(Data):
+
+    """Entity data that reports changed field values to its component"""
+
+    def __init__(self, component, entity, **data):
+        self.__dict__["_ComponentData__component"] = None
+        Data.__init__(self, component.fields, entity, **data)
+        self.__dict__["_ComponentData__component"] = component
+
+    def __setattr__(self, name, value):
+        component = self.__component
+        if component is None:
+            Data.__setattr__(self, name, value)
+            return
+        old_value = self.__dict__.get(name)
+        Data.__setattr__(self, name, value)
+        new_value = self.__dict__[name]
+        if old_value is not new_value and old_value != new_value:
+            component.field_changed(self.entity, name, old_value, new_value)
 
 
 class Base(Component):
@@ -44,9 +68,23 @@ class Base(Component):
 
         dependencies: Class property that sets the classes this Component
         depends on
+
+        indexed_fields: Class property that sets the fields for which an
+        index of value to entities is kept. The values of these fields need
+        to be hashable.
     """
     __registered_as = None
     dependencies = []
+    indexed_fields = []
+
+    def __init__(self, **fields):
+        Component.__init__(self, **fields)
+        self.__indexes = {}
+        self.__field_listeners = {}
+        self.__entity_listeners = []
+        self.__remove_listeners = []
+        for field_name in self.indexed_fields:
+            self.add_index(field_name)
 
     @ClassProperty
     @classmethod
@@ -59,6 +97,222 @@ class Base(Component):
         """Returns the fields of the component that can be saved."""
         return list(self.fields.keys())
 
+    def set_world(self, world):
+        """Sets the world of the component. The component instances are
+        shared by all worlds, so the indexes are built again from the
+        entities of the new world.
+
+        Args:
+            world: The world
+        """
+        Component.set_world(self, world)
+        for field_name in list(self.__indexes.keys()):
+            self.add_index(field_name)
+
+    def get_world_entities(self):
+        """Returns the entities of the component that are in the current
+        world of the component. The entities of replaced worlds stay in the
+        shared component instances."""
+        world = getattr(self, "world", None)
+        return set(entity for entity in self.entities
+                   if entity.world is world)
+
+    def set(self, entity, data=None, **data_kw):
+        """Set the component data for an entity, adding it to the component
+        if it is not already a member.
+
+        Args:
+            entity: The entity to set the data for
+
+            data: An object whose attributes will be copied to the fields of
+            the entity
+
+            data_kw: Values for the fields. These take precedence over the
+            values of data.
+
+        Returns:
+            The data of the entity
+        """
+        if data is not None:
+            for field_name in self.fields.keys():
+                if field_name not in data_kw and hasattr(data, field_name):
+                    data_kw[field_name] = getattr(data, field_name)
+        if entity in self.entities:
+            self.__unindex_entity(entity)
+            for callback in tuple(self.__remove_listeners):
+                callback(entity)
+        data = self[entity] = ComponentData(self, entity, **data_kw)
+        self.__index_entity(entity)
+        for callback in tuple(self.__entity_listeners):
+            callback(entity)
+        return data
+
+    def remove(self, entity):
+        """Remove the entity from the component
+
+        Args:
+            entity: The entity to remove
+
+        Returns:
+            True if the entity was removed, False if it was not in the
+            component
+        """
+        if entity in self.entities:
+            self.__unindex_entity(entity)
+            for callback in tuple(self.__remove_listeners):
+                callback(entity)
+        return Component.remove(self, entity)
+
+    __delitem__ = remove
+
+    def field_changed(self, entity, field_name, old_value, new_value):
+        """Called when the value of a field of an entity changed
+
+        Args:
+            entity: The entity whose data changed
+
+            field_name: The name of the field
+
+            old_value: The value the field had before
+
+            new_value: The value the field has now
+        """
+        if entity not in self.entities:
+            return
+        if (field_name in self.__indexes and
+                entity.world is getattr(self, "world", None)):
+            index = self.__indexes[field_name]
+            entities = index.get(old_value)
+            if entities is not None:
+                entities.discard(entity)
+                if not entities:
+                    del index[old_value]
+            index.setdefault(new_value, set()).add(entity)
+        for callback in tuple(self.__field_listeners.get(field_name, ())):
+            callback(entity, field_name, old_value, new_value)
+
+    def add_field_listener(self, field_name, callback):
+        """Adds a function that gets called when the value of the field
+        of an entity changed.
+
+        Args:
+            field_name: The name of the field
+
+            callback: The function to call. It gets passed the entity, the
+            name of the field, the old value and the new value.
+        """
+        callbacks = self.__field_listeners.setdefault(field_name, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+    def remove_field_listener(self, field_name, callback):
+        """Removes a function added by add_field_listener
+
+        Args:
+            field_name: The name of the field
+
+            callback: The function to remove
+        """
+        callbacks = self.__field_listeners.get(field_name, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def add_entity_listener(self, callback):
+        """Adds a function that gets called when an entity was added to the
+        component, or its data was replaced.
+
+        Args:
+            callback: The function to call. It gets passed the entity.
+        """
+        if callback not in self.__entity_listeners:
+            self.__entity_listeners.append(callback)
+
+    def remove_entity_listener(self, callback):
+        """Removes a function added by add_entity_listener
+
+        Args:
+            callback: The function to remove
+        """
+        if callback in self.__entity_listeners:
+            self.__entity_listeners.remove(callback)
+
+    def add_remove_listener(self, callback):
+        """Adds a function that gets called before an entity is removed from
+        the component, or its data is replaced.
+
+        Args:
+            callback: The function to call. It gets passed the entity.
+        """
+        if callback not in self.__remove_listeners:
+            self.__remove_listeners.append(callback)
+
+    def remove_remove_listener(self, callback):
+        """Removes a function added by add_remove_listener
+
+        Args:
+            callback: The function to remove
+        """
+        if callback in self.__remove_listeners:
+            self.__remove_listeners.remove(callback)
+
+    def add_index(self, field_name):
+        """Starts keeping an index of the values of a field
+
+        Args:
+            field_name: The name of the field. Its values need to be hashable.
+
+        Raises:
+            KeyError: If the component has no field with that name
+        """
+        if field_name not in self.fields:
+            raise KeyError("The component has no %s field" % field_name)
+        index = self.__indexes[field_name] = {}
+        for entity in self.get_world_entities():
+            value = getattr(self[entity], field_name)
+            index.setdefault(value, set()).add(entity)
+
+    def has_index(self, field_name):
+        """Returns whether there is an index for the field
+
+        Args:
+            field_name: The name of the field
+        """
+        return field_name in self.__indexes
+
+    def get_indexed(self, field_name, value):
+        """Returns the entities whose field has the given value
+
+        Args:
+            field_name: The name of an indexed field
+
+            value: The value to look up
+
+        Returns:
+            A set of the matching entities
+
+        Raises:
+            KeyError: If the field is not indexed
+        """
+        return set(self.__indexes[field_name].get(value, ()))
+
+    def __index_entity(self, entity):
+        """Adds the values of the entity to the indexes"""
+        data = self[entity]
+        for field_name, index in self.__indexes.items():
+            value = getattr(data, field_name)
+            index.setdefault(value, set()).add(entity)
+
+    def __unindex_entity(self, entity):
+        """Removes the values of the entity from the indexes"""
+        data = self[entity]
+        for field_name, index in self.__indexes.items():
+            value = getattr(data, field_name)
+            entities = index.get(value)
+            if entities is not None:
+                entities.discard(entity)
+                if not entities:
+                    del index[value]
+
     @classmethod
     def register(cls, name, auto_register=True):
         """Registers the class as a component
@@ -21,6 +21,7 @@
 """
 
 from fife_rpg.components.base import Base
+from fife_rpg.helpers import VersionedDict
 
 
 class CharacterStatistics(Base):
@@ -36,9 +37,11 @@ class CharacterStatistics(Base):
 
         origin: The origin of the character
 
-        primary_stats: The primary, directly increasable statistics
+        primary_stats: The primary, directly increasable statistics. A
+        :class:`fife_rpg.helpers.VersionedDict` so changes can be detected.
 
-        secondary_stats: The secondary, calculated statistics
+        secondary_stats: The secondary, calculated statistics. A
+        :class:`fife_rpg.helpers.VersionedDict` so changes can be detected.
 
         stat_points: The points that can be used to raise stats
 
@@ -47,8 +50,9 @@ class CharacterStatistics(Base):
 
     def __init__(self):
         Base.__init__(self, gender=str, picture=str, age=int, origin=str,
-                      primary_stats=dict, secondary_stats=dict,
-                      stat_points=int, traits=list,)
+                      primary_stats=VersionedDict,
+                      secondary_stats=VersionedDict, stat_points=int,
+                      traits=list,)
 
     @property
     def saveable_fields(self):
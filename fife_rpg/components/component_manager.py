@@ -70,7 +70,8 @@ def get_checkers():
     return copy(_CHECKERS)
 
 
-def register_checker(component_names, callback):
+def register_checker(component_names, callback, watched_fields=None,
+                     on_enter=False):
     """Add a checker to the checkers list
 
     Args:
@@ -78,8 +79,15 @@ def register_checker(component_names, callback):
         which the checker will check
 
         callback: The checker function
+
+        watched_fields: A dictionary of component names to lists of field
+        names. If set, the checker is only called for an entity when one of
+        these fields changed, instead of for all entities every frame.
+
+        on_enter: If True and watched_fields is set, the checker will also be
+        called once when an entity got all of the checked components.
     """
-    _CHECKERS.append((component_names, callback))
+    _CHECKERS.append((component_names, callback, watched_fields, on_enter))
 
 
 def clear_checkers():
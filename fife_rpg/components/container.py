@@ -25,11 +25,238 @@ from __future__ import division
 from builtins import range
 from past.utils import old_div
 from operator import attrgetter
+from bisect import bisect_left, insort
+import heapq
+from itertools import islice
 
 from fife_rpg.components.base import Base
 from fife_rpg.components.containable import Containable
 
 
+SORT_KEYS = {"slot": 0, "item_type": 1, "bulk": 2, "weight": 3}
+
+
+class ContainerIndex(object):
+
+    """The items of a container indexed by slot and item type, together with
+    the totals of their bulk and weight.
+
+    Properties:
+        items: Dictionary of the items in the container and the slot, item
+        type, bulk and weight they were added with
+
+        slots: Dictionary of slots and the items in them
+
+        types: Dictionary of item types and the items with that type
+
+        total_bulk: The bulk of all items in the container
+
+        total_weight: The weight of all items in the container
+
+        nested_bulk: The bulk of the contents of the containers in the
+        container, including their nested containers
+
+        nested_weight: The weight of the contents of the containers in the
+        container, including their nested containers
+
+        content_bulk: The bulk of the items and all nested contents
+
+        content_weight: The weight of the items and all nested contents
+
+        end_slot: The slot after the highest slot that was used since the
+        last reset of the free slots
+
+        used_slot_count: The number of occupied slots
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.slots = {}
+        self.types = {}
+        self.total_bulk = 0
+        self.total_weight = 0
+        self.nested_bulk = 0
+        self.nested_weight = 0
+        self.end_slot = 0
+        self.used_slot_count = 0
+        self.__free_slots = []
+        self.__free_slots_set = set()
+        self.__sorted_views = {}
+        self.__serials = {}
+        self.__next_serial = 0
+
+    def add(self, entity, item_data):
+        """Adds an item to the index
+
+        Args:
+            entity: The item
+
+            item_data: The containable data of the item
+        """
+        bulk = item_data.bulk * item_data.current_stack
+        self.items[entity] = (item_data.slot, item_data.item_type, bulk,
+                              item_data.weight)
+        if item_data.slot not in self.slots:
+            self.__slot_taken(item_data.slot)
+        self.slots.setdefault(item_data.slot, set()).add(entity)
+        self.types.setdefault(item_data.item_type, set()).add(entity)
+        self.total_bulk += bulk
+        self.total_weight += item_data.weight
+        self.__serials[entity] = self.__next_serial
+        self.__next_serial += 1
+        for sort_key, view in self.__sorted_views.items():
+            insort(view, self.__view_entry(entity, sort_key))
+
+    def remove(self, entity):
+        """Removes an item from the index
+
+        Args:
+            entity: The item
+        """
+        for sort_key, view in self.__sorted_views.items():
+            entry = self.__view_entry(entity, sort_key)
+            del view[bisect_left(view, entry)]
+        del self.__serials[entity]
+        slot, item_type, bulk, weight = self.items.pop(entity)
+        self.__discard(self.slots, slot, entity)
+        if slot not in self.slots:
+            self.__slot_freed(slot)
+        self.__discard(self.types, item_type, entity)
+        if self.items:
+            self.total_bulk -= bulk
+            self.total_weight -= weight
+        else:
+            self.total_bulk = 0
+            self.total_weight = 0
+            self.nested_bulk = 0
+            self.nested_weight = 0
+            self.reset_free_slots()
+
+    def __view_entry(self, entity, sort_key):
+        """Returns the entry of an item in a sorted view"""
+        entry = self.items[entity]
+        return (entry[SORT_KEYS[sort_key]], entry[0], self.__serials[entity],
+                entity)
+
+    def get_sorted_view(self, sort_key):
+        """Returns the items sorted by a key. The view is created the first
+        time it is requested and then kept sorted when items are added or
+        removed. It may not be changed.
+
+        Args:
+            sort_key: One of the keys of SORT_KEYS. Items with the same
+            value are sorted by slot.
+
+        Returns:
+            A sorted list of tuples. The item is the last value of the
+            tuples.
+
+        Raises:
+            KeyError: If the sort key is unknown
+        """
+        view = self.__sorted_views.get(sort_key)
+        if view is None:
+            view = sorted(self.__view_entry(entity, sort_key)
+                          for entity in self.items)
+            self.__sorted_views[sort_key] = view
+        return view
+
+    @property
+    def content_bulk(self):
+        """Returns the bulk of the items and all nested contents"""
+        return self.total_bulk + self.nested_bulk
+
+    @property
+    def content_weight(self):
+        """Returns the weight of the items and all nested contents"""
+        return self.total_weight + self.nested_weight
+
+    @staticmethod
+    def __discard(index, key, entity):
+        """Removes the entity from the set of the key"""
+        entities = index[key]
+        entities.discard(entity)
+        if not entities:
+            del index[key]
+
+    def __push_free_slot(self, slot):
+        """Adds a slot to the heap of free slots"""
+        if slot not in self.__free_slots_set:
+            self.__free_slots_set.add(slot)
+            heapq.heappush(self.__free_slots, slot)
+
+    def __slot_taken(self, slot):
+        """Called when an item was put into an empty slot"""
+        if slot < 0:
+            return
+        self.used_slot_count += 1
+        for free_slot in range(self.end_slot, slot):
+            self.__push_free_slot(free_slot)
+        self.end_slot = max(self.end_slot, slot + 1)
+
+    def __slot_freed(self, slot):
+        """Called when the last item of a slot was removed"""
+        if slot < 0:
+            return
+        self.used_slot_count -= 1
+        self.__push_free_slot(slot)
+
+    def get_free_slot(self):
+        """Returns the lowest slot that is not occupied. Occupied slots are
+        only removed from the heap of free slots when they reach its top.
+        """
+        free_slots = self.__free_slots
+        while free_slots and free_slots[0] in self.slots:
+            self.__free_slots_set.discard(heapq.heappop(free_slots))
+        if free_slots:
+            return free_slots[0]
+        return self.end_slot
+
+    def get_free_slots(self, count, max_slots=0):
+        """Returns the lowest slots that are not occupied
+
+        Args:
+            count: How many slots to return
+
+            max_slots: If greater than 0 only slots below it are returned
+
+        Returns:
+            A sorted list of up to count free slots
+        """
+        free_slots = []
+        for slot in sorted(self.__free_slots_set):
+            if len(free_slots) == count:
+                break
+            if slot not in self.slots:
+                free_slots.append(slot)
+        slot = self.end_slot
+        while len(free_slots) < count:
+            free_slots.append(slot)
+            slot += 1
+        if max_slots > 0:
+            free_slots = [slot for slot in free_slots if slot < max_slots]
+        return free_slots
+
+    def reset_free_slots(self):
+        """Rebuilds the free slots from the occupied slots"""
+        used_slots = [slot for slot in self.slots if slot >= 0]
+        self.end_slot = max(used_slots) + 1 if used_slots else 0
+        self.used_slot_count = len(used_slots)
+        self.__free_slots = [slot for slot in range(self.end_slot)
+                             if slot not in self.slots]
+        self.__free_slots_set = set(self.__free_slots)
+
+    def get_slot_item(self, slot):
+        """Returns the item in the slot, or None if the slot is empty
+
+        Args:
+            slot: The index of the slot
+        """
+        for entity in self.slots.get(slot, ()):
+            return entity
+        return None
+
+
 class Container(Base):
 
     """Component that allows an entity to contain one or more child entities.
@@ -42,8 +269,157 @@ class Container(Base):
 
     dependencies = [Containable]
 
+    _tracked_fields = ("container", "slot", "item_type", "bulk", "weight",
+                       "current_stack")
+
     def __init__(self):
         Base.__init__(self, max_bulk=float, max_slots=int)
+        self.__indexes = None
+        self.__containables = None
+        self.__item_containers = {}
+        self.__container_parents = {}
+
+    def set_world(self, world):
+        """Sets the world of the component. The indexes of the items of the
+        containers are dropped, so that they are built again from the
+        entities of the new world.
+
+        Args:
+            world: The world
+        """
+        Base.set_world(self, world)
+        self.remove_indexes()
+
+    def remove_indexes(self):
+        """Drops the indexes of the items of the containers and removes
+        their listeners from the Containable component. The indexes are
+        built again when they are used the next time."""
+        containables = self.__containables
+        if containables is not None:
+            for field_name in self._tracked_fields:
+                containables.remove_field_listener(
+                    field_name, self.cb_containable_changed)
+            containables.remove_entity_listener(self.cb_containable_added)
+            containables.remove_remove_listener(self.cb_containable_removed)
+            self.__containables = None
+        self.__indexes = None
+        self.__item_containers = {}
+        self.__container_parents = {}
+
+    def get_index(self, identifier):
+        """Returns the index of the items of a container. The indexes are
+        built the first time this is called and then kept up to date by
+        listening to changes of the Containable component.
+
+        Args:
+            identifier: The identifier of the container
+
+        Returns:
+            A :class:`ContainerIndex`
+        """
+        if self.__indexes is None:
+            self.__indexes = {}
+            containables = getattr(self.world.components,
+                                   Containable.registered_as)
+            for field_name in self._tracked_fields:
+                containables.add_field_listener(field_name,
+                                                self.cb_containable_changed)
+            containables.add_entity_listener(self.cb_containable_added)
+            containables.add_remove_listener(self.cb_containable_removed)
+            self.__containables = containables
+            for entity in containables.get_world_entities():
+                self.cb_containable_added(entity)
+        index = self.__indexes.get(identifier)
+        if index is None:
+            index = self.__indexes[identifier] = ContainerIndex()
+        return index
+
+    def cb_containable_added(self, entity):
+        """Called when an entity was added to the Containable component
+
+        Args:
+            entity: The entity
+        """
+        if entity.world is not self.world:
+            return
+        containables = getattr(self.world.components,
+                               Containable.registered_as)
+        item_data = containables[entity]
+        container = item_data.container
+        if not container:
+            return
+        identifier = entity.identifier
+        index = self.get_index(container)
+        index.add(entity, item_data)
+        self.__item_containers[entity] = (container, identifier)
+        self.__container_parents[identifier] = container
+        bulk, weight = index.items[entity][2:]
+        nested_index = self.__indexes.get(identifier)
+        if nested_index is not None and nested_index is not index:
+            index.nested_bulk += nested_index.content_bulk
+            index.nested_weight += nested_index.content_weight
+            bulk += nested_index.content_bulk
+            weight += nested_index.content_weight
+        self.__propagate(container, bulk, weight)
+
+    def cb_containable_removed(self, entity):
+        """Called before an entity is removed from the Containable component
+
+        Args:
+            entity: The entity
+        """
+        container, identifier = self.__item_containers.pop(entity,
+                                                           (None, None))
+        if container is None:
+            return
+        del self.__container_parents[identifier]
+        index = self.__indexes[container]
+        bulk, weight = index.items[entity][2:]
+        nested_index = self.__indexes.get(identifier)
+        if nested_index is not None and nested_index is not index:
+            index.nested_bulk -= nested_index.content_bulk
+            index.nested_weight -= nested_index.content_weight
+            bulk += nested_index.content_bulk
+            weight += nested_index.content_weight
+        index.remove(entity)
+        self.__propagate(container, -bulk, -weight)
+
+    def __propagate(self, identifier, bulk, weight):
+        """Adds a change of the contents of a container to the nested
+        totals of the containers it is in
+
+        Args:
+            identifier: The identifier of the container whose contents
+            changed
+
+            bulk: The change of the bulk
+
+            weight: The change of the weight
+        """
+        visited = set((identifier,))
+        parent = self.__container_parents.get(identifier)
+        while parent is not None and parent not in visited:
+            visited.add(parent)
+            index = self.__indexes[parent]
+            index.nested_bulk += bulk
+            index.nested_weight += weight
+            parent = self.__container_parents.get(parent)
+
+    def cb_containable_changed(self, entity, field_name, old_value,
+                               new_value):
+        """Called when a field of a containable changed
+
+        Args:
+            entity: The entity whose data changed
+
+            field_name: The name of the field
+
+            old_value: The value the field had before
+
+            new_value: The value the field has now
+        """
+        self.cb_containable_removed(entity)
+        self.cb_containable_added(entity)
 
     @property
     def saveable_fields(self):
@@ -111,14 +487,24 @@ def get_items(container, item_type=None):
 
         item_type: Type of items. If none all items are returned.
     """
-    world = container.world
-    containables = getattr(world[...], Containable.registered_as)
-    in_container = containables.container == container.identifier
+    index = get_index(container)
     if item_type is None:
-        return list(in_container)
-    else:
-        with_type = containables.item_type == item_type
-        return list(in_container & with_type)
+        return list(index.items)
+    return list(index.types.get(item_type, ()))
+
+
+def get_index(container):
+    """Returns the index of the items in a container.
+
+    Args:
+        container: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
+        container component
+
+    Returns:
+        A :class:`fife_rpg.components.container.ContainerIndex`
+    """
+    containers = getattr(container.world.components, Container.registered_as)
+    return containers.get_index(container.identifier)
 
 
 def get_free_slot(container):
@@ -136,55 +522,43 @@ def get_free_slot(container):
         if there is no free slot.
     """
 
-    in_container = get_items(container)
     container_component = getattr(container, Container.registered_as)
-    used_slots = set()
-    for child in in_container:
-        child_component = getattr(child, Containable.registered_as)
-        used_slots.add(child_component.slot)
-    if container_component.max_slots > 0:
-        usable_slots = set(range(container_component.max_slots))
-    else:
-        try:
-            usable_slots = set(range(max(used_slots) + 2))
-        except ValueError:
-            usable_slots = set((0,))
-    try:
-        return min(usable_slots - used_slots)
-    except ValueError:
+    slot = get_index(container).get_free_slot()
+    if 0 < container_component.max_slots <= slot:
         raise NoFreeSlotError
+    return slot
 
 
-def get_total_bulk(container):
+def get_total_bulk(container, nested=False):
     """Returns the bulk of all items in the container.
 
     Args:
         container: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
         container component
+
+        nested: Whether to include the contents of containers in the
+        container
     """
 
-    total_bulk = 0
-    for child in get_items(container):
-        child_component = getattr(child,
-                                  Containable.registered_as)
-        total_bulk += child_component.bulk * child_component.current_stack
-    return total_bulk
+    if nested:
+        return get_index(container).content_bulk
+    return get_index(container).total_bulk
 
 
-def get_total_weight(container):
+def get_total_weight(container, nested=False):
     """Returns the weight of all items in the container.
 
     Args:
         container: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
         container component
+
+        nested: Whether to include the contents of containers in the
+        container
     """
 
-    total_weight = 0
-    for child in get_items(container):
-        child_component = getattr(child,
-                                  Containable.registered_as)
-        total_weight += child_component.weight
-    return total_weight
+    if nested:
+        return get_index(container).content_weight
+    return get_index(container).total_weight
 
 
 def get_item(container, slot_or_type):
@@ -197,22 +571,21 @@ def get_item(container, slot_or_type):
         slot_or_type: The index of the slot, or an item type
     """
 
+    index = get_index(container)
     if type(slot_or_type) == int:
-        for child in get_items(container):
-            child_component = getattr(child, Containable.registered_as)
-            if child_component.slot == slot_or_type:
-                return child
-    else:
-        for child in get_items(container):
-            child_component = getattr(child, Containable.registered_as)
-            if child_component.item_type == slot_or_type:
-                return child
+        return index.get_slot_item(slot_or_type)
+    for child in index.types.get(slot_or_type, ()):
+        return child
     return None
 
 
 def remove_item(container, slot_or_type):
     """Removes the item at the given slot, or with the given type.
 
+    The slots of containers without a slot limit are compacted once more
+    than half of the used slot range is empty. Until then the freed slots
+    are reused by new items.
+
     Args:
         container: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
         container component
@@ -228,14 +601,39 @@ def remove_item(container, slot_or_type):
             item.container = ""
             item.slot = -1
             if container_data.max_slots <= 0:
-                entities = get_items(container)
-                items = []
-                for entity in entities:
-                    items.append(getattr(entity, Containable.registered_as))
-                items = sorted(items, key=attrgetter("slot"))
-                for x in range(len(items)):
-                    item = items[x]
-                    item.slot = x
+                compact_fragmented_slots(container)
+
+
+def compact_fragmented_slots(container):
+    """Compacts the slots of the container if more than half of the used
+    slot range is empty.
+
+    Args:
+        container: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
+        container component
+    """
+    index = get_index(container)
+    free_slot_count = index.end_slot - index.used_slot_count
+    if free_slot_count > index.used_slot_count:
+        compact_slots(container)
+
+
+def compact_slots(container):
+    """Moves the items of the container to the lowest slots, keeping their
+    order.
+
+    Args:
+        container: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
+        container component
+    """
+    items = []
+    for entity in get_items(container):
+        items.append(getattr(entity, Containable.registered_as))
+    items = sorted(items, key=attrgetter("slot"))
+    for x in range(len(items)):
+        item = items[x]
+        item.slot = x
+    get_index(container).reset_free_slots()
 
 
 def take_item(container, slot_or_type):
@@ -348,7 +746,216 @@ def put_item(container, item, slot=-1):
         raise BulkLimitError(total_bulk, container_data.max_bulk)
     remove_item(container, slot)
     if item_data.container:
-        remove_item(item_data.container, item_data.slot)
-    item_data.container = container.identifier
-    item_data.slot = slot
+        remove_item(container.world.get_entity(item_data.container),
+                    item_data.slot)
+    _move_item(item_data, container.identifier, slot)
     return old_item
+
+
+def _move_item(item_data, container_identifier, slot):
+    """Sets the container and the slot of an item. The item is taken out of
+    its current container first and gets its slot before it is put into the
+    new one, so the index of the new container never has it at its old slot.
+
+    Args:
+        item_data: The containable data of the item
+
+        container_identifier: The identifier of the container
+
+        slot: The slot in the container
+    """
+    if item_data.container:
+        item_data.container = ""
+    item_data.slot = slot
+    item_data.container = container_identifier
+
+
+def transfer_items(source, dest, item_filter=None):
+    """Moves all items, or the items that pass a filter, from one container
+    to another. Partial stacks are merged into the stacks of the same item
+    type in the destination, as put_item does. Either all items are moved
+    or, if they do not fit, none.
+
+    Args:
+        source: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
+        container component the items are taken from
+
+        dest: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
+        container component the items are put into
+
+        item_filter: A function that gets passed an item and returns
+        whether it should be moved. If None all items are moved.
+
+    Returns:
+        A list of the moved items whose stacks were completely merged into
+        other stacks. They are no longer in any container.
+
+    Raises:
+        :class:`fife_rpg.components.container.BulkLimitError` if the items
+        would exceed the bulk limit of the destination.
+
+        :class:`fife_rpg.components.container.NoFreeSlotError` if the
+        destination has not enough free slots.
+    """
+    source_index = get_index(source)
+    dest_index = get_index(dest)
+    if source_index is dest_index:
+        return []
+    dest_data = getattr(dest, Container.registered_as)
+    items = [item for item in source_index.items
+             if item_filter is None or item_filter(item)]
+    items.sort(key=lambda item: source_index.items[item][0])
+    items_data = [getattr(item, Containable.registered_as) for item in items]
+
+    total_bulk = dest_index.total_bulk
+    for item_data in items_data:
+        total_bulk += item_data.bulk * item_data.current_stack
+    if total_bulk > dest_data.max_bulk:
+        raise BulkLimitError(total_bulk, dest_data.max_bulk)
+
+    open_stacks = {}
+    for item_data in items_data:
+        item_type = item_data.item_type
+        if item_type in open_stacks:
+            continue
+        stacks = sorted(dest_index.types.get(item_type, ()),
+                        key=lambda stack: dest_index.items[stack][0])
+        stacks_data = [getattr(stack, Containable.registered_as)
+                       for stack in stacks]
+        open_stacks[item_type] = [
+            stack_data for stack_data in stacks_data
+            if stack_data.current_stack < stack_data.max_stack]
+    planned_stacks = {}
+    merges = []
+    moved = []
+    emptied = []
+    for item, item_data in zip(items, items_data):
+        remaining = item_data.current_stack
+        if remaining < item_data.max_stack:
+            for stack_data in open_stacks[item_data.item_type]:
+                stack_size = planned_stacks.get(stack_data,
+                                                stack_data.current_stack)
+                amount = min(stack_data.max_stack - stack_size, remaining)
+                if amount <= 0:
+                    continue
+                planned_stacks[stack_data] = stack_size + amount
+                merges.append((item_data, stack_data, amount))
+                remaining -= amount
+                if remaining == 0:
+                    break
+        if remaining == 0:
+            emptied.append(item)
+            continue
+        moved.append(item_data)
+        planned_stacks[item_data] = remaining
+        if remaining < item_data.max_stack:
+            open_stacks[item_data.item_type].append(item_data)
+    slots = dest_index.get_free_slots(len(moved), dest_data.max_slots)
+    if len(slots) < len(moved):
+        raise NoFreeSlotError
+
+    for item_data, stack_data, amount in merges:
+        item_data.current_stack -= amount
+        stack_data.current_stack += amount
+    for item_data, slot in zip(moved, slots):
+        _move_item(item_data, dest.identifier, slot)
+    for item in emptied:
+        item_data = getattr(item, Containable.registered_as)
+        item_data.container = ""
+        item_data.slot = -1
+    if getattr(source, Container.registered_as).max_slots <= 0:
+        compact_fragmented_slots(source)
+    return emptied
+
+
+def iter_sorted_items(container, sort_key="slot", reverse=False,
+                      item_filter=None):
+    """Iterates over the items of a container in sorted order without
+    copying or sorting them. The container may not change during the
+    iteration.
+
+    Args:
+        container: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
+        container component
+
+        sort_key: What to sort by. Either "slot", "item_type", "bulk" or
+        "weight"
+
+        reverse: Whether to iterate in descending order
+
+        item_filter: A function that gets passed an item and returns
+        whether it should be included. If None all items are included.
+
+    Returns:
+        An iterator over the items
+
+    Raises:
+        KeyError: If the sort key is unknown
+    """
+    view = get_index(container).get_sorted_view(sort_key)
+    if reverse:
+        entries = (view[position] for position in range(len(view) - 1, -1,
+                                                        -1))
+    else:
+        entries = iter(view)
+    items = (entry[-1] for entry in entries)
+    if item_filter is None:
+        return items
+    return (item for item in items if item_filter(item))
+
+
+def get_items_page(container, page, page_size, sort_key="slot",
+                   reverse=False, item_filter=None):
+    """Returns a page of the sorted items of a container. Without a filter
+    only the items of the page are looked at.
+
+    Args:
+        container: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
+        container component
+
+        page: The number of the page, starting at 0
+
+        page_size: How many items are on a page
+
+        sort_key: What to sort by. Either "slot", "item_type", "bulk" or
+        "weight"
+
+        reverse: Whether to sort in descending order
+
+        item_filter: A function that gets passed an item and returns
+        whether it should be included. If None all items are included.
+
+    Returns:
+        A list of the items on the page
+
+    Raises:
+        KeyError: If the sort key is unknown
+    """
+    start = page * page_size
+    if item_filter is None:
+        view = get_index(container).get_sorted_view(sort_key)
+        if reverse:
+            end = max(len(view) - start, 0)
+            entries = view[max(end - page_size, 0):end]
+            entries.reverse()
+        else:
+            entries = view[start:start + page_size]
+        return [entry[-1] for entry in entries]
+    items = iter_sorted_items(container, sort_key, reverse, item_filter)
+    return list(islice(items, start, start + page_size))
+
+
+def count_items(container, item_filter=None):
+    """Returns the number of items in the container
+
+    Args:
+        container: A :class:`fife_rpg.entities.rpg_entity.RPGEntity` with a
+        container component
+
+        item_filter: A function that gets passed an item and returns
+        whether it should be counted. If None all items are counted.
+    """
+    index = get_index(container)
+    if item_filter is None:
+        return len(index.items)
+    return sum(1 for item in index.items if item_filter(item))
@@ -144,6 +144,8 @@ def check_lockable_fifeagent(fifeagent, lockable):
 
         locakbe: A :class:`fife_rpg.components.lockable.Lockable` instance
     """
+    if fifeagent.behaviour is None:
+        return
     if lockable.closed:
         fifeagent.behaviour.act(lockable.closed_action, repeating=True)
     else:
@@ -157,4 +159,8 @@ def register_checkers():
     if FifeAgent.registered_as:
         ComponentManager.register_checker(
             (FifeAgent.registered_as, Lockable.registered_as),
-            check_lockable_fifeagent)
+            check_lockable_fifeagent,
+            {FifeAgent.registered_as: ["behaviour"],
+             Lockable.registered_as: ["closed", "opened_action",
+                                      "closed_action"]},
+            on_enter=True)
@@ -21,12 +21,12 @@
 .. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
 """
 from builtins import object
-import yaml
 
 from fife_rpg.systems import GameVariables
 from fife_rpg import ControllerBase
 from fife_rpg.systems.scriptingsystem import ScriptingSystem
 from fife_rpg.exceptions import NotRegisteredError
+from fife_rpg.helpers import load_yaml
 
 
 class DialogueSection(object):
@@ -225,7 +225,7 @@ class DialogueController(ControllerBase):
         ControllerBase.__init__(self, view, application)
         if isinstance(dialogue, str):
             dialogue_file = self.application.engine.getVFS().open(dialogue)
-            dialogue = yaml.load(dialogue_file)
+            dialogue = load_yaml(dialogue_file)
         if isinstance(dialogue, dict):
             self.dialogue = Dialogue(self.application.world, dialogue)
         else:
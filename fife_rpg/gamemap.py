@@ -24,10 +24,12 @@ from builtins import str
 from builtins import object
 from fife import fife
 from fife.extensions.serializers import xmlanimation
+from xml.etree import cElementTree as etree
 
 from fife_rpg.components.fifeagent import FifeAgent
 from fife_rpg.components.agent import Agent
 from fife_rpg.components.general import General
+from fife_rpg.spatial_index import SpatialGrid, RectGrid
 
 
 class NoSuchRegionError(Exception):
@@ -52,6 +54,47 @@ class NoSuchRegionError(Exception):
                 (self.map, self.region))
 
 
+class AgentInstanceListener(fife.InstanceChangeListener):
+
+    """Reports the fife instances of agents that moved or turned to their
+    map
+
+    Properties:
+        game_map: The :class:`GameMap` of the instances
+    """
+
+    def __init__(self, game_map):
+        fife.InstanceChangeListener.__init__(self)
+        self.game_map = game_map
+
+    def onInstanceChanged(self, instance, info):
+        # pylint: disable=C0103,W0221
+        """Called by FIFE when an instance changed
+
+        Args:
+            instance: The instance that changed
+
+            info: The flags of the changes
+        """
+        if info & (fife.ICHANGE_LOC | fife.ICHANGE_ROTATION):
+            self.game_map.instance_moved(instance)
+
+
+def read_map_id(filename):
+    """Reads the identifier of a map from its file. Only the root element of
+    the file is parsed.
+
+    Args:
+        filename: The path of the map file
+
+    Returns:
+        The identifier of the map
+    """
+    with open(filename, "rb") as map_file:
+        for _, element in etree.iterparse(map_file, events=("start",)):
+            return element.attrib["id"]
+
+
 class GameMap(object):
 
     """Contains the data of a map
@@ -66,7 +109,9 @@ class GameMap(object):
         camera: The name of the default camera
 
         regions: A dictionary that defines specific regions on the fife_map, as
-        :class:`fife.DoubleRect` instances.
+        :class:`fife.DoubleRect` instances. A function that returns the
+        dictionary can be passed instead, it is called the first time the
+        regions are accessed.
 
         is_active: Whether the map is currently active or nor
     """
@@ -74,13 +119,28 @@ class GameMap(object):
     def __init__(self, fife_map_or_filename, view_name, camera, regions,
                  application):
         self.__map = fife_map_or_filename
+        self.__filename = (fife_map_or_filename
+                           if isinstance(fife_map_or_filename, str)
+                           else None)
+        self.__name = None
         self.__camera = camera
+        self.__camera_name = camera
         if self.is_loaded:
             self.__setup_map_data()
         self.__view_name = view_name
         self.__regions = regions
-        self.__entities = {}
+        self.__entities = set()
+        self.__entities_by_identifier = {}
+        self.__entities_map_name = None
+        self.__listening_to_entities = False
         self.__application = application
+        self.__agent_grid = None
+        self.__region_grid = None
+        self.__agent_regions = {}
+        self.__region_states = None
+        self.__moved_agents = set()
+        self.__instance_listener = AgentInstanceListener(self)
+        self.__moved_instances = set()
         if not FifeAgent.registered_as:
             FifeAgent.register()
         if not Agent.registered_as:
@@ -95,11 +155,12 @@ class GameMap(object):
 
     @property
     def name(self):
-        """Returns the internal name of the map"""
+        """Returns the internal name of the map. This is None if the map
+        was never loaded."""
         if self.is_loaded:
             return self.__map.getId()
         else:
-            return None
+            return self.__name
 
     @property
     def view_name(self):
@@ -108,7 +169,10 @@ class GameMap(object):
 
     @property
     def regions(self):
-        """Returns the regions of the map"""
+        """Returns the regions of the map. Use :meth:`set_region` and
+        :meth:`remove_region` to change them."""
+        if callable(self.__regions):
+            self.__regions = self.__regions()
         return self.__regions
 
     @property
@@ -142,10 +206,11 @@ class GameMap(object):
 
             TypeError: If the key is not a string
         """
-        for entity in self.entities:
-            general = getattr(entity, General.registered_as)
-            if general.identifier == name:
-                return entity
+        if self.__entities_map_name is None:
+            self.update_entities()
+        entity = self.__entities_by_identifier.get(name)
+        if entity is not None:
+            return entity
         raise KeyError("The map %s has no entity with the name %s" %
                        (self.name, name))
 
@@ -162,6 +227,310 @@ class GameMap(object):
             layer = self.get_layer(layer)
         return self.camera.getMatchingInstances(point, layer)
 
+    def get_agent_grid(self):
+        """Returns the spatial index of the positions of the agents on the
+        map. The index is built the first time this is called and then
+        kept up to date by listening to changes of the map and position
+        fields of the Agent component.
+
+        Returns:
+            A :class:`fife_rpg.spatial_index.SpatialGrid` with the entities
+            as keys
+        """
+        if self.__agent_grid is None:
+            cell_size = self.__application.settings.get(
+                "fife-rpg", "AgentGridCellSize", 8.0)
+            self.__agent_grid = SpatialGrid(cell_size)
+            agents = getattr(self.__application.world.components,
+                             Agent.registered_as)
+            agents.add_field_listener("map", self.cb_agent_moved)
+            agents.add_field_listener("position", self.cb_agent_moved)
+            agents.add_entity_listener(self.cb_agent_added)
+            agents.add_remove_listener(self.cb_agent_removed)
+            for entity in agents.get_indexed("map", self.name):
+                self.cb_agent_added(entity)
+            if self.__region_states is not None:
+                # Agents may have left the map while there was no index
+                self.__moved_agents.update(self.__region_states)
+        return self.__agent_grid
+
+    def remove_agent_grid(self):
+        """Drops the spatial index of the agents and removes its listeners
+        from the Agent component. The index is built again when it is used
+        the next time."""
+        if self.__agent_grid is None:
+            return
+        agents = getattr(self.__application.world.components,
+                         Agent.registered_as)
+        agents.remove_field_listener("map", self.cb_agent_moved)
+        agents.remove_field_listener("position", self.cb_agent_moved)
+        agents.remove_entity_listener(self.cb_agent_added)
+        agents.remove_remove_listener(self.cb_agent_removed)
+        self.__agent_grid = None
+        self.__agent_regions.clear()
+        self.__moved_agents = set()
+
+    def remove_listeners(self):
+        """Removes the listeners the map added to the components, which are
+        shared by all maps and worlds. Called when the map is unloaded or
+        replaced."""
+        self.remove_agent_grid()
+        if self.__listening_to_entities:
+            components = self.__application.world.components
+            agents = getattr(components, Agent.registered_as)
+            agents.remove_field_listener("map", self.cb_agent_map_changed)
+            agents.remove_entity_listener(self.cb_agent_set)
+            agents.remove_remove_listener(self.cb_agent_unset)
+            getattr(components, General.registered_as).remove_field_listener(
+                "identifier", self.cb_identifier_changed)
+            self.__listening_to_entities = False
+            self.__entities_map_name = None
+
+    def cb_agent_added(self, entity):
+        """Called when an entity was added to the Agent component
+
+        Args:
+            entity: The entity
+        """
+        self.__agent_regions.pop(entity, None)
+        self.__moved_agents.add(entity)
+        agent = getattr(self.__application.world.components,
+                        Agent.registered_as)[entity]
+        if agent.map == self.name:
+            position = agent.position
+            self.__agent_grid.insert(entity, position.x, position.y)
+        else:
+            self.__agent_grid.remove(entity)
+
+    def cb_agent_moved(self, entity, field_name, old_value, new_value):
+        """Called when the map or the position of an agent changed
+
+        Args:
+            entity: The entity whose data changed
+
+            field_name: The name of the field
+
+            old_value: The value the field had before
+
+            new_value: The value the field has now
+        """
+        if field_name == "map" or entity in self.__agent_grid:
+            self.cb_agent_added(entity)
+        else:
+            self.__agent_regions.pop(entity, None)
+
+    def cb_agent_removed(self, entity):
+        """Called when an entity was removed from the Agent component
+
+        Args:
+            entity: The entity
+        """
+        self.__agent_grid.remove(entity)
+        self.__agent_regions.pop(entity, None)
+        self.__moved_agents.add(entity)
+
+    @staticmethod
+    def __get_coordinates(location):
+        """Returns the x and y coordinates of a point, or a tuple or list"""
+        if isinstance(location, (tuple, list)):
+            return location[0], location[1]
+        return location.x, location.y
+
+    def get_agents_in_radius(self, location, radius):
+        """Returns the entities of the agents within a distance of a point
+
+        Args:
+            location: A fife.DoublePoint instance or a tuple with 2 elements
+
+            radius: The maximum distance
+
+        Returns:
+            A list of the entities
+        """
+        x_pos, y_pos = self.__get_coordinates(location)
+        return self.get_agent_grid().query_radius(x_pos, y_pos, radius)
+
+    def get_agents_in_rect(self, rect):
+        """Returns the entities of the agents inside a rectangle
+
+        Args:
+            rect: A fife.DoubleRect instance or a tuple with x, y, width
+            and height
+
+        Returns:
+            A list of the entities
+        """
+        if isinstance(rect, (tuple, list)):
+            x_pos, y_pos, width, height = rect
+        else:
+            x_pos, y_pos, width, height = rect.x, rect.y, rect.w, rect.h
+        return self.get_agent_grid().query_rect(x_pos, y_pos, width, height)
+
+    def get_nearest_agents(self, location, count, max_distance=None):
+        """Returns the entities of the agents nearest to a point
+
+        Args:
+            location: A fife.DoublePoint instance or a tuple with 2 elements
+
+            count: The maximum number of entities to return
+
+            max_distance: If not None only agents up to this distance are
+            returned
+
+        Returns:
+            A list of the entities, sorted by distance
+        """
+        x_pos, y_pos = self.__get_coordinates(location)
+        return self.get_agent_grid().nearest(x_pos, y_pos, count,
+                                             max_distance)
+
+    def get_region_grid(self):
+        """Returns the spatial index of the regions of the map. The index is
+        built the first time this is called.
+
+        Returns:
+            A :class:`fife_rpg.spatial_index.RectGrid` with the names of the
+            regions as keys
+        """
+        if self.__region_grid is None:
+            cell_size = self.__application.settings.get(
+                "fife-rpg", "RegionGridCellSize", 16.0)
+            self.__region_grid = RectGrid(cell_size)
+            for name, rect in self.regions.items():
+                self.__region_grid.insert(name, rect.x, rect.y, rect.w,
+                                          rect.h)
+        return self.__region_grid
+
+    def set_region(self, name, rect):
+        """Adds a region to the map or replaces an existing one
+
+        Args:
+            name: The name of the region
+
+            rect: A fife.DoubleRect instance
+        """
+        self.regions[name] = rect
+        if self.__region_grid is not None:
+            self.__region_grid.insert(name, rect.x, rect.y, rect.w, rect.h)
+        self.__regions_changed()
+
+    def remove_region(self, name):
+        """Removes a region from the map
+
+        Args:
+            name: The name of the region
+
+        Raises:
+            :class:`fife_rpg.map.NoSuchRegionError` if the specified region
+            does not exist.
+        """
+        if name not in self.regions:
+            raise NoSuchRegionError(self.name, name)
+        del self.regions[name]
+        if self.__region_grid is not None:
+            self.__region_grid.remove(name)
+        self.__regions_changed()
+
+    def __regions_changed(self):
+        """Clears the cached regions of the agents after the regions of
+        the map changed"""
+        self.__agent_regions.clear()
+        if self.__agent_grid is not None:
+            self.__moved_agents.update(self.__agent_grid)
+
+    def get_regions_at(self, location):
+        """Returns the names of the regions that contain a point
+
+        Args:
+            location: A fife.DoublePoint instance or a tuple with 2 elements
+
+        Returns:
+            A list of the names of the regions
+        """
+        x_pos, y_pos = self.__get_coordinates(location)
+        point = fife.DoublePoint(x_pos, y_pos)
+        return [name for name in self.get_region_grid().query_point(x_pos,
+                                                                   y_pos)
+                if self.regions[name].contains(point)]
+
+    def get_agent_regions(self, entity):
+        """Returns the names of the regions of the map that contain the
+        position of an agent. The result is cached until the agent moves.
+
+        Args:
+            entity: The entity of the agent
+
+        Returns:
+            A frozenset of the names of the regions
+        """
+        self.get_agent_grid()
+        regions = self.__agent_regions.get(entity)
+        if regions is None:
+            agent = getattr(entity, Agent.registered_as)
+            regions = frozenset(self.get_regions_at(agent.position))
+            self.__agent_regions[entity] = regions
+        return regions
+
+    def update_region_states(self):
+        """Updates which regions the agents on the map are in. Only the
+        agents that moved, left or entered the map since the last call are
+        checked. On the first call all agents on the map are checked.
+
+        Returns:
+            A list of tuples with the identifier of an agent, a frozenset of
+            the names of the regions it entered and a frozenset of the names
+            of the regions it exited
+        """
+        grid = self.get_agent_grid()
+        if self.__region_states is None:
+            self.__region_states = {}
+            self.__moved_agents.update(grid)
+        moved_agents = self.__moved_agents
+        self.__moved_agents = set()
+        states = self.__region_states
+        changes = []
+        for entity in moved_agents:
+            identifier, old_regions = states.get(entity, (None, frozenset()))
+            if entity in grid:
+                new_regions = self.get_agent_regions(entity)
+            else:
+                new_regions = frozenset()
+            if new_regions:
+                if identifier is None:
+                    identifier = getattr(entity,
+                                         General.registered_as).identifier
+                states[entity] = (identifier, new_regions)
+            else:
+                states.pop(entity, None)
+            if old_regions != new_regions:
+                changes.append((identifier, new_regions - old_regions,
+                                old_regions - new_regions))
+        return changes
+
+    def get_agents_in_region(self, region):
+        """Returns the entities of the agents on the map that are inside a
+        region
+
+        Args:
+            region: The name of the region
+
+        Returns:
+            A list of the entities
+
+        Raises:
+            :class:`fife_rpg.map.NoSuchRegionError` if the specified region
+            does not exist.
+        """
+        if region not in self.regions:
+            raise NoSuchRegionError(self.name, region)
+        rect = self.regions[region]
+        grid = self.get_agent_grid()
+        found = []
+        for entity in grid.query_rect(rect.x, rect.y, rect.w, rect.h):
+            if rect.contains(fife.DoublePoint(*grid.get_position(entity))):
+                found.append(entity)
+        return found
+
     def is_in_region(self, location, region):
         """Checks if a given point is inside the given region
 
@@ -183,6 +552,7 @@ class GameMap(object):
 
     def __setup_map_data(self):
         """Sets up the map data after the map was loaded"""
+        self.__name = self.__map.getId()
         self.__camera = self.__map.getCamera(self.__camera)
         cameras = self.__map.getCameras()
         for camera in cameras:
@@ -193,64 +563,263 @@ class GameMap(object):
         self.__application.world.add_entity_delete_callback(
             self.cb_entity_delete)
         if not self.is_loaded:
-            engine = self.__application.engine
-            loader = fife.MapLoader(engine.getModel(),
-                                    engine.getVFS(),
-                                    engine.getImageManager(),
-                                    engine.getRenderBackend())
-
-            if loader.isLoadable(self.__map):
-                self.__map = loader.load(self.__map)
-                self.__setup_map_data()
-            else:
-                raise RuntimeError("Can't load mapfile %s" % str(self.__map))
-            self.update_entities()
-            self.__application.map_loded(self.__map.getId())
+            self.load()
         else:
             self.__application.update_agents(self.__map.getId())
         self.camera.setEnabled(True)
 
+    def load(self):
+        """Loads the map, if it is not loaded yet, without activating it
+
+        Raises:
+            RuntimeError: If the map file can't be loaded
+        """
+        if self.is_loaded:
+            return
+        engine = self.__application.engine
+        loader = fife.MapLoader(engine.getModel(),
+                                engine.getVFS(),
+                                engine.getImageManager(),
+                                engine.getRenderBackend())
+
+        if loader.isLoadable(self.__map):
+            self.__map = loader.load(self.__map)
+            self.__setup_map_data()
+        else:
+            raise RuntimeError("Can't load mapfile %s" % str(self.__map))
+        self.update_entities()
+        self.__application.map_loded(self.__map.getId())
+
+    def import_object_file(self, filename):
+        """Imports an object file of the map into the model, without loading
+        the map. The objects are skipped by fife when the map is loaded
+        later.
+
+        Args:
+            filename: The path of the object file
+        """
+        engine = self.__application.engine
+        loader = fife.MapLoader(engine.getModel(),
+                                engine.getVFS(),
+                                engine.getImageManager(),
+                                engine.getRenderBackend())
+        loader.loadImportFile(filename)
+
+    def unload(self):
+        """Unloads the map, so that it is loaded again when it is activated.
+        The positions and rotations of the agents on the map are written
+        back to their Agent components first.
+
+        Raises:
+            RuntimeError: If the map is active
+        """
+        if not self.is_loaded:
+            return
+        if self.is_active:
+            raise RuntimeError("The active map %s can't be unloaded" %
+                               self.name)
+        for entity in self.entities:
+            fifeagent = getattr(entity, FifeAgent.registered_as)
+            if not fifeagent:
+                continue
+            if fifeagent.behaviour is not None:
+                agent = getattr(entity, Agent.registered_as)
+                location = fifeagent.behaviour.location
+                agent.position = (location.x, location.y, location.z)
+                agent.rotation = fifeagent.behaviour.rotation
+            fifeagent.layer = None
+            fifeagent.behaviour = None
+            fifeagent.instance = None
+        self.remove_listeners()
+        self.__entities = set()
+        self.__entities_by_identifier = {}
+        self.__entities_map_name = None
+        self.__moved_instances = set()
+        self.__name = self.__map.getId()
+        filename = self.__filename or self.__map.getFilename()
+        self.__application.engine.getModel().deleteMap(self.__map)
+        self.__map = filename
+        self.__camera = self.__camera_name
+
     def deactivate(self):
         """Deactivates the map"""
         self.camera.setEnabled(False)
 
     def update_entities(self):
-        """Update the maps entites from the entities of the world
+        """Update the maps entites from the entities of the world. After the
+        first call the entities are kept up to date by listening to changes
+        of the Agent and General components, so later calls do nothing
+        unless the map was unloaded or its listeners were removed.
+        """
+        name = self.name
+        if name is not None and name == self.__entities_map_name:
+            return
+        components = self.__application.world.components
+        agents = getattr(components, Agent.registered_as)
+        if not self.__listening_to_entities:
+            agents.add_field_listener("map", self.cb_agent_map_changed)
+            agents.add_entity_listener(self.cb_agent_set)
+            agents.add_remove_listener(self.cb_agent_unset)
+            getattr(components, General.registered_as).add_field_listener(
+                "identifier", self.cb_identifier_changed)
+            self.__listening_to_entities = True
+        self.__entities = agents.get_indexed("map", name)
+        self.__entities_by_identifier = dict(
+            (getattr(entity, General.registered_as).identifier, entity)
+            for entity in self.__entities)
+        self.__entities_map_name = name
+
+    def __add_entity(self, entity):
+        """Adds an entity to the entities of the map"""
+        self.__entities.add(entity)
+        identifier = getattr(entity, General.registered_as).identifier
+        self.__entities_by_identifier[identifier] = entity
+
+    def __discard_entity(self, entity):
+        """Removes an entity from the entities of the map, if it is on it"""
+        if entity not in self.__entities:
+            return
+        self.__entities.discard(entity)
+        identifier = getattr(entity, General.registered_as).identifier
+        if self.__entities_by_identifier.get(identifier) is entity:
+            del self.__entities_by_identifier[identifier]
+
+    def cb_agent_map_changed(self, entity, field_name, old_value, new_value):
+        """Called when the map of an agent changed
+
+        Args:
+            entity: The entity whose data changed
+
+            field_name: The name of the field
+
+            old_value: The value the field had before
+
+            new_value: The value the field has now
+        """
+        if self.__entities_map_name is None:
+            return
+        if new_value == self.__entities_map_name:
+            self.__add_entity(entity)
+        else:
+            self.__discard_entity(entity)
+
+    def cb_agent_set(self, entity):
+        """Called when the Agent of an entity was added or replaced
+
+        Args:
+            entity: The entity
+        """
+        if self.__entities_map_name is None:
+            return
+        agent = getattr(self.__application.world.components,
+                        Agent.registered_as)[entity]
+        if agent.map == self.__entities_map_name:
+            self.__add_entity(entity)
+        else:
+            self.__discard_entity(entity)
+
+    def cb_agent_unset(self, entity):
+        """Called before the Agent of an entity is removed or replaced
+
+        Args:
+            entity: The entity
         """
-        extent = self.__application.world[...]
-        self.__entities = getattr(extent,
-                                  Agent.registered_as).map == self.name
+        self.__discard_entity(entity)
 
-    def update_entities_fife(self):
-        """Updates the fife instances to the values of the agent"""
-        old_entities = self.entities.copy()
-        for entity in old_entities:
+    def cb_identifier_changed(self, entity, field_name, old_value,
+                              new_value):
+        """Called when the identifier of an entity changed
+
+        Args:
+            entity: The entity whose data changed
+
+            field_name: The name of the field
+
+            old_value: The value the field had before
+
+            new_value: The value the field has now
+        """
+        if entity not in self.__entities:
+            return
+        if self.__entities_by_identifier.get(old_value) is entity:
+            del self.__entities_by_identifier[old_value]
+        self.__entities_by_identifier[new_value] = entity
+
+    def update_entities_fife(self, entities=None):
+        """Updates the fife instances to the values of the agent
+
+        Args:
+            entities: The entities to update. If None all entities of the
+            map will be updated.
+        """
+        if entities is None:
+            entities = self.entities.copy()
+        else:
+            entities = self.entities & set(entities)
+        for entity in entities:
             fifeagent = getattr(entity, FifeAgent.registered_as)
-            if fifeagent:
+            if fifeagent and fifeagent.instance:
                 agent = getattr(entity, Agent.registered_as)
                 if agent.new_map is not None and agent.new_map != self.name:
                     self.remove_entity(str(entity.identifier))
+                    agent.map = agent.new_map
+                    agent.layer = agent.new_layer or agent.layer
+                    agent.position = agent.new_position or agent.position
+                    if agent.new_rotation is not None:
+                        agent.rotation = agent.new_rotation
+                    agent.new_map = None
+                    agent.new_layer = None
+                    agent.new_position = None
+                    agent.new_rotation = None
                     continue
                 location = fifeagent.instance.getLocation()
                 if agent.new_layer is not None:
+                    agent.layer = agent.new_layer
                     location.setLayer(self.get_layer(agent.layer))
                 if agent.new_position is not None:
+                    agent.position = agent.new_position
                     location.setExactLayerCoordinates(
                         fife.ExactModelCoordinate(
                             *agent.new_position))
                 fifeagent.instance.setLocation(location)
                 if agent.new_rotation is not None:
+                    agent.rotation = agent.new_rotation
                     fifeagent.instance.setRotation(agent.rotation)
                 agent.new_map = None
                 agent.new_layer = None
                 agent.new_position = None
                 agent.new_rotation = None
 
+    def watch_instance(self, instance):
+        """Starts reporting the moves and turns of the fife instance of an
+        entity of the map to update_entitities_agent
+
+        Args:
+            instance: The fife.Instance of the entity
+        """
+        instance.addChangeListener(self.__instance_listener)
+
+    def instance_moved(self, instance):
+        """Queues the entity of a fife instance that moved or turned for the
+        next call of update_entitities_agent
+
+        Args:
+            instance: The fife.Instance of the entity
+        """
+        entity = self.__entities_by_identifier.get(instance.getId())
+        if entity is not None:
+            self.__moved_instances.add(entity)
+
     def update_entitities_agent(self):
-        """Update the values of the agent component of the maps entities"""
-        for entity in self.entities:
+        """Update the values of the agent component of the maps entities
+        whose fife instances moved or turned since the last call"""
+        moved_instances = self.__moved_instances
+        self.__moved_instances = set()
+        for entity in moved_instances:
+            if entity not in self.__entities:
+                continue
             fifeagent = getattr(entity, FifeAgent.registered_as)
-            if fifeagent:
+            if fifeagent and fifeagent.behaviour is not None:
                 agent = getattr(entity, Agent.registered_as)
                 location = fifeagent.behaviour.location
                 agent.position = (location.x, location.y, location.z)
@@ -277,7 +846,7 @@ class GameMap(object):
             fifeagent.behaviour = None
             agent = getattr(entity, Agent.registered_as)
             agent.map = ""
-            self.update_entities()
+            self.__discard_entity(entity)
         except KeyError as error:
             raise error
 
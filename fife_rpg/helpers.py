@@ -20,10 +20,21 @@
 .. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
 """
 
+import os
+
 import yaml
 
 from fife.fife import DoublePoint, DoublePoint3D
 
+from fife_rpg.startup_profiler import count
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+    from yaml import CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+    from yaml import SafeDumper as YamlDumper
+
 
 class ClassProperty(property):
 
@@ -43,6 +54,53 @@ class Enum(set):
         raise AttributeError
 
 
+class VersionedDict(dict):
+
+    """A dictionary that counts the changes made to it
+
+    Properties:
+        version: Increased on every change of the dictionary
+    """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.version += 1
+
+    def clear(self):
+        dict.clear(self)
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.version += 1
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.version += 1
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version += 1
+
+
+def versioned_dict_representer(dumper, data):
+    """Represent a VersionedDict as a normal mapping"""
+    return dumper.represent_dict(dict(data))
+
+
 class DoublePointYaml(DoublePoint):
 
     """fife.DoublePoint that can be dumped by yaml"""
@@ -153,15 +211,117 @@ def double_point_3d_constructor(loader, node):
                              float(z_pos))
 
 
-class FRPGDumper(yaml.SafeDumper):
+class FRPGDumper(YamlDumper):
 
     """Normal dumper with changes to save save the file in a specific style"""
 
     def represent_mapping(self, tag, mapping, flow_style=False):
-        return yaml.SafeDumper.represent_mapping(self, tag, mapping,
-                                                 flow_style)
+        return YamlDumper.represent_mapping(self, tag, mapping, flow_style)
+
+
+def add_yaml_constructor(tag, constructor):
+    """Adds a constructor for a tag to the loaders used by fife-rpg
+
+    Args:
+        tag: The yaml tag
+
+        constructor: Function that constructs the object from a yaml node
+    """
+    for loader in set((YamlLoader, yaml.SafeLoader)):
+        yaml.add_constructor(tag, constructor, loader)
+
+
+def add_yaml_representer(data_type, representer):
+    """Adds a representer for a type to the dumpers used by fife-rpg
+
+    Args:
+        data_type: The type of the objects to represent
+
+        representer: Function that represents the object as a yaml node
+    """
+    for dumper in set((YamlDumper, yaml.SafeDumper)):
+        yaml.add_representer(data_type, representer, dumper)
+
+
+def load_yaml(stream):
+    """Loads the first document of a yaml stream
+
+    The libyaml based loader is used if it is available.
+
+    Args:
+        stream: A string or file like object
+
+    Returns:
+        The loaded document
+    """
+    count("yaml_documents")
+    return yaml.load(stream, Loader=YamlLoader)
+
+
+def dump_yaml(data, stream=None):
+    """Dumps data as a yaml document
+
+    The libyaml based dumper is used if it is available.
+
+    Args:
+        data: The data to dump
+
+        stream: A file like object. If None the document is returned as a
+        string.
+    """
+    return yaml.dump(data, stream, Dumper=YamlDumper)
+
+
+def load_all_yaml(stream):
+    """Loads all documents of a yaml stream
+
+    The libyaml based loader is used if it is available.
+
+    Args:
+        stream: A string or file like object
+
+    Returns:
+        A generator that yields the loaded documents
+    """
+    for document in yaml.load_all(stream, Loader=YamlLoader):
+        count("yaml_documents")
+        yield document
 
 
 def dump_entities(entities, stream=None):
     """Dump entities in the preferred FifeRGP style"""
     return yaml.dump_all(entities, stream, Dumper=FRPGDumper, indent=4)
+
+
+def get_memory_usage():
+    """Returns the resident memory of the process
+
+    Returns:
+        The size in bytes, or None if it can't be determined on this system
+    """
+    try:
+        with open("/proc/self/statm") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def replace_file(source, destination):
+    """Renames a file, replacing the destination if it exists. On POSIX
+    systems the destination is replaced atomically. Python 2 has no
+    os.replace and os.rename can't replace files on Windows there, so the
+    destination is removed first on that combination.
+
+    Args:
+        source: The path of the file to rename
+
+        destination: The new path of the file
+    """
+    replace = getattr(os, "replace", None)
+    if replace is not None:
+        replace(source, destination)
+        return
+    if os.name == "nt" and os.path.exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
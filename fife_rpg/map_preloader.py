@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Prepares maps before they are switched to
+
+The map files and the object files they import are read in a background
+thread, which also collects the object files from the imports of the map.
+The fife.MapLoader is not thread safe, so the objects are imported into the
+model on the main thread, one file at a time and only as many files per step
+as fit into the frame budget. The map itself is loaded by fife in a single
+call that can't be split, so that is left to the map switch, which then
+skips the objects that were already imported.
+
+.. module:: map_preloader
+    :synopsis: Prepares maps before they are switched to
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from builtins import object
+import os
+import threading
+import time
+from queue import Empty, Queue
+from xml.etree import cElementTree as etree
+
+
+def read_map_files(filename):
+    """Reads a map file and the files and directories it imports, so that
+    they are in the cache of the operating system when they are loaded
+
+    Args:
+        filename: The path of the map file
+
+    Returns:
+        A list with the paths of the imported object files
+    """
+    directory = os.path.dirname(filename)
+    with open(filename, "rb") as map_file:
+        root = etree.fromstring(map_file.read())
+    import_files = []
+    for element in root.iter("import"):
+        path = element.attrib.get("file") or element.attrib.get("dir")
+        if not path:
+            continue
+        path = os.path.join(directory, path)
+        if os.path.isdir(path):
+            files = [os.path.join(path, name)
+                     for name in sorted(os.listdir(path))]
+        else:
+            files = [path]
+        for import_filename in files:
+            if not os.path.isfile(import_filename):
+                continue
+            with open(import_filename, "rb") as import_file:
+                import_file.read()
+            import_files.append(import_filename)
+    return import_files
+
+
+class MapPreloadThread(threading.Thread):
+
+    """Thread that reads the files of the requested maps
+
+    Properties:
+        requests: Queue of the names and filenames of the maps to read
+
+        events: Queue with the names of the maps that were read, the paths
+        of their object files and the raised exception or None
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="MapPreload")
+        self.daemon = True
+        self.requests = Queue()
+        self.events = Queue()
+
+    def run(self):
+        while True:
+            name, filename = self.requests.get()
+            try:
+                import_files = read_map_files(filename)
+            except Exception as error:  # pylint: disable=broad-except
+                self.events.put((name, [], error))
+            else:
+                self.events.put((name, import_files, None))
+
+
+class MapPreloader(object):
+
+    """Reads maps in the background and imports their objects during the
+    steps of the application
+
+    Properties:
+        application: The :class:`fife_rpg.rpg_application.RPGApplication`
+        that owns the maps
+
+        pending: The names of the maps that were requested and whose objects
+        are not imported yet
+
+        frame_budget: If not None, the objects of the maps are only imported
+        for this many seconds per step. At least one object file is
+        imported per step, as a single file can't be split.
+    """
+
+    def __init__(self, application, frame_budget=None):
+        self.application = application
+        self.pending = set()
+        self.frame_budget = frame_budget
+        self.__ready = []
+        self.__import_files = {}
+        self.__preloaded = set()
+        self.__thread = None
+
+    @property
+    def ready(self):
+        """Returns the names of the maps whose files were read and whose
+        objects wait to be imported"""
+        return list(self.__ready)
+
+    def is_preloaded(self, name):
+        """Returns whether the objects of a map are imported or the map is
+        loaded
+
+        Args:
+            name: The name of the map
+        """
+        return (name in self.__preloaded or
+                self.application.maps[name].is_loaded)
+
+    def request(self, name):
+        """Requests a map to be preloaded. Does nothing if the map is
+        already preloaded or requested.
+
+        Args:
+            name: The name of the map
+
+        Raises:
+            LookupError: If there is no map with that name
+        """
+        maps = self.application.maps
+        if name not in maps:
+            raise LookupError("The map with the name '%s' cannot be found"
+                              % (name))
+        if name in self.pending or self.is_preloaded(name):
+            return
+        self.pending.add(name)
+        if self.__thread is None:
+            self.__thread = MapPreloadThread()
+            self.__thread.start()
+        self.__thread.requests.put((name, maps[name].fife_map))
+
+    def cancel(self, name):
+        """Removes a map from the pending maps
+
+        Args:
+            name: The name of the map
+        """
+        self.pending.discard(name)
+        self.__import_files.pop(name, None)
+        if name in self.__ready:
+            self.__ready.remove(name)
+
+    def step(self, can_load=True):
+        """Imports the object files of the next map whose files were read,
+        if there is one and loading is allowed in this step, until the frame
+        budget is used up
+
+        Args:
+            can_load: Whether objects may be imported in this step. The
+            application passes False while the player is not idle.
+
+        Returns:
+            The name of the map whose objects were all imported in this
+            step, or None
+        """
+        if self.__thread is not None:
+            while True:
+                try:
+                    name, import_files, error = (
+                        self.__thread.events.get_nowait())
+                except Empty:
+                    break
+                if error is not None:
+                    # fife reports the actual error when the map is loaded
+                    self.pending.discard(name)
+                elif name in self.pending:
+                    self.__import_files[name] = import_files
+                    self.__ready.append(name)
+        if not can_load or not self.__ready:
+            return None
+        name = self.__ready[0]
+        import_files = self.__import_files[name]
+        game_map = self.application.maps.get(name)
+        if game_map is not None and not game_map.is_loaded:
+            start = time.time()
+            while import_files:
+                try:
+                    game_map.import_object_file(import_files.pop(0))
+                except RuntimeError:
+                    # The error is raised again when the map is loaded
+                    pass
+                if (import_files and self.frame_budget is not None and
+                        time.time() - start >= self.frame_budget):
+                    return None
+        self.cancel(name)
+        if game_map is None:
+            return None
+        self.__preloaded.add(name)
+        return name
@@ -21,27 +21,41 @@
 """
 
 from past.builtins import basestring
+from collections import OrderedDict
 from copy import copy
+from functools import partial
 import gettext
 import imp
+import math
 import os
+import time
 
 from bGrease.grease_fife.mode import FifeManager
 from fife import fife
 from fife.extensions.basicapplication import ApplicationBase
-from fife_rpg import GameMap
-from fife_rpg.behaviours import BehaviourManager
+from fife_rpg import GameMap, NoSuchRegionError
+from fife_rpg.gamemap import read_map_id
+from fife_rpg.behaviours import AGENT_STATES, BehaviourManager
 from fife_rpg.components.agent import Agent, STACK_POSITION
 from fife_rpg.components.fifeagent import FifeAgent, setup_behaviour
 from fife_rpg.components.general import General
+from fife_rpg.components.move_agent import MoveAgent
 from fife_rpg.exceptions import AlreadyRegisteredError
+from fife_rpg.helpers import (dump_yaml, get_memory_usage, load_yaml,
+                              load_all_yaml)
+from fife_rpg.map_preloader import MapPreloader
+from fife_rpg.startup_manifest import StartupManifest
+from fife_rpg import startup_profiler
+from fife_rpg.startup_profiler import StartupProfiler, startup_phase
 from fife_rpg.systems import GameVariables
 from fife_rpg.systems.scriptingsystem import ScriptingSystem
 from fife_rpg.world import RPGWorld
-import yaml
-from xml.etree import cElementTree as etree
 
 _SCRIPTING_MODULE = "application"
+_WATCHED_AGENT_FIELDS = ("map", "new_map", "new_layer", "new_position",
+                         "new_rotation", "gfx", "namespace")
+_DEFAULT_PRELOAD_DISTANCE = 20.0
+_DEFAULT_PRELOAD_FRAME_BUDGET = 5
 
 
 class KeyFilter(fife.IKeyFilter):
@@ -101,7 +115,12 @@ class RPGApplication(FifeManager, ApplicationBase):
         Args:
             TDS: A fife_settings.Setting instance
         """
-        ApplicationBase.__init__(self, TDS)
+        self.startup_profiler = None
+        if TDS.get("fife-rpg", "ProfileStartup", False):
+            self.startup_profiler = StartupProfiler()
+            self.startup_profiler.start()
+        with startup_profiler.phase("init_engine"):
+            ApplicationBase.__init__(self, TDS)
         FifeManager.__init__(self)
         self.name = self.settings.get("fife-rpg", "ProjectName")
         if self.name is None:
@@ -119,14 +138,33 @@ class RPGApplication(FifeManager, ApplicationBase):
         self._behaviours = {}
         self._map_switched_callbacks = []
         self._map_loaded_callbacks = []
+        self._region_entered_callbacks = []
+        self._region_exited_callbacks = []
+        self._changed_agents = set()
+        self._applying_agent_changes = False
+        frame_budget = self.settings.get("fife-rpg", "PreloadFrameBudget",
+                                         _DEFAULT_PRELOAD_FRAME_BUDGET)
+        self._map_preloader = MapPreloader(self,
+                                           frame_budget / 1000.0 or None)
+        self._preload_agent = None
+        self._preload_distance = None
+        self._preload_cell = None
+        self._move_agents_changed = False
+        self._loaded_maps = OrderedDict()
+        manifest_filename = self.settings.get("fife-rpg", "StartupManifest",
+                                              None)
+        self._startup_manifest = (StartupManifest(manifest_filename,
+                                                  self.read_file)
+                                  if manifest_filename else None)
+        self._startup_manifest_pending = self._startup_manifest is not None
+        self._scripting_module = imp.new_module(_SCRIPTING_MODULE)
         default_language = self.settings.get("i18n", "DefaultLanguage", "en")
         languages_dir = self.settings.get("i18n", "Directory", "__languages")
-        for language in self.settings.get("i18n", "Languages", ("en",)):
-            fallback = (language == default_language)
-            self._languages[language] = gettext.translation(self.name,
-                                                            languages_dir,
-                                                            [language],
-                                                            fallback=fallback)
+        with startup_profiler.phase("load_translations"):
+            for language in self.settings.get("i18n", "Languages", ("en",)):
+                fallback = (language == default_language)
+                self._languages[language] = gettext.translation(
+                    self.name, languages_dir, [language], fallback=fallback)
         language = self.settings.get("i18n", "Language", default_language)
         self.switch_language(language)
 
@@ -209,7 +247,7 @@ class RPGApplication(FifeManager, ApplicationBase):
             globals: The globals dictionary of the GameEnvironment that is
             filled by the GameScene
         """
-        app_module = imp.new_module(_SCRIPTING_MODULE)
+        app_module = self._scripting_module
         app_module.__dict__["current_map"] = self.current_map
         app_module.__dict__["maps"] = self.maps
         variables[_SCRIPTING_MODULE] = app_module
@@ -227,11 +265,14 @@ class RPGApplication(FifeManager, ApplicationBase):
         else:
             raise AlreadyRegisteredError(identifier, "Map")
 
-    def update_agents(self, game_map):
+    def update_agents(self, game_map, entities=None):
         """Updates the map to be in sync with the entities
 
         Args:
             game_map: The name of the map, or a Map instance
+
+            entities: The entities to update. If None all entities of the map
+            will be updated.
         """
         if isinstance(game_map, str):
             game_map = self.maps[game_map]
@@ -241,7 +282,11 @@ class RPGApplication(FifeManager, ApplicationBase):
                                              "fife-rpg")
         fife_model = self.engine.getModel()
         game_map.update_entities()
-        for entity in game_map.entities:
+        if entities is None:
+            entities = game_map.entities
+        else:
+            entities = game_map.entities & set(entities)
+        for entity in entities:
             agent = getattr(entity, Agent.registered_as)
             namespace = agent.namespace or object_namespace
             map_object = fife_model.getObject(agent.gfx, namespace)
@@ -284,6 +329,7 @@ class RPGApplication(FifeManager, ApplicationBase):
                 fifeagent.instance = fife_instance
                 setup_behaviour(fifeagent)
                 fifeagent.behaviour.idle()
+                game_map.watch_instance(fife_instance)
             else:
                 visual = fife_instance.get2dGfxVisual()
             visual.setStackPosition(STACK_POSITION[agent.type])
@@ -296,6 +342,8 @@ class RPGApplication(FifeManager, ApplicationBase):
         """
         if identifier in self._maps:
             game_map = self.maps[identifier]
+            self._loaded_maps.pop(identifier, None)
+            self._loaded_maps[identifier] = time.time()
             for callback in self._map_loaded_callbacks:
                 callback(game_map)
             self.update_agents(game_map)
@@ -321,14 +369,171 @@ class RPGApplication(FifeManager, ApplicationBase):
                 callback(old_map, name)
             return
         if name in self._maps:
+            self._map_preloader.cancel(name)
             self._current_map = self.maps[name]
             self._current_map.activate()
+            self._loaded_maps.pop(name, None)
+            self._loaded_maps[name] = time.time()
             for callback in self._map_switched_callbacks:
                 callback(old_map, name)
+            self.unload_unused_maps()
+            if self.settings.get("fife-rpg", "PreloadMaps", False):
+                self._preload_agent = self.settings.get(
+                    "fife-rpg", "PreloadAgent", None)
+                self._preload_distance = self.settings.get(
+                    "fife-rpg", "PreloadDistance", _DEFAULT_PRELOAD_DISTANCE)
+                self.preload_predicted_maps()
         else:
             raise LookupError("The map with the name '%s' cannot be found"
                               % (name))
 
+    def preload_map(self, name):
+        """Requests a map to be prepared in the background, so that
+        switching to it is fast. Does nothing if the map is already loaded.
+
+        The files of the map are read in the background. Its objects are
+        then imported while the agent of the "PreloadAgent" setting is idle,
+        for at most the "PreloadFrameBudget" setting in milliseconds per
+        step, 5 by default, or without a limit if that is 0. The map itself
+        is only loaded when it is switched to.
+
+        Args:
+            name: The name of the map
+
+        Raises:
+            LookupError: If there is no map with that name
+        """
+        self._map_preloader.request(name)
+
+    def predict_map_transitions(self, agent_name=None, distance=None):
+        """Returns the names of the maps that the MoveAgent entities of the
+        current map lead to
+
+        Args:
+            agent_name: If not None the maps are sorted by the distance of
+            their MoveAgent entity to this agent
+
+            distance: If not None and an agent is given only MoveAgent
+            entities up to this distance from the agent are considered
+
+        Returns:
+            A list of the names of the maps
+        """
+        game_map = self.current_map
+        if game_map is None or not MoveAgent.registered_as:
+            return []
+        move_agents = getattr(self.world.components, MoveAgent.registered_as)
+        if agent_name is None:
+            entities = game_map.entities
+        else:
+            entity = self.world.get_entity(agent_name)
+            if entity is None:
+                return []
+            location = getattr(entity, Agent.registered_as).position
+            entities = game_map.get_nearest_agents(
+                location, len(game_map.get_agent_grid()), distance)
+        names = []
+        for entity in entities:
+            if entity not in move_agents:
+                continue
+            target_map = move_agents[entity].target_map
+            if (target_map and target_map != game_map.name and
+                    target_map in self.maps and target_map not in names):
+                names.append(target_map)
+        return names
+
+    def preload_predicted_maps(self):
+        """Requests the maps returned by :meth:`predict_map_transitions` to
+        be preloaded. The agent and distance are taken from the
+        "PreloadAgent" and "PreloadDistance" settings. The distance defaults
+        to 20, so only the MoveAgent entities near the agent are checked."""
+        self._preload_cell = self.get_preload_agent_cell()
+        self._move_agents_changed = False
+        for name in self.predict_map_transitions(self._preload_agent,
+                                                 self._preload_distance):
+            self.preload_map(name)
+
+    def get_preload_agent_cell(self):
+        """Returns the cell of the agent grid of the current map that the
+        agent of the "PreloadAgent" setting is in
+
+        Returns:
+            A tuple with the column and row of the cell, or None if there is
+            no current map or no such agent
+        """
+        if self.current_map is None or self._preload_agent is None:
+            return None
+        entity = self.world.get_entity(self._preload_agent)
+        if entity is None:
+            return None
+        position = getattr(entity, Agent.registered_as).position
+        cell_size = self.current_map.get_agent_grid().cell_size
+        return (int(math.floor(position.x / cell_size)),
+                int(math.floor(position.y / cell_size)))
+
+    def check_preload_prediction(self):
+        """Preloads the predicted maps again if the agent of the
+        "PreloadAgent" setting moved to another cell of the agent grid or
+        a MoveAgent changed since the last prediction"""
+        if (self._move_agents_changed or
+                self.get_preload_agent_cell() != self._preload_cell):
+            self.preload_predicted_maps()
+
+    def cb_move_agent_changed(self, entity, *args):  # pylint: disable=W0613
+        """Called when a MoveAgent was set, changed or removed
+
+        Args:
+            entity: The entity whose MoveAgent changed
+        """
+        self._move_agents_changed = True
+
+    def is_preload_agent_idle(self):
+        """Returns whether the agent of the "PreloadAgent" setting is idle.
+        This is also True if there is no such agent or it has no behaviour.
+        """
+        if self._preload_agent is None:
+            return True
+        entity = self.world.get_entity(self._preload_agent)
+        if entity is None:
+            return True
+        fifeagent = getattr(entity, FifeAgent.registered_as)
+        if not fifeagent or fifeagent.behaviour is None:
+            return True
+        return fifeagent.behaviour.state in (AGENT_STATES.NONE,
+                                             AGENT_STATES.IDLE)
+
+    def unload_unused_maps(self):
+        """Unloads the least recently activated maps, except the current
+        map, while more maps are loaded than the "MaxLoadedMaps" setting
+        allows or the memory usage of the process exceeds the
+        "MaxLoadedMapsMemory" setting, in MiB. A value of 0 disables a
+        limit. Because freed memory is not always returned to the system
+        at most one map is unloaded per call because of the memory limit.
+
+        Returns:
+            A list of the names of the unloaded maps
+        """
+        max_maps = self.settings.get("fife-rpg", "MaxLoadedMaps", 0)
+        max_memory = self.settings.get("fife-rpg", "MaxLoadedMapsMemory", 0)
+        unloaded = []
+        for name in list(self._loaded_maps.keys()):
+            over_count = max_maps and len(self._loaded_maps) > max_maps
+            if not over_count:
+                if unloaded or not max_memory:
+                    break
+                memory_usage = get_memory_usage()
+                if (memory_usage is None or
+                        memory_usage <= max_memory * 1024 * 1024):
+                    break
+            game_map = self.maps.get(name)
+            if game_map is self.current_map:
+                continue
+            del self._loaded_maps[name]
+            if game_map is not None:
+                game_map.unload()
+            unloaded.append(name)
+        return unloaded
+
     def add_map_switch_callback(self, callback):
         """Adds a callback function which gets called after
         the map switched
@@ -371,48 +576,176 @@ class RPGApplication(FifeManager, ApplicationBase):
             index = self._map_loaded_callbacks.index(callback)
             del self._map_loaded_callbacks[index]
 
+    def add_region_entered_callback(self, callback):
+        """Adds a callback function which gets called after an agent
+        entered a region of the current map
+
+        Args:
+            callback: The function to add. It gets called with the name of
+            the map, the name of the agent and the name of the region.
+        """
+        if callback not in self._region_entered_callbacks:
+            self._region_entered_callbacks.append(callback)
+
+    def remove_region_entered_callback(self, callback):
+        """Removes a callback function that got called after an agent
+        entered a region.
+
+        Args:
+            callback: The function to remove
+        """
+        if callback in self._region_entered_callbacks:
+            index = self._region_entered_callbacks.index(callback)
+            del self._region_entered_callbacks[index]
+
+    def add_region_exited_callback(self, callback):
+        """Adds a callback function which gets called after an agent
+        exited a region of the current map
+
+        Args:
+            callback: The function to add. It gets called with the name of
+            the map, the name of the agent and the name of the region.
+        """
+        if callback not in self._region_exited_callbacks:
+            self._region_exited_callbacks.append(callback)
+
+    def remove_region_exited_callback(self, callback):
+        """Removes a callback function that got called after an agent
+        exited a region.
+
+        Args:
+            callback: The function to remove
+        """
+        if callback in self._region_exited_callbacks:
+            index = self._region_exited_callbacks.index(callback)
+            del self._region_exited_callbacks[index]
+
+    @startup_phase()
     def load_maps(self):
-        """Load the names of the available maps from a map file."""
+        """Load the names of the available maps from a map file. The maps
+        that were loaded before are replaced."""
+        for game_map in self._maps.values():
+            game_map.remove_listeners()
         self._maps = {}
         maps_path = self.settings.get(
             "fife-rpg", "MapsPath", "maps")
-        vfs = self.engine.getVFS()
         filename = os.path.join(maps_path, "maps.yaml")
         if not os.path.exists(filename):
             return
-        maps_file = vfs.open(filename)
-        maps_doc = yaml.load(maps_file)
+        maps_doc = self.load_yaml_file(filename)
         maps_path = self.settings.get(
             "fife-rpg", "MapsPath", "maps")
         camera = self.settings.get(
             "fife-rpg", "Camera", "main")
+        index_filename = self.settings.get("fife-rpg", "MapIndexFile", None)
+        old_index = self.load_map_index(index_filename)
+        map_index = {}
 
         for name, filename in maps_doc["Maps"].items():
             filepath = os.path.join(maps_path, filename + '.xml')
-            identifier = etree.parse(filepath).getroot().attrib["id"]
+            file_stat = os.stat(filepath)
+            entry = [file_stat.st_mtime, file_stat.st_size]
+            old_entry = old_index.get(filepath)
+            if old_entry is not None and old_entry[1:] == entry:
+                identifier = old_entry[0]
+            else:
+                identifier = read_map_id(filepath)
+            map_index[filepath] = [identifier] + entry
             regions_filename = ("%s_regions.yaml" %
                                 os.path.splitext(filepath)[0])
-            regions = {}
-            try:
-                regions_file = self.engine.getVFS().open(regions_filename)
-            except fife.NotFound:
-                regions_file = None
-            if regions_file is not None:
-                regions_data = yaml.load(regions_file)
-                if regions_data is not None:
-                    for region_name, region_data in (
-                            iter(regions_data.items())):
-                        region = fife.DoubleRect(x=region_data[0],
-                                                 y=region_data[1],
-                                                 width=region_data[2],
-                                                 height=region_data[3])
-                        regions[region_name] = region
+            regions = partial(self.load_regions, regions_filename)
             game_map = GameMap(filepath, name, camera, regions, self)
             self.add_map(identifier, game_map)
+        if index_filename and map_index != old_index:
+            self.save_map_index(index_filename, map_index)
+
+    @staticmethod
+    def load_map_index(filename):
+        """Loads the cached identifiers of the map files
+
+        Args:
+            filename: The path of the index file. If None or if the file
+            can't be read an empty index is returned.
+
+        Returns:
+            A dictionary of the paths of the map files to lists with the
+            identifier, modification time and size of the file
+        """
+        if not filename or not os.path.exists(filename):
+            return {}
+        try:
+            with open(filename, "r") as index_file:
+                map_index = load_yaml(index_file)
+        except Exception:  # pylint: disable=broad-except
+            return {}
+        return map_index if isinstance(map_index, dict) else {}
+
+    @staticmethod
+    def save_map_index(filename, map_index):
+        """Saves the identifiers of the map files. The index is only a
+        cache, so errors while writing it are ignored.
+
+        Args:
+            filename: The path of the index file
+
+            map_index: A dictionary of the paths of the map files to lists
+            with the identifier, modification time and size of the file
+        """
+        try:
+            with open(filename, "w") as index_file:
+                dump_yaml(map_index, index_file)
+        except (IOError, OSError):
+            pass
 
+    def load_regions(self, filename):
+        """Loads the regions of a map from a yaml file
+
+        Args:
+            filename: The path of the regions file
+
+        Returns:
+            A dictionary of the names of the regions to fife.DoubleRect
+            instances. The dictionary is empty if the file does not exist.
+        """
+        regions = {}
+        try:
+            regions_data = self.load_yaml_file(filename)
+        except fife.NotFound:
+            return regions
+        if regions_data is not None:
+            for region_name, region_data in iter(regions_data.items()):
+                region = fife.DoubleRect(x=region_data[0],
+                                         y=region_data[1],
+                                         width=region_data[2],
+                                         height=region_data[3])
+                regions[region_name] = region
+        return regions
+
+    @startup_phase()
     def create_world(self):
-        """Creates the world used by this application"""
+        """Creates the world used by this application. The listeners of the
+        previous world are removed."""
+        if self.world is not None:
+            for game_map in self._maps.values():
+                game_map.remove_listeners()
+            self.world.destroy()
         self.world = RPGWorld(self)
+        for game_map in self._maps.values():
+            if game_map.is_loaded:
+                game_map.update_entities()
+        self._changed_agents = set()
+        agents = getattr(self.world.components, Agent.registered_as)
+        for field_name in _WATCHED_AGENT_FIELDS:
+            agents.add_field_listener(field_name, self.cb_agent_changed)
+        agents.add_entity_listener(self.cb_agent_set)
+        if MoveAgent.registered_as:
+            move_agents = getattr(self.world.components,
+                                  MoveAgent.registered_as)
+            for field_name in ("target_map", "target_position"):
+                move_agents.add_field_listener(field_name,
+                                               self.cb_move_agent_changed)
+            move_agents.add_entity_listener(self.cb_move_agent_changed)
+            move_agents.add_remove_listener(self.cb_move_agent_changed)
         GameVariables.add_callback(self.update_game_variables)
         ScriptingSystem.register_command("set_global_lighting",
                                          self.set_global_lighting,
@@ -426,6 +759,24 @@ class RPGApplication(FifeManager, ApplicationBase):
         ScriptingSystem.register_command("is_agent_in_region",
                                          self.is_agent_in_region,
                                          _SCRIPTING_MODULE)
+        ScriptingSystem.register_command("get_regions_at_location",
+                                         self.get_regions_at_location,
+                                         _SCRIPTING_MODULE)
+        ScriptingSystem.register_command("get_agents_in_region",
+                                         self.get_agents_in_region,
+                                         _SCRIPTING_MODULE)
+        ScriptingSystem.register_command("preload_map",
+                                         self.preload_map,
+                                         _SCRIPTING_MODULE)
+        ScriptingSystem.register_command("get_agents_in_radius",
+                                         self.get_agents_in_radius,
+                                         _SCRIPTING_MODULE)
+        ScriptingSystem.register_command("get_agents_in_rect",
+                                         self.get_agents_in_rect,
+                                         _SCRIPTING_MODULE)
+        ScriptingSystem.register_command("get_nearest_agents",
+                                         self.get_nearest_agents,
+                                         _SCRIPTING_MODULE)
 
     def request_quit(self):
         """Sends the quit command to the application's listener.
@@ -473,8 +824,7 @@ class RPGApplication(FifeManager, ApplicationBase):
             filename = self.settings.get("fife-rpg", "CombinedFile",
                                          filename)
         self._components = {}
-        components_file = self.engine.getVFS().open(filename)
-        for name, path in yaml.load(components_file)["Components"].items():
+        for name, path in self.load_yaml_file(filename)["Components"].items():
             self._components[name] = path
 
     def get_component_data(self, component_name):
@@ -517,6 +867,7 @@ class RPGApplication(FifeManager, ApplicationBase):
                                                 "register_script_commands"):
             module.register_script_commands(component.registered_as)
 
+    @startup_phase()
     def register_components(self, component_list=None, register_checkers=True,
                             register_script_commands=True):
         """Calls the register method of the components in the component list
@@ -565,8 +916,7 @@ class RPGApplication(FifeManager, ApplicationBase):
             filename = self.settings.get("fife-rpg", "CombinedFile",
                                          filename)
         self._actions = {}
-        actions_file = self.engine.getVFS().open(filename)
-        file_data = yaml.load(actions_file)
+        file_data = self.load_yaml_file(filename)
         for name, path in file_data["Actions"].items():
             self._actions[name] = path
 
@@ -596,6 +946,7 @@ class RPGApplication(FifeManager, ApplicationBase):
         else:
             action.register()
 
+    @startup_phase()
     def register_actions(self, action_list=None):
         """Calls the register method of the actions in the action list
 
@@ -631,8 +982,7 @@ class RPGApplication(FifeManager, ApplicationBase):
             filename = self.settings.get("fife-rpg", "CombinedFile",
                                          filename)
         self._systems = {}
-        systems_file = self.engine.getVFS().open(filename)
-        for name, path in yaml.load(systems_file)["Systems"].items():
+        for name, path in self.load_yaml_file(filename)["Systems"].items():
             self._systems[name] = path
 
     def get_system_data(self, system_name):
@@ -661,6 +1011,7 @@ class RPGApplication(FifeManager, ApplicationBase):
         else:
             system.register()
 
+    @startup_phase()
     def register_systems(self, system_list=None):
         """Calls the register method of the systems in the system list
 
@@ -696,8 +1047,7 @@ class RPGApplication(FifeManager, ApplicationBase):
             filename = self.settings.get("fife-rpg", "CombinedFile",
                                          filename)
         self._behaviours = {}
-        behaviours_file = self.engine.getVFS().open(filename)
-        for name, path in yaml.load(behaviours_file)["Behaviours"].items():
+        for name, path in self.load_yaml_file(filename)["Behaviours"].items():
             self._behaviours[name] = path
 
     def get_behaviour_data(self, behaviour_name):
@@ -727,6 +1077,7 @@ class RPGApplication(FifeManager, ApplicationBase):
         else:
             behaviour.register()
 
+    @startup_phase()
     def register_behaviours(self, behaviour_list=None):
         """Calls the register method of the behaviours in the behaviour list
 
@@ -749,6 +1100,87 @@ class RPGApplication(FifeManager, ApplicationBase):
             else:
                 self.register_behaviour(behaviour)
 
+    def read_file(self, filename):
+        """Reads a file through the VFS of the engine
+
+        Args:
+            filename: The path of the file
+
+        Returns:
+            The content of the file
+
+        Raises:
+            fife.NotFound: If the file does not exist
+        """
+        raw_data = self.engine.getVFS().open(filename)
+        return raw_data.readString(raw_data.getDataLength())
+
+    def load_yaml_file(self, filename, all_documents=False):
+        """Loads a yaml file through the VFS of the engine. If the
+        "StartupManifest" setting is set the parsed data is taken from the
+        manifest while the content of the file is unchanged.
+
+        Args:
+            filename: The path of the file
+
+            all_documents: If True a list of all documents in the file is
+            returned, otherwise only the first document
+
+        Returns:
+            The loaded data
+
+        Raises:
+            fife.NotFound: If the file does not exist
+        """
+        def parse(data):
+            """Parses the content of the file"""
+            if all_documents:
+                return list(load_all_yaml(data))
+            return load_yaml(data)
+
+        if self._startup_manifest is None:
+            return parse(self.engine.getVFS().open(filename))
+        return self._startup_manifest.get(filename, parse)
+
+    def build_startup_manifest(self):
+        """Parses the component, action, system and behaviour definitions,
+        the object database, the maps file and the regions files into the
+        startup manifest and saves it. This is meant to be run as a build
+        step. The game also updates the manifest when it reads a changed
+        file, but only saves it once, on the first step after the startup.
+
+        Returns:
+            True if the manifest was saved, False if it could not be written
+
+        Raises:
+            ValueError: If the "StartupManifest" setting is not set
+        """
+        if self._startup_manifest is None:
+            raise ValueError("The \"StartupManifest\" setting is not set")
+        definitions_files = set()
+        for setting, default in (("ComponentsFile", "components.yaml"),
+                                 ("ActionsFile", "actions.yaml"),
+                                 ("SystemsFile", "systems.yaml"),
+                                 ("BehavioursFile", "behaviours.yaml")):
+            filename = self.settings.get("fife-rpg", setting, default)
+            definitions_files.add(self.settings.get("fife-rpg",
+                                                    "CombinedFile", filename))
+        for filename in definitions_files:
+            self.load_yaml_file(filename)
+        self.load_yaml_file(self.settings.get(
+            "fife-rpg", "ObjectDBFile", "objects/object_database.yaml"),
+                            all_documents=True)
+        maps_path = self.settings.get("fife-rpg", "MapsPath", "maps")
+        maps_filename = os.path.join(maps_path, "maps.yaml")
+        if os.path.exists(maps_filename):
+            maps_doc = self.load_yaml_file(maps_filename)
+            for filename in maps_doc["Maps"].values():
+                filepath = os.path.join(maps_path, filename + '.xml')
+                self.load_regions("%s_regions.yaml" %
+                                  os.path.splitext(filepath)[0])
+        return self._startup_manifest.save()
+
+    @startup_phase()
     def load_combined(self, filepath=None):
         """Loads components, actions, systems and behaviours.
 
@@ -787,10 +1219,92 @@ class RPGApplication(FifeManager, ApplicationBase):
 
             agent_name: Name of the agent
         """
+        game_map = (self.maps[map_name]
+                    if map_name is not None
+                    else self.current_map)
+        if region_name not in game_map.regions:
+            raise NoSuchRegionError(game_map.name, region_name)
         entity = self.world.get_entity(agent_name)
-        agent = getattr(entity, Agent.registered_as)
-        location = agent.position
-        return self.is_location_in_region(map_name, location, region_name)
+        return region_name in game_map.get_agent_regions(entity)
+
+    def get_regions_at_location(self, map_name, location):
+        """Returns the names of the regions of the map that contain the
+        location
+
+        Args:
+            map_name: Name of the map. If None the current map will be used
+
+            location: A list or tuple containing the location
+        """
+        game_map = (self.maps[map_name]
+                    if map_name is not None
+                    else self.current_map)
+        return game_map.get_regions_at(location)
+
+    def get_agents_in_region(self, map_name, region_name):
+        """Returns the names of the agents inside the region of the map
+
+        Args:
+            map_name: Name of the map. If None the current map will be used
+
+            region_name: Name of the region
+        """
+        game_map = (self.maps[map_name]
+                    if map_name is not None
+                    else self.current_map)
+        return [entity.identifier for entity in
+                game_map.get_agents_in_region(region_name)]
+
+    def get_agents_in_radius(self, map_name, location, radius):
+        """Returns the names of the agents within a distance of a location
+
+        Args:
+            map_name: Name of the map. If None the current map will be used
+
+            location: A list or tuple containing the location
+
+            radius: The maximum distance
+        """
+        game_map = (self.maps[map_name]
+                    if map_name is not None
+                    else self.current_map)
+        return [entity.identifier for entity in
+                game_map.get_agents_in_radius(location, radius)]
+
+    def get_agents_in_rect(self, map_name, rect):
+        """Returns the names of the agents inside a rectangle
+
+        Args:
+            map_name: Name of the map. If None the current map will be used
+
+            rect: A list or tuple with x, y, width and height
+        """
+        game_map = (self.maps[map_name]
+                    if map_name is not None
+                    else self.current_map)
+        return [entity.identifier for entity in
+                game_map.get_agents_in_rect(rect)]
+
+    def get_nearest_agents(self, map_name, location, count,
+                           max_distance=None):
+        """Returns the names of the agents nearest to a location, sorted by
+        distance
+
+        Args:
+            map_name: Name of the map. If None the current map will be used
+
+            location: A list or tuple containing the location
+
+            count: The maximum number of agents to return
+
+            max_distance: If not None only agents up to this distance are
+            returned
+        """
+        game_map = (self.maps[map_name]
+                    if map_name is not None
+                    else self.current_map)
+        return [entity.identifier for entity in
+                game_map.get_nearest_agents(location, count, max_distance)]
 
     def execute_console_command(self, command):
         """Executes a console command
@@ -802,34 +1316,79 @@ class RPGApplication(FifeManager, ApplicationBase):
         """
         return self._listener.onConsoleCommand(command)
 
-    def check_agent_changes(self):
-        """Checks all agents for changes"""
-        extent = getattr(self.world[...], Agent.registered_as)
-        extent = extent.map == self.current_map.name
-        new_test = True
-        for entity in extent:
-            if not getattr(entity, FifeAgent.registered_as):
-                new_test = False
-        for agent, fifeagent in self.world.components.join(
-                Agent.registered_as,
-                FifeAgent.registered_as):
-            map_test = agent.map == self.current_map.name
-
-            fife_object = fifeagent.instance.getObject()
-            gfx_test = (fife_object.getNamespace() == agent.namespace and
-                        fife_object.getId() == agent.gfx)
-            if map_test and gfx_test and new_test:
-                continue
-            agent.map = agent.new_map or agent.map
-            agent.layer = agent.new_layer or agent.layer
-            agent.position = agent.new_position or agent.position
-            agent.rotation = agent.new_rotation or agent.rotation
-            agent.new_map = None
-            agent.new_layer = None
-            agent.new_position = None
-            agent.new_rotation = None
+    def cb_agent_changed(self, entity, field_name, old_value, new_value):
+        """Called when a watched field of an agent changed. Queues the entity
+        for the next call of check_agent_changes.
 
-        self.update_agents(self.current_map)
+        Args:
+            entity: The entity that changed
+
+            field_name: The name of the field that changed
+
+            old_value: The previous value of the field
+
+            new_value: The new value of the field
+        """
+        if self._applying_agent_changes:
+            return
+        if field_name.startswith("new_") and new_value is None:
+            return
+        self._changed_agents.add(entity)
+
+    def cb_agent_set(self, entity):
+        """Called when the Agent of an entity was added or replaced. Queues
+        the entity for the next call of check_agent_changes.
+
+        Args:
+            entity: The entity whose Agent was set
+        """
+        if self._applying_agent_changes:
+            return
+        self._changed_agents.add(entity)
+
+    def check_agent_changes(self):
+        """Applies the changes of the agents that changed since the last
+        call. The changes made while applying them do not queue the agents
+        again."""
+        if not self._changed_agents:
+            return
+        changed_agents = self._changed_agents
+        self._changed_agents = set()
+        game_map = self.current_map
+        self._applying_agent_changes = True
+        try:
+            game_map.update_entities_fife(changed_agents)
+            for entity in changed_agents:
+                agent = getattr(entity, Agent.registered_as)
+                if not agent:
+                    continue
+                agent.map = agent.new_map or agent.map
+                agent.layer = agent.new_layer or agent.layer
+                agent.position = agent.new_position or agent.position
+                if agent.new_rotation is not None:
+                    agent.rotation = agent.new_rotation
+                agent.new_map = None
+                agent.new_layer = None
+                agent.new_position = None
+                agent.new_rotation = None
+            self.update_agents(game_map, changed_agents)
+        finally:
+            self._applying_agent_changes = False
+
+    def check_region_changes(self):
+        """Calls the region callbacks for the agents that entered or exited
+        regions of the current map since the last call"""
+        if not (self._region_entered_callbacks or
+                self._region_exited_callbacks):
+            return
+        game_map = self.current_map
+        for identifier, entered, exited in game_map.update_region_states():
+            for region_name in sorted(exited):
+                for callback in self._region_exited_callbacks:
+                    callback(game_map.name, identifier, region_name)
+            for region_name in sorted(entered):
+                for callback in self._region_entered_callbacks:
+                    callback(game_map.name, identifier, region_name)
 
     def set_global_lighting(self, red, green, blue):
         """Sets the color of the current maps lighting
@@ -850,17 +1409,65 @@ class RPGApplication(FifeManager, ApplicationBase):
             self.current_map.camera.getLightingColor()
         return (1.0, 1.0, 1.0)
 
+    def autosave(self, filename=None, progress_callback=None,
+                 done_callback=None):
+        """Saves all entities of the world in a background thread
+
+        Args:
+            filename: The path of the save file. If set to None the
+            "AutosaveFile" setting will be used.
+
+            progress_callback: Called with the number of written entities
+            and the total number of entities
+
+            done_callback: Called with the filename and the raised
+            exception, or None if the file was written
+
+        Returns:
+            True if the autosave was started, False if another autosave is
+            still running
+        """
+        if filename is None:
+            filename = self.settings.get("fife-rpg", "AutosaveFile",
+                                         "saves/autosave.sav")
+        binary = self.settings.get("fife-rpg", "AutosaveBinary", True)
+        compress = self.settings.get("fife-rpg", "AutosaveCompress", False)
+        return self.world.autosave(filename, binary, compress,
+                                   progress_callback, done_callback)
+
+    def finish_startup_profile(self):
+        """Stops the startup profiler and writes its report to the files set
+        by the "StartupProfileFile" setting. If that is not set the report
+        is only available through the startup_profiler attribute. This is
+        called by the first step."""
+        profiler = self.startup_profiler
+        if profiler is None or not profiler.is_running:
+            return
+        profiler.stop()
+        filename = self.settings.get("fife-rpg", "StartupProfileFile", None)
+        if filename:
+            profiler.dump(filename)
+
     def step(self, time_delta):
         """Performs actions every frame.
 
         Args:
             time_delta: Time elapsed since last call to pump
         """
+        if self.startup_profiler is not None:
+            self.finish_startup_profile()
         if self.current_map:
             self.check_agent_changes()
-            self.current_map.update_entities_fife()
-            self.current_map.update_entities()
             self.current_map.update_entitities_agent()
+            self.check_region_changes()
+            if self._preload_agent is not None:
+                self.check_preload_prediction()
+        if self._startup_manifest_pending:
+            # Files that are parsed later are only added to the manifest
+            # by build_startup_manifest, to keep saving out of the game loop
+            self._startup_manifest_pending = False
+            self._startup_manifest.save()
+        self._map_preloader.step(self.is_preload_agent_idle())
         if self.world:
             self.world.step(time_delta)
         FifeManager.step(self, time_delta)
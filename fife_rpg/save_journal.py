@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Save files made of a full snapshot and a journal of changes
+
+The snapshot is an entity file in the format of
+:mod:`fife_rpg.binary_entities`. Every checkpoint after it appends a
+delta to the journal file, which contains the dictionaries of the
+entities that changed and the identifiers of the deleted entities.
+After a number of deltas the journal is compacted into a new snapshot.
+
+The snapshot and the deltas start with the generation of the snapshot.
+A new snapshot replaces the old one before the journal is truncated, and
+deltas of another generation are ignored, so an interrupted compaction
+never loses the deltas that are not in the snapshot yet.
+
+.. module:: save_journal
+    :synopsis: Save files made of a snapshot and a journal of changes
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from builtins import object
+from io import BytesIO
+import os
+import struct
+import uuid
+
+from fife_rpg import binary_entities
+from fife_rpg.helpers import replace_file
+
+DELETED_KEY = "Deleted"
+GENERATION_KEY = "Generation"
+
+_LENGTH = struct.Struct("<I")
+
+
+class SaveJournal(object):
+
+    """A snapshot file with a journal of deltas
+
+    Properties:
+        filename: The path of the snapshot file
+
+        journal_filename: The path of the journal file
+
+        compact_threshold: The number of deltas after which the journal
+        should be compacted into a new snapshot
+
+        delta_count: The number of deltas in the journal
+
+        generation: The generation of the current snapshot
+    """
+
+    def __init__(self, filename, compact_threshold=50):
+        self.filename = filename
+        self.journal_filename = filename + ".journal"
+        self.compact_threshold = compact_threshold
+        self.delta_count = 0
+        self.generation = None
+
+    @property
+    def needs_compaction(self):
+        """Returns whether the journal reached the compact threshold"""
+        return self.delta_count >= self.compact_threshold
+
+    def write_snapshot(self, entity_dicts):
+        """Writes a full snapshot of a new generation and truncates the
+        journal
+
+        Args:
+            entity_dicts: The dictionaries of all entities
+        """
+        generation = uuid.uuid4().hex
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "wb") as snapshot_file:
+            writer = binary_entities.BinaryEntityWriter(snapshot_file)
+            writer.write({GENERATION_KEY: generation})
+            for entity_dict in entity_dicts:
+                writer.write(entity_dict)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        replace_file(temp_filename, self.filename)
+        self.generation = generation
+        if os.path.exists(self.journal_filename):
+            with open(self.journal_filename, "wb"):
+                pass
+        self.delta_count = 0
+
+    def write_delta(self, entity_dicts, deleted_identifiers):
+        """Appends a delta to the journal
+
+        Args:
+            entity_dicts: The dictionaries of the changed entities
+
+            deleted_identifiers: The identifiers of the deleted entities
+        """
+        delta = BytesIO()
+        writer = binary_entities.BinaryEntityWriter(delta)
+        writer.write({GENERATION_KEY: self.generation})
+        for identifier in deleted_identifiers:
+            writer.write({DELETED_KEY: identifier})
+        for entity_dict in entity_dicts:
+            writer.write(entity_dict)
+        data = delta.getvalue()
+        with open(self.journal_filename, "ab") as journal_file:
+            journal_file.write(_LENGTH.pack(len(data)))
+            journal_file.write(data)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self.delta_count += 1
+
+    def read_deltas(self, create_entity=None):
+        """Reads the deltas of the journal that belong to the generation of
+        the snapshot. An incomplete delta at the end of the journal, left by
+        an interrupted write, is ignored.
+
+        Args:
+            create_entity: Function that is called with the dictionaries
+            of entities that are stored in fields of other entities.
+
+        Returns:
+            A list of deltas, which are lists of entity dictionaries.
+            Deleted entities are dictionaries with only the DELETED_KEY.
+        """
+        deltas = []
+        if not os.path.exists(self.journal_filename):
+            return deltas
+        with open(self.journal_filename, "rb") as journal_file:
+            while True:
+                length = journal_file.read(_LENGTH.size)
+                if len(length) < _LENGTH.size:
+                    break
+                length = _LENGTH.unpack(length)[0]
+                data = journal_file.read(length)
+                if len(data) < length:
+                    break
+                delta = list(binary_entities.load_entities(BytesIO(data),
+                                                           create_entity))
+                if (not delta or
+                        delta[0].get(GENERATION_KEY) != self.generation):
+                    continue
+                deltas.append(delta[1:])
+        return deltas
+
+    def load(self, get_identifier, create_entity=None):
+        """Reads the snapshot and replays the deltas of the journal
+
+        Args:
+            get_identifier: Function that returns the identifier of an
+            entity dictionary
+
+            create_entity: Function that is called with the dictionaries
+            of entities that are stored in fields of other entities.
+
+        Returns:
+            The dictionaries of the saved entities
+        """
+        # Entities in fields of other entities are only created once the
+        # deltas are applied, so they are created with their newest data
+        entities = {}
+        self.generation = None
+        with open(self.filename, "rb") as snapshot_file:
+            for entity_dict in binary_entities.load_entities(snapshot_file):
+                if GENERATION_KEY in entity_dict:
+                    self.generation = entity_dict[GENERATION_KEY]
+                    continue
+                entities[get_identifier(entity_dict)] = entity_dict
+        deltas = self.read_deltas()
+        for delta in deltas:
+            for entity_dict in delta:
+                if DELETED_KEY in entity_dict:
+                    entities.pop(entity_dict[DELETED_KEY], None)
+                else:
+                    entities[get_identifier(entity_dict)] = entity_dict
+        self.delta_count = len(deltas)
+        if create_entity is None:
+            return list(entities.values())
+        creating = set()
+
+        def create(entity_data):
+            """Creates a nested entity from the newest dictionary with its
+            identifier"""
+            try:
+                identifier = get_identifier(entity_data)
+            except KeyError:
+                identifier = None
+            if identifier is not None and identifier not in creating:
+                entity_data = entities.get(identifier, entity_data)
+            creating.add(identifier)
+            try:
+                return create_entity(_replace_entities(dict(entity_data),
+                                                       create))
+            finally:
+                creating.discard(identifier)
+
+        return [_replace_entities(entity_dict, create)
+                for entity_dict in entities.values()]
+
+
+def _replace_entities(value, create):
+    """Returns a copy of a value read without a world in which the
+    dictionaries of entities are replaced by the entities
+
+    Args:
+        value: The value
+
+        create: Function that is called with the
+        :class:`fife_rpg.binary_entities.EntityData` of an entity and
+        returns the entity
+    """
+    if isinstance(value, binary_entities.EntityData):
+        return create(value)
+    elif isinstance(value, dict):
+        return dict((key, _replace_entities(item, create))
+                    for key, item in value.items())
+    elif isinstance(value, list):
+        return [_replace_entities(item, create) for item in value]
+    elif isinstance(value, tuple):
+        return tuple(_replace_entities(item, create) for item in value)
+    return value
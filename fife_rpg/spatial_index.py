@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Spatial indexes for proximity queries on maps
+
+.. module:: spatial_index
+    :synopsis: Spatial indexes for proximity queries on maps
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from __future__ import division
+
+from builtins import object
+from builtins import range
+import heapq
+import math
+
+
+class SpatialGrid(object):
+
+    """A uniform grid of points, for example the positions of agents
+
+    Properties:
+        cell_size: The width and height of the cells of the grid
+    """
+
+    def __init__(self, cell_size=8.0):
+        self.cell_size = float(cell_size)
+        self.__cells = {}
+        self.__positions = {}
+
+    def __len__(self):
+        return len(self.__positions)
+
+    def __contains__(self, key):
+        return key in self.__positions
+
+    def __iter__(self):
+        return iter(self.__positions)
+
+    def __cell(self, x_pos, y_pos):
+        """Returns the cell that contains the position"""
+        return (int(math.floor(x_pos / self.cell_size)),
+                int(math.floor(y_pos / self.cell_size)))
+
+    def __cells_in_rect(self, left, top, right, bottom):
+        """Yields the points in the cells that overlap the rectangle"""
+        min_x, min_y = self.__cell(left, top)
+        max_x, max_y = self.__cell(right, bottom)
+        cells = self.__cells
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > len(cells):
+            for (cell_x, cell_y), keys in cells.items():
+                if min_x <= cell_x <= max_x and min_y <= cell_y <= max_y:
+                    for key in keys:
+                        yield key
+            return
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                for key in cells.get((cell_x, cell_y), ()):
+                    yield key
+
+    def get_position(self, key):
+        """Returns the position of a point as a tuple
+
+        Args:
+            key: The key of the point
+
+        Raises:
+            KeyError: If there is no point with that key
+        """
+        return self.__positions[key]
+
+    def insert(self, key, x_pos, y_pos):
+        """Inserts a point, or moves it if it already exists
+
+        Args:
+            key: The key of the point
+
+            x_pos: The x coordinate
+
+            y_pos: The y coordinate
+        """
+        cell = self.__cell(x_pos, y_pos)
+        old_position = self.__positions.get(key)
+        if old_position is not None:
+            old_cell = self.__cell(*old_position)
+            if old_cell != cell:
+                self.__remove_from_cell(old_cell, key)
+                self.__cells.setdefault(cell, set()).add(key)
+        else:
+            self.__cells.setdefault(cell, set()).add(key)
+        self.__positions[key] = (x_pos, y_pos)
+
+    def remove(self, key):
+        """Removes a point, if it exists
+
+        Args:
+            key: The key of the point
+        """
+        position = self.__positions.pop(key, None)
+        if position is not None:
+            self.__remove_from_cell(self.__cell(*position), key)
+
+    def __remove_from_cell(self, cell, key):
+        """Removes a key from a cell"""
+        keys = self.__cells[cell]
+        keys.discard(key)
+        if not keys:
+            del self.__cells[cell]
+
+    def query_rect(self, x_pos, y_pos, width, height):
+        """Returns the points inside a rectangle, including its border
+
+        Args:
+            x_pos: The x coordinate of the left side
+
+            y_pos: The y coordinate of the top side
+
+            width: The width of the rectangle
+
+            height: The height of the rectangle
+
+        Returns:
+            A list of the keys of the points
+        """
+        right = x_pos + width
+        bottom = y_pos + height
+        positions = self.__positions
+        found = []
+        for key in self.__cells_in_rect(x_pos, y_pos, right, bottom):
+            point_x, point_y = positions[key]
+            if x_pos <= point_x <= right and y_pos <= point_y <= bottom:
+                found.append(key)
+        return found
+
+    def query_radius(self, x_pos, y_pos, radius):
+        """Returns the points inside a circle, including its border
+
+        Args:
+            x_pos: The x coordinate of the center
+
+            y_pos: The y coordinate of the center
+
+            radius: The radius of the circle
+
+        Returns:
+            A list of the keys of the points
+        """
+        radius_squared = radius * radius
+        positions = self.__positions
+        found = []
+        for key in self.__cells_in_rect(x_pos - radius, y_pos - radius,
+                                        x_pos + radius, y_pos + radius):
+            point_x, point_y = positions[key]
+            if ((point_x - x_pos) ** 2 + (point_y - y_pos) ** 2 <=
+                    radius_squared):
+                found.append(key)
+        return found
+
+    def nearest(self, x_pos, y_pos, count, max_distance=None):
+        """Returns the points nearest to a position. The cells are searched
+        in rings around the cell of the position until enough points are
+        found that no unsearched point can be nearer.
+
+        Args:
+            x_pos: The x coordinate of the position
+
+            y_pos: The y coordinate of the position
+
+            count: The maximum number of points to return
+
+            max_distance: If not None only points up to this distance are
+            returned
+
+        Returns:
+            A list of the keys of the points, sorted by distance
+        """
+        if count <= 0 or not self.__positions:
+            return []
+        center_x, center_y = self.__cell(x_pos, y_pos)
+        positions = self.__positions
+        cells = self.__cells
+        candidates = []
+        searched = 0
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > 4 * len(cells):
+                candidates = [(self.__distance(key, x_pos, y_pos), key)
+                              for key in positions]
+                break
+            for cell_x in range(center_x - ring, center_x + ring + 1):
+                for cell_y in range(center_y - ring, center_y + ring + 1):
+                    if (ring and center_x - ring < cell_x < center_x + ring
+                            and center_y - ring < cell_y < center_y + ring):
+                        continue
+                    for key in cells.get((cell_x, cell_y), ()):
+                        searched += 1
+                        candidates.append(
+                            (self.__distance(key, x_pos, y_pos), key))
+            covered = ring * self.cell_size
+            if searched == len(positions):
+                break
+            if max_distance is not None and covered >= max_distance:
+                break
+            if (len(candidates) >= count and
+                    heapq.nsmallest(count, candidates,
+                                    key=lambda item: item[0])[-1][0] <=
+                    covered):
+                break
+            ring += 1
+        if max_distance is not None:
+            candidates = [candidate for candidate in candidates
+                          if candidate[0] <= max_distance]
+        nearest = heapq.nsmallest(count, candidates,
+                                  key=lambda item: item[0])
+        return [key for _, key in nearest]
+
+    def __distance(self, key, x_pos, y_pos):
+        """Returns the distance of a point to a position"""
+        point_x, point_y = self.__positions[key]
+        return math.hypot(point_x - x_pos, point_y - y_pos)
+
+
+class RectGrid(object):
+
+    """A uniform grid of axis aligned rectangles, for example the regions of
+    a map
+
+    Rectangles that would cover more than max_cells cells are not stored
+    in the cells but checked on every query.
+
+    Properties:
+        cell_size: The width and height of the cells of the grid
+
+        max_cells: The maximum number of cells a rectangle is stored in
+    """
+
+    def __init__(self, cell_size=16.0, max_cells=256):
+        self.cell_size = float(cell_size)
+        self.max_cells = max_cells
+        self.__cells = {}
+        self.__rects = {}
+        self.__large = set()
+
+    def __len__(self):
+        return len(self.__rects)
+
+    def __contains__(self, key):
+        return key in self.__rects
+
+    def __cell_range(self, x_pos, y_pos, width, height):
+        """Returns the first and last cell columns and rows of a
+        rectangle"""
+        cell_size = self.cell_size
+        return (int(math.floor(x_pos / cell_size)),
+                int(math.floor(y_pos / cell_size)),
+                int(math.floor((x_pos + width) / cell_size)),
+                int(math.floor((y_pos + height) / cell_size)))
+
+    def get_rect(self, key):
+        """Returns a rectangle as a tuple of x, y, width and height
+
+        Args:
+            key: The key of the rectangle
+
+        Raises:
+            KeyError: If there is no rectangle with that key
+        """
+        return self.__rects[key]
+
+    def insert(self, key, x_pos, y_pos, width, height):
+        """Inserts a rectangle, or replaces it if it already exists
+
+        Args:
+            key: The key of the rectangle
+
+            x_pos: The x coordinate of the left side
+
+            y_pos: The y coordinate of the top side
+
+            width: The width of the rectangle
+
+            height: The height of the rectangle
+        """
+        self.remove(key)
+        self.__rects[key] = (x_pos, y_pos, width, height)
+        min_x, min_y, max_x, max_y = self.__cell_range(x_pos, y_pos,
+                                                       width, height)
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > self.max_cells:
+            self.__large.add(key)
+            return
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                self.__cells.setdefault((cell_x, cell_y), set()).add(key)
+
+    def remove(self, key):
+        """Removes a rectangle, if it exists
+
+        Args:
+            key: The key of the rectangle
+        """
+        rect = self.__rects.pop(key, None)
+        if rect is None:
+            return
+        if key in self.__large:
+            self.__large.discard(key)
+            return
+        min_x, min_y, max_x, max_y = self.__cell_range(*rect)
+        cells = self.__cells
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                keys = cells[(cell_x, cell_y)]
+                keys.discard(key)
+                if not keys:
+                    del cells[(cell_x, cell_y)]
+
+    def query_point(self, x_pos, y_pos):
+        """Returns the rectangles that contain a point, including their
+        border
+
+        Args:
+            x_pos: The x coordinate of the point
+
+            y_pos: The y coordinate of the point
+
+        Returns:
+            A list of the keys of the rectangles
+        """
+        cell = (int(math.floor(x_pos / self.cell_size)),
+                int(math.floor(y_pos / self.cell_size)))
+        rects = self.__rects
+        found = []
+        for keys in (self.__cells.get(cell, ()), self.__large):
+            for key in keys:
+                rect_x, rect_y, width, height = rects[key]
+                if (rect_x <= x_pos <= rect_x + width and
+                        rect_y <= y_pos <= rect_y + height):
+                    found.append(key)
+        return found
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A cache of the parsed data files that are read at startup
+
+Each source file is stored with the SHA-1 hash of its content and its
+parsed data. The data is used as long as the hash of the source matches,
+otherwise the source is parsed again and the manifest is marked as changed.
+
+.. module:: startup_manifest
+    :synopsis: A cache of the parsed data files that are read at startup
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from builtins import object
+import hashlib
+import os
+import pickle
+
+from fife_rpg.helpers import replace_file
+
+MANIFEST_VERSION = 1
+
+
+class StartupManifest(object):
+
+    """Parsed source files, validated by the hashes of their content
+
+    Properties:
+        filename: The path of the manifest file
+
+        read_source: Function that returns the content of a source file
+
+        changed: Whether entries were added or replaced since the manifest
+        was loaded or saved
+    """
+
+    def __init__(self, filename, read_source):
+        self.filename = filename
+        self.read_source = read_source
+        self.changed = False
+        self.__entries = None
+
+    def __load_entries(self):
+        """Returns the entries, reading them from the file on first use"""
+        if self.__entries is not None:
+            return self.__entries
+        self.__entries = {}
+        if not os.path.exists(self.filename):
+            return self.__entries
+        try:
+            with open(self.filename, "rb") as manifest_file:
+                version, entries = pickle.load(manifest_file)
+        except Exception:  # pylint: disable=broad-except
+            return self.__entries
+        if version == MANIFEST_VERSION and isinstance(entries, dict):
+            self.__entries = entries
+        return self.__entries
+
+    def get(self, source, parse):
+        """Returns the parsed data of a source file
+
+        Args:
+            source: The path of the source file
+
+            parse: Function that parses the content of the source file. It
+            is only called if the manifest has no valid entry for the source.
+
+        Returns:
+            The parsed data. Data that can't be pickled is returned but not
+            stored in the manifest.
+        """
+        data = self.read_source(source)
+        if not isinstance(data, bytes):
+            digest = hashlib.sha1(data.encode("utf-8")).hexdigest()
+        else:
+            digest = hashlib.sha1(data).hexdigest()
+        entries = self.__load_entries()
+        entry = entries.get(source)
+        if entry is not None and entry[0] == digest:
+            try:
+                return pickle.loads(entry[1])
+            except Exception:  # pylint: disable=broad-except
+                pass
+        value = parse(data)
+        try:
+            entries[source] = (digest, pickle.dumps(value,
+                                                    pickle.HIGHEST_PROTOCOL))
+        except Exception:  # pylint: disable=broad-except
+            entries.pop(source, None)
+        self.changed = True
+        return value
+
+    def save(self):
+        """Writes the manifest, if it changed. The manifest is only a cache,
+        so errors while writing it are ignored.
+
+        Returns:
+            True if the manifest was written or did not change, False if it
+            could not be written
+        """
+        if not self.changed:
+            return True
+        temp_filename = self.filename + ".tmp"
+        try:
+            directory = os.path.dirname(self.filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(temp_filename, "wb") as manifest_file:
+                pickle.dump((MANIFEST_VERSION, self.__load_entries()),
+                            manifest_file, pickle.HIGHEST_PROTOCOL)
+            replace_file(temp_filename, self.filename)
+        except (IOError, OSError):
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            return False
+        self.changed = False
+        return True
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measures the phases of the startup of an application
+
+Phases are marked with the :func:`startup_phase` decorator or the
+:func:`phase` context manager and events, like parsed yaml documents, are
+counted with :func:`count`. These do nothing unless a
+:class:`StartupProfiler` is started.
+
+.. module:: startup_profiler
+    :synopsis: Measures the phases of the startup of an application
+
+.. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
+"""
+
+from builtins import object
+from contextlib import contextmanager
+from functools import wraps
+import json
+import time
+from timeit import default_timer
+
+try:
+    _cpu_time = time.process_time  # pylint: disable=invalid-name
+except AttributeError:
+    _cpu_time = time.clock  # pylint: disable=invalid-name,no-member
+
+_ACTIVE = None
+
+
+class StartupProfiler(object):
+
+    """Records the wall and CPU time of startup phases and counts events
+
+    Properties:
+        phases: A list of dictionaries with the name, nesting depth, wall
+        time, CPU time and the counts of each phase, in the order in which
+        the phases started
+
+        counts: A dictionary of the names of the counted events to their
+        total counts
+
+        wall_time: The wall time from the start to the stop of the profiler
+
+        cpu_time: The CPU time from the start to the stop of the profiler
+
+        is_running: Whether the profiler is started
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.counts = {}
+        self.wall_time = None
+        self.cpu_time = None
+        self.__depth = 0
+        self.__start_wall = None
+        self.__start_cpu = None
+
+    @property
+    def is_running(self):
+        """Returns whether the profiler is started"""
+        return _ACTIVE is self
+
+    def start(self):
+        """Starts the profiler. Only one profiler can be running at a
+        time."""
+        global _ACTIVE  # pylint: disable=global-statement
+        _ACTIVE = self
+        self.__start_wall = default_timer()
+        self.__start_cpu = _cpu_time()
+
+    def stop(self):
+        """Stops the profiler and records the total times"""
+        global _ACTIVE  # pylint: disable=global-statement
+        if not self.is_running:
+            return
+        _ACTIVE = None
+        self.wall_time = default_timer() - self.__start_wall
+        self.cpu_time = _cpu_time() - self.__start_cpu
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager that records a phase
+
+        Args:
+            name: The name of the phase
+        """
+        record = {"name": name, "depth": self.__depth}
+        self.phases.append(record)
+        counts_before = dict(self.counts)
+        start_wall = default_timer()
+        start_cpu = _cpu_time()
+        self.__depth += 1
+        try:
+            yield record
+        finally:
+            self.__depth -= 1
+            record["wall_time"] = default_timer() - start_wall
+            record["cpu_time"] = _cpu_time() - start_cpu
+            record["counts"] = dict(
+                (key, value - counts_before.get(key, 0))
+                for key, value in self.counts.items()
+                if value != counts_before.get(key, 0))
+
+    def count(self, name, amount=1):
+        """Counts an event
+
+        Args:
+            name: The name of the event
+
+            amount: How often the event happened
+        """
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def to_dict(self):
+        """Returns the results as a dictionary"""
+        return {"wall_time": self.wall_time, "cpu_time": self.cpu_time,
+                "counts": dict(self.counts), "phases": list(self.phases)}
+
+    def report_json(self):
+        """Returns the results as a JSON string"""
+        return json.dumps(self.to_dict(), indent=4, sort_keys=True)
+
+    def report_text(self):
+        """Returns the results as a table"""
+        lines = ["%-40s %10s %10s  %s" % ("Phase", "Wall (s)", "CPU (s)",
+                                          "Counts")]
+        for record in self.phases:
+            counts = ", ".join("%s=%d" % item
+                               for item in sorted(record.get("counts",
+                                                             {}).items()))
+            lines.append("%-40s %10.3f %10.3f  %s" % (
+                "  " * record["depth"] + record["name"],
+                record.get("wall_time", 0.0), record.get("cpu_time", 0.0),
+                counts))
+        if self.wall_time is not None:
+            counts = ", ".join("%s=%d" % item
+                               for item in sorted(self.counts.items()))
+            lines.append("%-40s %10.3f %10.3f  %s" % (
+                "Total", self.wall_time, self.cpu_time, counts))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, filename):
+        """Writes the results as text to filename.txt and as JSON to
+        filename.json
+
+        Args:
+            filename: The path of the files, without extension
+        """
+        with open(filename + ".txt", "w") as text_file:
+            text_file.write(self.report_text())
+        with open(filename + ".json", "w") as json_file:
+            json_file.write(self.report_json())
+
+
+@contextmanager
+def phase(name):
+    """Context manager that records a phase in the running profiler
+
+    Args:
+        name: The name of the phase
+    """
+    if _ACTIVE is None:
+        yield None
+        return
+    with _ACTIVE.phase(name) as record:
+        yield record
+
+
+def startup_phase(name=None):
+    """Decorator that records each call of a function as a phase in the
+    running profiler
+
+    Args:
+        name: The name of the phase. If None the name of the function will
+        be used.
+    """
+    def decorator(function):
+        """Wraps the function"""
+        phase_name = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            """Calls the function inside a phase"""
+            if _ACTIVE is None:
+                return function(*args, **kwargs)
+            with _ACTIVE.phase(phase_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, amount=1):
+    """Counts an event in the running profiler
+
+    Args:
+        name: The name of the event
+
+        amount: How often the event happened
+    """
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, amount)
@@ -21,12 +21,11 @@
 .. moduleauthor:: Karsten Bock <KarstenBock@gmx.net>
 """
 from builtins import object
-import yaml
 
 from fife_rpg.systems import Base
-from fife_rpg.entities import RPGEntity
 from fife_rpg.components.character_statistics import CharacterStatistics
 from fife_rpg.exceptions import AlreadyRegisteredError
+from fife_rpg.helpers import load_yaml
 
 
 def get_stat_cost(offset):
@@ -173,6 +172,62 @@ class CharacterStatisticSystem(Base):
         Base.__init__(self)
         self.primary_statistics = {}
         self.secondary_statistics = {}
+        self.__dependents = {}
+        self.__order = []
+        self.__calculated = {}
+        self.__component = None
+
+    def __update_dependents(self):
+        """Builds the dictionary of which secondary statistics depend on
+        a statistic and the order in which the secondary statistics have to
+        be calculated, and invalidates the calculated values."""
+        self.__dependents = {}
+        for statistic_name, statistic in self.secondary_statistics.items():
+            for name in statistic.influences.keys():
+                self.__dependents.setdefault(name, set()).add(statistic_name)
+        order = []
+        visited = set()
+        for statistic_name in self.secondary_statistics.keys():
+            if statistic_name in visited:
+                continue
+            visited.add(statistic_name)
+            stack = [(statistic_name, iter(
+                self.secondary_statistics[statistic_name].influences))]
+            while stack:
+                name, influences = stack[-1]
+                for influence in influences:
+                    if (influence in self.secondary_statistics and
+                            influence not in visited):
+                        visited.add(influence)
+                        stack.append((influence, iter(
+                            self.secondary_statistics[influence].influences)))
+                        break
+                else:
+                    stack.pop()
+                    order.append(name)
+        self.__order = order
+        self.__calculated = {}
+
+    def get_dependent_statistics(self, changed):
+        """Returns the secondary statistics that are influenced, directly or
+        indirectly, by the given statistics
+
+        Args:
+            changed: The names of the changed statistics
+
+        Returns:
+            A list of the names of the dependent secondary statistics, in the
+            order in which they should be calculated
+        """
+        dependent = set()
+        pending = list(changed)
+        while pending:
+            name = pending.pop()
+            for statistic_name in self.__dependents.get(name, ()):
+                if statistic_name not in dependent:
+                    dependent.add(statistic_name)
+                    pending.append(statistic_name)
+        return [name for name in self.__order if name in dependent]
 
     def add_primary_statistic(self, name, view_name, description):
         """Adds a primary statistic to the system
@@ -188,6 +243,7 @@ class CharacterStatisticSystem(Base):
             raise AlreadyRegisteredError(name, "Statistic")
         statistic = Statistic(name, view_name, description)
         self.primary_statistics[name] = statistic
+        self.__update_dependents()
 
     def add_secondary_statistic(self, name, view_name,
                                 description, influences):
@@ -207,6 +263,7 @@ class CharacterStatisticSystem(Base):
         statistic = CalculatedStatistic(name, view_name, description,
                                         influences)
         self.secondary_statistics[name] = statistic
+        self.__update_dependents()
 
     def load_statistics_from_file(self, filename):
         """Clears the statistics and populates them from a file
@@ -215,7 +272,7 @@ class CharacterStatisticSystem(Base):
             filename: The path to the file
         """
         statistics_file = open(filename, "r")
-        statistics_data = yaml.load(statistics_file)
+        statistics_data = load_yaml(statistics_file)
         for name, primary_data in statistics_data["primary"].items():
             view_name = primary_data["name"]
             desc = primary_data["description"]
@@ -457,14 +514,61 @@ class CharacterStatisticSystem(Base):
             time_delta: Time elapsed since last step
         """
         comp_name = CharacterStatistics.registered_as
-        entity_extent = getattr(self.world[RPGEntity], comp_name)
-        for entity in entity_extent:
-            stats_component = getattr(entity, comp_name)
-            comp_secondary_stats = stats_component.secondary_stats
-            for statistic_name, statistic in (
-                    iter(self.secondary_statistics.items())):
-                total = 0
-                for name, influence in statistic.influences.items():
-                    value = self.get_statistic_value(entity, name)
-                    total += value * influence
-                comp_secondary_stats[statistic_name] = total
+        component = getattr(self.world.components, comp_name)
+        if component is not self.__component:
+            if self.__component is not None:
+                self.__component.remove_remove_listener(
+                    self.cb_statistics_removed)
+            component.add_remove_listener(self.cb_statistics_removed)
+            self.__component = component
+            self.__calculated = {}
+        calculated = self.__calculated
+        for entity in component.entities:
+            stats_component = component[entity]
+            primary_stats = stats_component.primary_stats
+            last = calculated.get(entity)
+            if last is not None:
+                last_stats, last_version, last_values = last
+                if (last_stats is primary_stats and
+                        last_version == primary_stats.version):
+                    continue
+                changed = [name for name in
+                           set(last_values.keys()) | set(primary_stats.keys())
+                           if last_values.get(name) !=
+                           primary_stats.get(name)]
+                to_calculate = self.get_dependent_statistics(changed)
+            else:
+                to_calculate = list(self.__order)
+            self.calculate_statistics(stats_component, to_calculate)
+            calculated[entity] = (primary_stats, primary_stats.version,
+                                  dict(primary_stats))
+
+    def cb_statistics_removed(self, entity):
+        """Called before the CharacterStatistics of an entity are removed
+        or replaced
+
+        Args:
+            entity: The entity
+        """
+        self.__calculated.pop(entity, None)
+
+    def calculate_statistics(self, stats_component, statistics):
+        """Calculates the values of secondary statistics
+
+        Args:
+            stats_component: The CharacterStatistics data of an entity
+
+            statistics: The names of the secondary statistics to calculate
+        """
+        primary_stats = stats_component.primary_stats
+        secondary_stats = stats_component.secondary_stats
+        for statistic_name in statistics:
+            statistic = self.secondary_statistics[statistic_name]
+            total = 0
+            for name, influence in statistic.influences.items():
+                if name in self.primary_statistics:
+                    value = primary_stats.get(name, 0)
+                else:
+                    value = secondary_stats.get(name, 0)
+                total += value * influence
+            secondary_stats[statistic_name] = total
@@ -30,6 +30,9 @@ class GameVariables(Base):
 
     """The game environment system manages what variables and functions are
     available to scripts.
+
+    Properties:
+        version: Increased every time a variable is set, deleted or replaced
     """
 
     __callbacks = []
@@ -59,6 +62,12 @@ class GameVariables(Base):
         Base.__init__(self)
         self.__dynamic = {}
         self.__static = {}
+        self.__version = 0
+
+    @property
+    def version(self):
+        """Returns the version of the variables"""
+        return self.__version
 
     def get_variables(self):
         """Returns the the variables as a dictionary"""
@@ -85,6 +94,7 @@ class GameVariables(Base):
             if name not in self.__dynamic and name in self.__static:
                 return "There is already a %s static variable" % (name)
         self.__dynamic[name] = value
+        self.__version += 1
         return self.__dynamic[name]
 
     def delete_variable(self, name):
@@ -97,6 +107,7 @@ class GameVariables(Base):
         """
         if name in self.__dynamic:
             del self.__dynamic[name]
+            self.__version += 1
         else:
             return "There was no %s dynamic variable" % name
 
@@ -121,8 +132,16 @@ class GameVariables(Base):
         Args:
             time_delta: Time since last step invocation
         """
+        old_static = copy(self.__static)
         for callback in self.__callbacks:
             callback(self.__static)
+        if len(old_static) != len(self.__static):
+            self.__version += 1
+            return
+        for name, value in old_static.items():
+            if self.__static.get(name, old_static) is not value:
+                self.__version += 1
+                return
 
 
 # pylint: disable=C0111
@@ -23,12 +23,10 @@
 
 from copy import copy
 
-import yaml
-
 from fife_rpg.systems import Base
 from fife_rpg.systems import GameVariables
 from fife_rpg.exceptions import AlreadyRegisteredError
-from fife_rpg.helpers import ClassProperty
+from fife_rpg.helpers import ClassProperty, VersionedDict, load_yaml
 import imp
 
 
@@ -44,6 +42,7 @@ class ScriptingSystem(Base):
     dependencies = []
 
     __commands = {"": {}}
+    __commands_version = 0
 
     @classmethod
     def register(cls, name="scripting"):
@@ -73,6 +72,7 @@ class ScriptingSystem(Base):
         if module not in cls.__commands:
             cls.__commands[module] = {}
         cls.__commands[module][name] = command_function
+        ScriptingSystem.__commands_version += 1
 
     @classmethod
     def register_commands(cls, command_dict, module=""):
@@ -93,32 +93,73 @@ class ScriptingSystem(Base):
 
     def __init__(self):
         Base.__init__(self)
-        self.globals = {}
+        self.__globals = VersionedDict()
         self.__scripts = {}
+        self.__script_globals = None
+        self.__script_globals_version = None
+        self.__script_versions = {}
         self.reset()
 
+    @property
+    def globals(self):
+        """Returns the globals dictionary"""
+        return self.__globals
+
+    @globals.setter
+    def globals(self, value):
+        """Replaces the globals dictionary
+
+        Args:
+            value: A dictionary with the new globals
+        """
+        old_version = self.__globals.version
+        self.__globals = VersionedDict(value)
+        self.__globals.version = old_version + 1
+
     def set_world(self, world):
         """Bind the system to a world"""
         Base.set_world(self, world)
         app = world.application
         app.add_map_switch_callback(self.on_map_switched)
+        app.add_region_entered_callback(self.on_region_entered)
+        app.add_region_exited_callback(self.on_region_exited)
 
     def reset(self):
         """Resets the scripting system"""
         self.globals = {}
         self.__scripts = {}
+        self.__script_globals = None
+        self.__script_globals_version = None
+        self.__script_versions = {}
+
+    def get_globals_version(self):
+        """Returns a value that changes whenever the game variables, the
+        globals or the registered commands change"""
+        variables_version = None
+        if GameVariables.registered_as:
+            game_variables = getattr(self.world.systems,
+                                     GameVariables.registered_as)
+            variables_version = game_variables.version
+        return (variables_version, self.__globals.version,
+                ScriptingSystem.__commands_version)
 
     def prepare_globals(self):
         """Builds the actual globals passed to scripts and returns them
-        as a dictionary"""
+        as a dictionary. The dictionary is only rebuilt if the value of
+        get_globals_version changed since the last call."""
+        version = self.get_globals_version()
+        if (self.__script_globals is not None and
+                version == self.__script_globals_version):
+            return self.__script_globals
         script_globals = {}
         if GameVariables.registered_as:
             game_variables = getattr(self.world.systems,
                                      GameVariables.registered_as)
             script_globals.update(game_variables.get_variables())
         script_globals.update(self.globals)
-        script_globals.update(self.commands[""])
-        for name, module_commands in self.commands.items():
+        commands = ScriptingSystem.__commands
+        script_globals.update(commands[""])
+        for name, module_commands in commands.items():
             if name == "":
                 continue
             if name not in script_globals:
@@ -126,8 +167,24 @@ class ScriptingSystem(Base):
             module = script_globals[name]
             module.__dict__.update(module_commands)
 
+        self.__script_globals = script_globals
+        self.__script_globals_version = version
         return script_globals
 
+    def update_script_globals(self, name, script):
+        """Updates the globals of a script, if they changed since the last
+        update of that script
+
+        Args:
+            name: The name of the script
+
+            script: The module of the script
+        """
+        script_globals = self.prepare_globals()
+        if self.__script_versions.get(name) != self.__script_globals_version:
+            script.__dict__.update(script_globals)
+            self.__script_versions[name] = self.__script_globals_version
+
     def step(self, time_delta):
         """Execute a time step for the system. Must be defined
         by all system classes.
@@ -135,16 +192,15 @@ class ScriptingSystem(Base):
         Args:
             time_delta: Time since last step invocation
         """
-        for script in self.__scripts.values():
+        for name, script in self.__scripts.items():
             if "step" not in script.__dict__:
                 continue
-            script_globals = self.prepare_globals()
-            script.__dict__.update(script_globals)
+            self.update_script_globals(name, script)
             script.step(time_delta)
 
     def eval(self, string):
         """Evaluate the strin inside the scripting environment"""
-        script_globals = self.prepare_globals()
+        script_globals = copy(self.prepare_globals())
         return eval(string, script_globals)  # pylint: disable=eval-used
 
     def add_script(self, name, filename):
@@ -160,6 +216,7 @@ class ScriptingSystem(Base):
         script_module = imp.new_module(name)
         exec(script_file, script_module.__dict__)  # pylint: disable=W0122
         self.__scripts[name] = script_module
+        self.__script_versions.pop(name, None)
         script_file.close()
 
     def load_scripts(self, filename=None):
@@ -174,7 +231,7 @@ class ScriptingSystem(Base):
             filename = application.settings.get("fife-rpg", "ScriptsFile",
                                                 "scripts.yaml")
         scripts_file = application.engine.getVFS().open(filename)
-        scripts_data = yaml.load(scripts_file)
+        scripts_data = load_yaml(scripts_file)
         scripts = (scripts_data["Scripts"])
 
         if scripts is not None:
@@ -194,9 +251,42 @@ class ScriptingSystem(Base):
         """
         if GameVariables.registered_as:
             getattr(self.world.systems, GameVariables.registered_as).step(0)
-        for script in self.__scripts.values():
+        for name, script in self.__scripts.items():
             if "map_switched" not in script.__dict__:
                 continue
-            script_globals = self.prepare_globals()
-            script.__dict__.update(script_globals)
+            self.update_script_globals(name, script)
             script.map_switched(old_map, new_map)
+
+    def on_region_entered(self, map_name, agent_name, region_name):
+        """Called when an agent entered a region of the current map
+
+        Arguments:
+
+            map_name: The name of the map
+
+            agent_name: The name of the agent
+
+            region_name: The name of the region
+        """
+        for name, script in self.__scripts.items():
+            if "region_entered" not in script.__dict__:
+                continue
+            self.update_script_globals(name, script)
+            script.region_entered(map_name, agent_name, region_name)
+
+    def on_region_exited(self, map_name, agent_name, region_name):
+        """Called when an agent exited a region of the current map
+
+        Arguments:
+
+            map_name: The name of the map
+
+            agent_name: The name of the agent
+
+            region_name: The name of the region
+        """
+        for name, script in self.__scripts.items():
+            if "region_exited" not in script.__dict__:
+                continue
+            self.update_script_globals(name, script)
+            script.region_exited(map_name, agent_name, region_name)
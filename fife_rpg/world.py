@@ -24,14 +24,19 @@
 from builtins import next
 from builtins import str
 from copy import copy
+from functools import partial
+import gzip
 import sys
 import imp
 
 from bGrease.grease_fife.world import World, WorldEntitySet, EntityExtent
 from fife.fife import MapLoader
-import yaml
 
+from fife_rpg import autosave
+from fife_rpg import binary_entities
 from fife_rpg import helpers
+from fife_rpg import save_journal
+from fife_rpg import startup_profiler
 from fife_rpg.components import ComponentManager
 from fife_rpg.systems import SystemManager
 from fife_rpg.entities.rpg_entity import RPGEntity
@@ -50,6 +55,29 @@ class RPGWorldEntitySet(WorldEntitySet):
         WorldEntitySet.remove(self, entity)
 
 
+class CheckerQueue(object):
+
+    """Collects the entities a checker with watched fields has to be called
+    for
+
+    Properties:
+        entities: The set of queued entities
+    """
+
+    def __init__(self):
+        self.entities = set()
+
+    def add_entity(self, entity, *args):  # pylint: disable=W0613
+        """Queues the entity. Used as field and entity listener."""
+        self.entities.add(entity)
+
+    def pop_entities(self):
+        """Returns the queued entities and clears the queue"""
+        entities = self.entities
+        self.entities = set()
+        return entities
+
+
 class RPGWorld(World):
 
     """The Base world for all rpgs.
@@ -61,6 +89,9 @@ class RPGWorld(World):
         uses this engine
 
         object_db: Stores the template data
+
+        autosaver: The :class:`fife_rpg.autosave.Autosaver` that runs the
+        autosaves of the world
     """
 
     MAX_ID_NUMBER = sys.maxsize
@@ -68,29 +99,37 @@ class RPGWorld(World):
     def __init__(self, application):
         self.application = application
         self.object_db = {}
+        self.autosaver = autosave.Autosaver()
         GameVariables.add_callback(self.update_game_variables)
         self.register_mandatory_components()
-        yaml.add_representer(RPGEntity, self.entity_representer,
-                             yaml.SafeDumper)
-        yaml.add_constructor('!Entity', self.entity_constructor,
-                             yaml.SafeLoader)
-        yaml.add_representer(helpers.DoublePointYaml,
-                             helpers.double_point_representer,
-                             yaml.SafeDumper)
-        yaml.add_constructor("!DoublePoint",
-                             helpers.double_point_constructor,
-                             yaml.SafeLoader)
-        yaml.add_representer(helpers.DoublePoint3DYaml,
-                             helpers.double_point_3d_representer,
-                             yaml.SafeDumper)
-        yaml.add_constructor("!DoublePoint3D",
-                             helpers.double_point_3d_constructor,
-                             yaml.SafeLoader)
+        helpers.add_yaml_representer(RPGEntity, self.entity_representer)
+        helpers.add_yaml_constructor('!Entity', self.entity_constructor)
+        helpers.add_yaml_representer(helpers.VersionedDict,
+                                     helpers.versioned_dict_representer)
+        helpers.add_yaml_representer(helpers.DoublePointYaml,
+                                     helpers.double_point_representer)
+        helpers.add_yaml_constructor("!DoublePoint",
+                                     helpers.double_point_constructor)
+        helpers.add_yaml_representer(helpers.DoublePoint3DYaml,
+                                     helpers.double_point_3d_representer)
+        helpers.add_yaml_constructor("!DoublePoint3D",
+                                     helpers.double_point_3d_constructor)
         World.__init__(self, application.engine)
         self.entities = RPGWorldEntitySet(self)
         self._full_extent = EntityExtent(self, self.entities)
         self._entity_delete_callbacks = set()
         self.__entity_cache = {}
+        self.__entities_module = imp.new_module("entities")
+        self.__entities_module_changed = True
+        self.__checker_queues = {}
+        self.__listener_removers = []
+        self.__identifier_numbers = {}
+        self.__save_journal = None
+        self.__tracking_changes = False
+        self.__changed_entities = set()
+        self.__deleted_identifiers = set()
+        self.__versioned_values = {}
+        self.create_checker_queues()
 
     def register_mandatory_components(self):
         """Registers the mandatory components"""
@@ -125,9 +164,47 @@ class RPGWorld(World):
         """
         return identifier in self.__entity_cache
 
+    def find_entities(self, component_name, field_name, value):
+        """Returns the entities whose component field has the given value.
+
+        Uses the index of the component if the field is indexed, otherwise
+        all entities of the component are checked.
+
+        Args:
+            component_name: The name of the component
+
+            field_name: The name of the field
+
+            value: The value to look for
+
+        Returns:
+            A set of the matching entities
+        """
+        component = getattr(self.components, component_name)
+        if component.has_index(field_name):
+            return component.get_indexed(field_name, value)
+        extent = getattr(self[...], component_name)
+        return getattr(extent, field_name) == value
+
+    def add_index(self, component_name, field_name):
+        """Starts keeping an index of the values of a component field, which
+        will be used by find_entities.
+
+        Args:
+            component_name: The name of the component
+
+            field_name: The name of the field. Its values need to be hashable.
+        """
+        component = getattr(self.components, component_name)
+        if not component.has_index(field_name):
+            component.add_index(field_name)
+
     def create_unique_identifier(self, identifier):
         """Returns an unused identifier based on the given identifier
 
+        The numbers appended to an identifier are counted up per base
+        identifier, so numbers of deleted entities are not reused.
+
         Args:
             identifier: The base identifier
 
@@ -136,7 +213,7 @@ class RPGWorld(World):
         """
         if not self.is_identifier_used(identifier):
             return identifier
-        id_number = 1
+        id_number = self.__identifier_numbers.get(identifier, 1)
         while self.is_identifier_used(identifier + "_" + str(id_number)):
             id_number += 1
             if id_number > self.MAX_ID_NUMBER:
@@ -144,9 +221,22 @@ class RPGWorld(World):
                     "Number exceeds MAX_ID_NUMBER:" +
                     str(self.MAX_ID_NUMBER)
                 )
+        self.__identifier_numbers[identifier] = id_number + 1
         identifier = identifier + "_" + str(id_number)
         return identifier
 
+    def update_identifier_numbers(self):
+        """Sets the numbers used by create_unique_identifier to follow the
+        highest numbers of the existing identifiers."""
+        self.__identifier_numbers = {}
+        for identifier in self.__entity_cache.keys():
+            base, _, number = identifier.rpartition("_")
+            if not base or not number.isdigit():
+                continue
+            next_number = int(number) + 1
+            if next_number > self.__identifier_numbers.get(base, 1):
+                self.__identifier_numbers[base] = next_number
+
     def configure(self):
         """Configure the worlds components and systems"""
         World.configure(self)
@@ -183,12 +273,14 @@ class RPGWorld(World):
                 info[key].update(val)
 
             new_ent = RPGEntity(self, identifier)
+            startup_profiler.count("entities")
             for component, data in list(info.items()):
                 setattr(new_ent, component, None)
                 comp_obj = getattr(new_ent, component)
                 for key, value in list(data.items()):
                     setattr(comp_obj, key, value)
             self.__entity_cache[identifier] = new_ent
+            self.__entities_module_changed = True
             return new_ent
         else:
             return None
@@ -200,12 +292,19 @@ class RPGWorld(World):
             variables: The globals dictionary of the GameEnvironment that is
             filled by the GameScene
         """
-        ent_module = imp.new_module("entities")
-        extent = getattr(self[RPGEntity], General.registered_as)
-        for entity in extent:
-            ent_module.__dict__[entity.identifier] = entity
+        ent_module = self.__entities_module
+        if self.__entities_module_changed:
+            ent_dict = ent_module.__dict__
+            for name in list(ent_dict.keys()):
+                if not name.startswith("__"):
+                    del ent_dict[name]
+            extent = getattr(self[RPGEntity], General.registered_as)
+            for entity in extent:
+                ent_dict[entity.identifier] = entity
+            self.__entities_module_changed = False
         variables["entities"] = ent_module
 
+    @startup_profiler.startup_phase()
     def import_agent_objects(self, object_path=None):
         """Import the objects used by agents from the given path
 
@@ -222,6 +321,7 @@ class RPGWorld(World):
                            self.engine.getRenderBackend())
         loader.loadImportDirectory(object_path)
 
+    @startup_profiler.startup_phase()
     def read_object_db(self, db_filename=None):
         """Reads the Object Information Database from a file
 
@@ -232,9 +332,8 @@ class RPGWorld(World):
         if not db_filename:
             db_filename = self.application.settings.get(
                 "fife-rpg", "ObjectDBFile", "objects/object_database.yaml")
-        vfs = self.engine.getVFS()
-        database_file = vfs.open(db_filename)
-        database = yaml.load_all(database_file)
+        database = self.application.load_yaml_file(db_filename,
+                                                   all_documents=True)
         for object_info in database:
             self.object_db.update(object_info)
 
@@ -260,6 +359,7 @@ class RPGWorld(World):
                     entity_data[key] = template_data[key].copy()
         return entity_data
 
+    @startup_profiler.startup_phase()
     def load_and_create_entities(self, entities_file_name=None):
         """Reads the entities from a file and creates them
 
@@ -272,12 +372,13 @@ class RPGWorld(World):
                 "fife-rpg", "EntitiesFile", "objects/entities.yaml")
         vfs = self.engine.getVFS()
         entities_file = vfs.open(entities_file_name)
-        entities = yaml.safe_load_all(entities_file)
+        entities = helpers.load_all_yaml(entities_file)
         try:
             while next(entities):
                 next(entities)
         except StopIteration:
             pass
+        self.update_identifier_numbers()
 
     @classmethod
     def create_entity_dictionary(cls, entity, remove_default=True):
@@ -297,7 +398,8 @@ class RPGWorld(World):
         components = ComponentManager.get_components()
         for name, component in components.items():
             component_values = getattr(entity, name)
-            if component_values:
+            # Removed components keep their data until the next step
+            if component_values and entity in component.entities:
                 component_data = None
                 for field in component.saveable_fields:
                     fields = component.fields
@@ -336,6 +438,18 @@ class RPGWorld(World):
             The created Entity
         """
         entity_dict = loader.construct_mapping(node, deep=True)
+        return self.create_entity_from_dictionary(entity_dict)
+
+    def create_entity_from_dictionary(self, entity_dict):
+        """Creates an Entity from a dictionary as created by
+        create_entity_dictionary
+
+        Args:
+            entity_dict: The dictionary of the entity
+
+        Returns:
+            The created Entity
+        """
         template = None
         if "Template" in entity_dict:
             template = entity_dict["Template"]
@@ -360,6 +474,237 @@ class RPGWorld(World):
             raise ValueError("There is no identifier and no Template set."
                              "Can't create an Entity without an identifier.")
 
+    def save_entities_binary(self, filename, entities=None):
+        """Saves entities to a file in the compact binary format of
+        :mod:`fife_rpg.binary_entities`
+
+        Args:
+            filename: The path of the file
+
+            entities: The entities to save. If this is None all entities
+            of the world will be saved.
+        """
+        if entities is None:
+            entities = list(self.__entity_cache.values())
+        with open(filename, "wb") as save_file:
+            binary_entities.dump_entities(
+                (self.create_entity_dictionary(entity)
+                 for entity in entities),
+                save_file, self.create_entity_dictionary)
+
+    def load_entities_binary(self, filename):
+        """Reads entities from a file in the compact binary format of
+        :mod:`fife_rpg.binary_entities` and creates them
+
+        Args:
+            filename: The path of the file
+        """
+        with open(filename, "rb") as save_file:
+            compressed = save_file.read(2) == b"\x1f\x8b"
+        if compressed:
+            save_file = gzip.open(filename, "rb")
+        else:
+            save_file = open(filename, "rb")
+        with save_file:
+            for entity_dict in binary_entities.load_entities(
+                    save_file, self.create_entity_from_dictionary):
+                self.create_entity_from_dictionary(entity_dict)
+        self.update_identifier_numbers()
+
+    def create_snapshot(self, entities=None):
+        """Creates dictionaries of entities that share no mutable values
+        with the entities
+
+        Args:
+            entities: The entities to include. If this is None all
+            entities of the world will be included.
+
+        Returns:
+            A list with the dictionaries of the entities
+        """
+        if entities is None:
+            entities = list(self.__entity_cache.values())
+        return [self.create_entity_snapshot(entity) for entity in entities]
+
+    def create_entity_snapshot(self, entity, remove_default=True):
+        """Creates a dictionary of an entity that shares no mutable values
+        with the entity
+
+        Args:
+            entity: The Entity instance
+
+            remove_default: Skips fields whose value is the same as the
+            default value.
+
+        Returns:
+            The created dictionary
+        """
+        return autosave.snapshot_value(
+            self.create_entity_dictionary(entity, remove_default),
+            self.create_entity_snapshot)
+
+    def autosave(self, filename, binary=True, compress=False,
+                 progress_callback=None, done_callback=None):
+        """Takes a snapshot of all entities and writes it to a file in a
+        background thread. The callbacks are called during step.
+
+        Args:
+            filename: The path of the file
+
+            binary: Whether to use the binary format instead of yaml
+
+            compress: Whether to compress the file with gzip
+
+            progress_callback: Called with the number of written entities
+            and the total number of entities
+
+            done_callback: Called with the filename and the raised
+            exception, or None if the file was written
+
+        Returns:
+            True if the autosave was started, False if another autosave is
+            still running
+        """
+        if self.autosaver.is_saving:
+            return False
+        return self.autosaver.save(self.create_snapshot(), filename, binary,
+                                   compress, progress_callback,
+                                   done_callback)
+
+    def save_checkpoint(self, filename=None):
+        """Saves the entities to a save journal. The first checkpoint to a
+        file writes a full snapshot, later ones only append the entities
+        that changed since the last checkpoint to the journal.
+
+        Changes are detected through the saveable fields of the
+        components and the versions of their
+        :class:`fife_rpg.helpers.VersionedDict` values. Changes inside other
+        mutable values, such as adding an item to a set, need to be reported
+        with mark_entity_changed.
+
+        Args:
+            filename: The path of the snapshot file. If this is None the
+            file of the last checkpoint is used.
+        """
+        journal = self.__save_journal
+        if filename is not None and (journal is None or
+                                     journal.filename != filename):
+            journal = self.__save_journal = save_journal.SaveJournal(
+                filename, self.__journal_compact_threshold())
+            self.__start_tracking_changes()
+            self.__update_versioned_values()
+            journal.write_snapshot(self.create_snapshot())
+        elif journal is None:
+            raise ValueError("No save file set for the checkpoint")
+        elif journal.needs_compaction:
+            self.__update_versioned_values()
+            journal.write_snapshot(self.create_snapshot())
+        else:
+            self.__update_versioned_values()
+            journal.write_delta(
+                [self.create_entity_snapshot(entity, False)
+                 for entity in self.__changed_entities
+                 if entity in self.entities],
+                self.__deleted_identifiers)
+        self.__changed_entities = set()
+        self.__deleted_identifiers = set()
+
+    def load_checkpoint(self, filename):
+        """Reads the entities of a save journal and creates them. Following
+        checkpoints will be written to the same journal.
+
+        Args:
+            filename: The path of the snapshot file
+        """
+        journal = save_journal.SaveJournal(filename,
+                                           self.__journal_compact_threshold())
+        general_name = General.registered_as
+        for entity_dict in journal.load(
+                lambda entity_dict: (entity_dict["Components"][general_name]
+                                     ["identifier"]),
+                self.create_entity_from_dictionary):
+            self.create_entity_from_dictionary(entity_dict)
+        self.update_identifier_numbers()
+        self.__save_journal = journal
+        self.__start_tracking_changes()
+        self.__update_versioned_values()
+        self.__changed_entities = set()
+        self.__deleted_identifiers = set()
+
+    def mark_entity_changed(self, entity):
+        """Adds an entity to the entities that will be saved at the next
+        checkpoint. Entities that are not in the world anymore are ignored.
+
+        Args:
+            entity: The changed entity
+        """
+        if entity in self.entities:
+            self.__changed_entities.add(entity)
+
+    def __update_versioned_values(self):
+        """Marks the entities whose saveable
+        :class:`fife_rpg.helpers.VersionedDict` values were replaced or
+        changed since the last call as changed"""
+        last_values = self.__versioned_values
+        versioned_values = {}
+        for name, component in ComponentManager.get_components().items():
+            for field_name in component.saveable_fields:
+                field = component.fields[field_name]
+                if not issubclass(field.type, helpers.VersionedDict):
+                    continue
+                for entity in component.entities:
+                    value = getattr(component[entity], field_name)
+                    key = (entity, name, field_name)
+                    last = last_values.get(key)
+                    if (last is None or last[0] is not value or
+                            last[1] != value.version):
+                        self.__changed_entities.add(entity)
+                    versioned_values[key] = (value, value.version)
+        self.__versioned_values = versioned_values
+
+    def __journal_compact_threshold(self):
+        """Returns the number of deltas after which a save journal is
+        compacted"""
+        return int(self.application.settings.get(
+            "fife-rpg", "JournalCompactThreshold", 50))
+
+    def __start_tracking_changes(self):
+        """Adds the listeners that record the entities that changed since
+        the last checkpoint"""
+        if self.__tracking_changes:
+            return
+        self.__tracking_changes = True
+        for component in ComponentManager.get_components().values():
+            component.add_entity_listener(self.mark_entity_changed)
+            component.add_remove_listener(self.mark_entity_changed)
+            self.__listener_removers.append(
+                partial(component.remove_entity_listener,
+                        self.mark_entity_changed))
+            self.__listener_removers.append(
+                partial(component.remove_remove_listener,
+                        self.mark_entity_changed))
+            for field_name in component.saveable_fields:
+                component.add_field_listener(field_name,
+                                             self.cb_saveable_field_changed)
+                self.__listener_removers.append(
+                    partial(component.remove_field_listener, field_name,
+                            self.cb_saveable_field_changed))
+
+    def cb_saveable_field_changed(self, entity, field_name, old_value,
+                                  new_value):
+        """Called when a saveable field of a component changes
+
+        Args:
+            entity: The entity whose field changed
+
+            field_name: The name of the field
+
+            old_value: The value before the change
+
+            new_value: The value after the change
+        """
+        self.mark_entity_changed(entity)
+
     def clear(self):
         """Clear the world, remove all entities"""
         self.object_db = {}
@@ -377,6 +722,10 @@ class RPGWorld(World):
                 The entity that should be deleted.
         """
         del self.__entity_cache[entity.identifier]
+        self.__entities_module_changed = True
+        if self.__tracking_changes:
+            self.__changed_entities.discard(entity)
+            self.__deleted_identifiers.add(entity.identifier)
         for callback in self._entity_delete_callbacks:
             callback(entity)
 
@@ -397,9 +746,12 @@ class RPGWorld(World):
         entity = self.get_entity(old_identifier)
         new_identifier = self.create_unique_identifier(new_identifier)
         del self.__entity_cache[old_identifier]
+        if self.__tracking_changes:
+            self.__deleted_identifiers.add(old_identifier)
         comp_data = getattr(entity, General.registered_as)
         setattr(comp_data, "identifier", new_identifier)
         self.__entity_cache[new_identifier] = entity
+        self.__entities_module_changed = True
         return new_identifier
 
 
@@ -410,7 +762,85 @@ class RPGWorld(World):
             time_delta: Time that passed since the last call
         """
         World.step(self, time_delta)
+        self.autosaver.step()
         checkers = ComponentManager.get_checkers()
-        for names, callback in checkers:
-            for components in self.components.join(*names):
-                callback(*components)
+        for names, callback, watched_fields, on_enter in checkers:
+            if watched_fields is None:
+                for components in self.components.join(*names):
+                    callback(*components)
+                continue
+            queue = self.get_checker_queue(names, callback, watched_fields,
+                                           on_enter)
+            if not queue.entities:
+                continue
+            components = [getattr(self.components, name) for name in names]
+            for entity in queue.pop_entities():
+                if all(entity in component.entities
+                       for component in components):
+                    callback(*[component[entity] for component in components])
+
+    def destroy(self):
+        """Removes the listeners that the world added to the components.
+        The component instances are shared by all worlds, so this has to be
+        called before the world is replaced."""
+        for remove_listener in self.__listener_removers:
+            remove_listener()
+        self.__listener_removers = []
+        self.__checker_queues = {}
+        self.__save_journal = None
+        self.__tracking_changes = False
+        self.__changed_entities = set()
+        self.__deleted_identifiers = set()
+
+    def create_checker_queues(self):
+        """Creates the queues of the registered checkers with watched fields,
+        so that changes made before the first step are not missed. Queues of
+        checkers registered later are created on the next step."""
+        for names, callback, watched_fields, on_enter in (
+                ComponentManager.get_checkers()):
+            if watched_fields is not None:
+                self.get_checker_queue(names, callback, watched_fields,
+                                       on_enter)
+
+    def get_checker_queue(self, names, callback, watched_fields, on_enter):
+        """Returns the queue of a checker with watched fields. The queue is
+        created and attached to the components the first time.
+
+        Args:
+            names: The names of the components the checker checks
+
+            callback: The checker function
+
+            watched_fields: A dictionary of component names to the fields
+            that trigger the checker
+
+            on_enter: Whether the checker is called for entities that got all
+            of the checked components
+
+        Returns:
+            A :class:`CheckerQueue`
+        """
+        key = (tuple(names), callback)
+        if key in self.__checker_queues:
+            return self.__checker_queues[key]
+        queue = self.__checker_queues[key] = CheckerQueue()
+        for component_name, field_names in watched_fields.items():
+            component = getattr(self.components, component_name)
+            for field_name in field_names:
+                component.add_field_listener(field_name, queue.add_entity)
+                self.__listener_removers.append(
+                    partial(component.remove_field_listener, field_name,
+                            queue.add_entity))
+        if on_enter:
+            for name in names:
+                component = getattr(self.components, name)
+                component.add_entity_listener(queue.add_entity)
+                self.__listener_removers.append(
+                    partial(component.remove_entity_listener,
+                            queue.add_entity))
+            components = [getattr(self.components, name) for name in names]
+            entities = set(components[0].entities)
+            for component in components[1:]:
+                entities &= component.entities
+            queue.entities.update(entities)
+        return queue
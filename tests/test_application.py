@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+import unittest
+
+from fife import fife
+from fife.fife import DoubleRect
+
+from fife_rpg.behaviours import AGENT_STATES
+from fife_rpg.components import ComponentManager
+from fife_rpg.components.agent import Agent
+from fife_rpg.components.fifeagent import FifeAgent
+from fife_rpg.gamemap import GameMap
+from fife_rpg.rpg_application import base
+from fife_rpg.rpg_application.base import RPGApplication
+from fife_rpg.systems import SystemManager
+
+TEST_LAYER = "TestLayer"
+
+# Dummy classes
+
+
+class Settings(object):
+    """Dummy class that acts like the settings as needed"""
+
+    def __init__(self, values=None):
+        self.values = values or {}
+
+    def get(self, section, name, default=None):  # pylint: disable=W0613
+        return self.values.get(name, default)
+
+
+class FifeCamera(object):
+    """Dummy class that acts like a fife camera as needed"""
+
+    def __init__(self):
+        self.enabled = False
+
+    def isEnabled(self):
+        return self.enabled
+
+    def setEnabled(self, value):
+        self.enabled = value
+
+
+class FifeLayer(object):
+    """Dummy class that acts like a fife layer as needed"""
+
+    def __init__(self):
+        self.deleted = []
+
+    def getInstance(self, identifier):
+        return identifier
+
+    def deleteInstance(self, instance):
+        self.deleted.append(instance)
+
+
+class FifeMap(fife.Map):
+    """Dummy class that acts like a loaded fife map as needed"""
+
+    def __init__(self, identifier):  # pylint: disable=W0231
+        self.identifier = identifier
+        self.camera = FifeCamera()
+        self.layers = {TEST_LAYER: FifeLayer()}
+
+    def getId(self):
+        return self.identifier
+
+    def getCamera(self, name=None):  # pylint: disable=W0613
+        return self.camera
+
+    def getCameras(self):
+        return [self.camera]
+
+    def getLayer(self, name):
+        return self.layers[name]
+
+    def getFilename(self):
+        return "maps/%s.xml" % self.identifier
+
+
+class FifeModel(object):
+    """Dummy class that acts like a fife model as needed"""
+
+    def __init__(self):
+        self.deleted = []
+
+    def deleteMap(self, fife_map):
+        self.deleted.append(fife_map.getId())
+
+
+class Engine(object):
+    """Dummy class that acts like a fife engine as needed"""
+
+    def __init__(self):
+        self.model = FifeModel()
+
+    def getModel(self):
+        return self.model
+
+
+class FifeInstance(object):
+    """Dummy class that acts like a fife instance as needed"""
+
+    def __init__(self, identifier):
+        self.identifier = identifier
+        self.listeners = []
+
+    def getId(self):
+        return self.identifier
+
+    def addChangeListener(self, listener):
+        self.listeners.append(listener)
+
+    def move(self, info):
+        for listener in self.listeners:
+            listener.onInstanceChanged(self, info)
+
+
+class Behaviour(object):
+    """Dummy class that acts like an agent behaviour as needed"""
+
+    def __init__(self, state):
+        self.state = state
+        self.location = fife.ExactModelCoordinate(0, 0, 0)
+        self.rotation = 0
+
+
+class Application(RPGApplication):
+    """Dummy class that acts like an RPGApplication as needed, without an
+    engine"""
+
+    def __init__(self, settings=None):  # pylint: disable=W0231
+        self._setting = settings or Settings()
+        self.world = None
+        self._maps = {}
+        self._current_map = None
+        self._changed_agents = set()
+        self._applying_agent_changes = False
+        self._region_entered_callbacks = []
+        self._region_exited_callbacks = []
+        self._loaded_maps = OrderedDict()
+        self._preload_agent = None
+        self._preload_distance = None
+        self._preload_cell = None
+        self._move_agents_changed = False
+        self.predictions = []
+        self.engine = Engine()
+        self.updated_agents = []
+
+    def predict_map_transitions(self, agent_name=None, distance=None):
+        self.predictions.append((agent_name, distance))
+        return []
+
+    def update_agents(self, game_map, entities=None):
+        game_map.update_entities()
+        self.updated_agents.append(set(entities))
+
+
+# Test cases
+
+
+class TestApplication(unittest.TestCase):
+
+    def setUp(self):
+        self.application = Application()
+        self.application.create_world()
+        self.world = self.application.world
+        for name in ("Town", "Forest", "Cave", "Castle"):
+            self.application.add_map(name, GameMap(FifeMap(name), name,
+                                                   "Default", {},
+                                                   self.application))
+        self.application._current_map = self.application.maps["Town"]
+
+    def tearDown(self):
+        for entity in list(self.world.entities):
+            entity.delete()
+        ComponentManager.clear_components()
+        ComponentManager.clear_checkers()
+        SystemManager.clear_systems()
+
+    def create_agent(self, identifier, map_name="Town", position=(0, 0, 0)):
+        return self.world.get_or_create_entity(
+            identifier, {Agent.registered_as: {"map": map_name,
+                                               "layer": TEST_LAYER,
+                                               "position": position}})
+
+    def test_queued_agents(self):
+        first = self.create_agent("First")
+        second = self.create_agent("Second")
+        self.application.check_agent_changes()
+        self.assertEqual(self.application.updated_agents, [{first, second}],
+                         "New agents are not reconciled")
+        self.application.check_agent_changes()
+        self.assertEqual(len(self.application.updated_agents), 1,
+                         "Unchanged agents are reconciled")
+        getattr(first, Agent.registered_as).gfx = "changed"
+        self.application.check_agent_changes()
+        self.assertEqual(self.application.updated_agents[-1], {first},
+                         "Changed agents are not reconciled")
+        getattr(first, Agent.registered_as).rotation = 90
+        self.application.check_agent_changes()
+        self.assertEqual(len(self.application.updated_agents), 2,
+                         "Agents with unwatched changes are reconciled")
+        setattr(second, Agent.registered_as,
+                getattr(first, Agent.registered_as))
+        self.application.check_agent_changes()
+        self.assertEqual(self.application.updated_agents[-1], {second},
+                         "Agents whose data was replaced are not reconciled")
+
+    def test_new_map(self):
+        entity = self.create_agent("Mover")
+        self.application.check_agent_changes()
+        game_map = self.application.maps["Town"]
+        layer = game_map.get_layer(TEST_LAYER)
+        fifeagent = getattr(entity, FifeAgent.registered_as)
+        fifeagent.layer = layer
+        fifeagent.instance = "Mover"
+        agent = getattr(entity, Agent.registered_as)
+        agent.new_map = "Forest"
+        agent.new_position = (5, 6, 0)
+        agent.new_rotation = 180
+        self.application.check_agent_changes()
+        self.assertEqual(layer.deleted, ["Mover"],
+                         "The instance was not removed from the old map")
+        self.assertEqual(agent.map, "Forest")
+        self.assertEqual((agent.position.x, agent.position.y), (5, 6))
+        self.assertEqual(agent.rotation, 180)
+        self.assertIsNone(agent.new_map)
+        self.assertIsNone(agent.new_position)
+        self.assertNotIn(entity, game_map.entities)
+        updated_count = len(self.application.updated_agents)
+        self.application.check_agent_changes()
+        self.assertEqual(len(self.application.updated_agents), updated_count,
+                         "Agents were queued again by the applied changes")
+        agent.new_map = "Town"
+        self.application.check_agent_changes()
+        self.assertEqual(agent.map, "Town")
+        self.application.check_agent_changes()
+        self.assertEqual(len(self.application.updated_agents),
+                         updated_count + 1,
+                         "Agents were queued again by the applied changes")
+
+    def test_moved_instances(self):
+        game_map = self.application.maps["Town"]
+        moved = self.create_agent("Moved")
+        still = self.create_agent("Still")
+        game_map.update_entities()
+        instances = {}
+        for entity in (moved, still):
+            fifeagent = getattr(entity, FifeAgent.registered_as)
+            fifeagent.behaviour = Behaviour(AGENT_STATES.WALK)
+            fifeagent.behaviour.location = fife.ExactModelCoordinate(3, 4, 0)
+            fifeagent.behaviour.rotation = 90
+            instances[entity] = FifeInstance(entity.identifier)
+            game_map.watch_instance(instances[entity])
+        instances[moved].move(fife.ICHANGE_LOC | fife.ICHANGE_ROTATION)
+        instances[still].move(fife.ICHANGE_SPEED)
+        game_map.update_entitities_agent()
+        agent = getattr(moved, Agent.registered_as)
+        self.assertEqual((agent.position.x, agent.position.y), (3, 4))
+        self.assertEqual(agent.rotation, 90)
+        agent = getattr(still, Agent.registered_as)
+        self.assertEqual((agent.position.x, agent.position.y), (0, 0),
+                         "An agent whose instance did not move was updated")
+        agent = getattr(moved, Agent.registered_as)
+        agent.position = (1, 1, 0)
+        game_map.update_entitities_agent()
+        self.assertEqual((agent.position.x, agent.position.y), (1, 1),
+                         "An agent was updated twice for one move")
+
+    def test_region_callbacks(self):
+        game_map = self.application.maps["Town"]
+        game_map.set_region("Gate", DoubleRect(0, 0, 10, 10))
+        game_map.set_region("Square", DoubleRect(0, 0, 20, 20))
+        entity = self.create_agent("Walker", position=(50, 50, 0))
+        events = []
+        self.application.add_region_entered_callback(
+            lambda *args: events.append(("entered",) + args))
+        self.application.add_region_exited_callback(
+            lambda *args: events.append(("exited",) + args))
+        self.application.check_region_changes()
+        self.assertEqual([], events)
+        agent = getattr(entity, Agent.registered_as)
+        agent.position = (5, 5, 0)
+        self.application.check_region_changes()
+        self.assertEqual(events, [("entered", "Town", "Walker", "Gate"),
+                                  ("entered", "Town", "Walker", "Square")])
+        del events[:]
+        agent.position = (15, 15, 0)
+        self.application.check_region_changes()
+        self.assertEqual(events, [("exited", "Town", "Walker", "Gate")])
+        del events[:]
+        agent.map = "Forest"
+        self.application.check_region_changes()
+        self.assertEqual(events, [("exited", "Town", "Walker", "Square")])
+
+    def mark_maps_loaded(self, *names):
+        for name in names:
+            self.application._loaded_maps[name] = 0
+
+    def test_unload_unused_maps(self):
+        self.application.settings.values["MaxLoadedMaps"] = 3
+        self.mark_maps_loaded("Town", "Forest", "Cave", "Castle")
+        self.assertEqual(["Forest"], self.application.unload_unused_maps(),
+                         "The least recently used map was not unloaded")
+        self.assertFalse(self.application.maps["Forest"].is_loaded)
+        self.assertTrue(self.application.maps["Town"].is_loaded,
+                        "The current map was unloaded")
+        self.assertEqual(["Forest"], self.application.engine.model.deleted)
+        self.assertEqual(["Town", "Cave", "Castle"],
+                         list(self.application._loaded_maps))
+        self.assertEqual([], self.application.unload_unused_maps())
+
+    def test_unload_unused_maps_memory(self):
+        self.application.settings.values["MaxLoadedMapsMemory"] = 100
+        self.mark_maps_loaded("Town", "Forest", "Cave")
+        memory_usage = [200 * 1024 * 1024]
+        get_memory_usage = base.get_memory_usage
+        base.get_memory_usage = lambda: memory_usage[0]
+        try:
+            self.assertEqual(["Forest"], self.application.unload_unused_maps(),
+                             "More than one map was unloaded per call")
+            self.assertEqual(["Cave"], self.application.unload_unused_maps())
+            self.assertEqual([], self.application.unload_unused_maps(),
+                             "The current map was unloaded")
+            self.mark_maps_loaded("Castle")
+            memory_usage[0] = 50 * 1024 * 1024
+            self.assertEqual([], self.application.unload_unused_maps(),
+                             "A map was unloaded below the memory limit")
+            memory_usage[0] = None
+            self.assertEqual([], self.application.unload_unused_maps(),
+                             "A map was unloaded without a memory usage")
+        finally:
+            base.get_memory_usage = get_memory_usage
+
+    def test_preload_agent_idle(self):
+        self.assertTrue(self.application.is_preload_agent_idle())
+        self.application._preload_agent = "Player"
+        self.assertTrue(self.application.is_preload_agent_idle(),
+                        "A missing agent is not idle")
+        entity = self.create_agent("Player")
+        self.assertTrue(self.application.is_preload_agent_idle(),
+                        "An agent without a behaviour is not idle")
+        fifeagent = getattr(entity, FifeAgent.registered_as)
+        fifeagent.behaviour = Behaviour(AGENT_STATES.WALK)
+        self.assertFalse(self.application.is_preload_agent_idle(),
+                         "A walking agent is idle")
+        fifeagent.behaviour.state = AGENT_STATES.IDLE
+        self.assertTrue(self.application.is_preload_agent_idle())
+
+    def test_preload_prediction(self):
+        self.application._preload_agent = "Player"
+        entity = self.create_agent("Player", position=(1, 1, 0))
+        self.application.preload_predicted_maps()
+        self.assertEqual(1, len(self.application.predictions))
+        self.application.check_preload_prediction()
+        agent = getattr(entity, Agent.registered_as)
+        agent.position = (2, 2, 0)
+        self.application.check_preload_prediction()
+        self.assertEqual(1, len(self.application.predictions),
+                         "The maps were predicted again inside a cell")
+        agent.position = (9, 1, 0)
+        self.application.check_preload_prediction()
+        self.assertEqual(2, len(self.application.predictions),
+                         "The maps were not predicted in a new cell")
+        self.application.cb_move_agent_changed(entity)
+        self.application.check_preload_prediction()
+        self.assertEqual(3, len(self.application.predictions),
+                         "The maps were not predicted after a MoveAgent "
+                         "changed")
+        self.application.check_preload_prediction()
+        self.assertEqual(3, len(self.application.predictions))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from fife.fife import DoublePoint3D
+
+from fife_rpg import autosave, binary_entities
+
+
+class TestAutosave(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "saves", "auto.sav")
+        self.progress = []
+        self.done = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_snapshot(self):
+        position = DoublePoint3D(1, 2, 3)
+        knows = set(["Town"])
+        value = {"position": position, "knows": knows, "list": [knows]}
+        snapshot = autosave.snapshot_value(value, None)
+        position.x = 5
+        knows.add("Castle")
+        self.assertEqual(1, snapshot["position"].x)
+        self.assertEqual(set(["Town"]), snapshot["knows"])
+        self.assertEqual([set(["Town"])], snapshot["list"])
+
+    def test_save(self):
+        entities = [{"Components": {"General": {"identifier": "e%d" % i}}}
+                    for i in range(3)]
+        saver = autosave.Autosaver()
+        self.assertTrue(saver.save(entities, self.filename, compress=True,
+                                   progress_callback=self.cb_progress,
+                                   done_callback=self.cb_done))
+        self.assertFalse(saver.save(entities, self.filename))
+        saver.wait()
+        self.assertFalse(saver.is_saving)
+        self.assertEqual([(self.filename, None)], self.done)
+        self.assertEqual((3, 3), self.progress[-1])
+        self.assertFalse(os.path.exists(self.filename + ".tmp"))
+        with gzip.open(self.filename, "rb") as save_file:
+            self.assertEqual(entities,
+                             list(binary_entities.load_entities(save_file)))
+
+    def test_save_error(self):
+        saver = autosave.Autosaver()
+        saver.save([{"Components": {"General": {"identifier": object()}}}],
+                   self.filename, done_callback=self.cb_done)
+        saver.wait()
+        self.assertIsInstance(self.done[0][1],
+                              binary_entities.BinaryFormatError)
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertFalse(os.path.exists(self.filename + ".tmp"))
+
+    def cb_progress(self, saved, total):
+        self.progress.append((saved, total))
+
+    def cb_done(self, filename, error):
+        self.done.append((filename, error))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from io import BytesIO, StringIO
+
+from fife_rpg import binary_entities
+from fife_rpg.helpers import DoublePoint3DYaml
+
+ENTITIES_YAML = u"""\
+--- !Entity
+Components:
+    General:
+        identifier: PlayerCharacter
+    Agent:
+        map: Level1
+        layer: actors
+        position: [1.5, 2.0, 0.0]
+        knows: !!set {Town: null}
+        behaviour_args: {}
+--- !Entity
+Template: Chest
+Components:
+    Container:
+        children: [null, null, 3]
+        max_bulk: 100
+"""
+
+
+class TestBinaryEntities(unittest.TestCase):
+
+    def setUp(self):
+        self.entities = [
+            {"Components": {"General": {"identifier": u"PlayerCharacter"},
+                            "Agent": {"map": u"Level1",
+                                      "position": DoublePoint3DYaml(1.5, 2,
+                                                                    0),
+                                      "rotation": -90,
+                                      "knows": set(["Town"]),
+                                      "behaviour_args": {}}}},
+            {"Template": u"Chest",
+             "Components": {"Container": {"children": [None, None, 3],
+                                          "max_bulk": 2 ** 70,
+                                          "weight": 1.25,
+                                          "locked": False}}},
+        ]
+
+    def test_round_trip(self):
+        stream = BytesIO()
+        binary_entities.dump_entities(self.entities, stream)
+        stream.seek(0)
+        loaded = list(binary_entities.load_entities(stream))
+        self.assertEqual(self.entities, loaded)
+        position = loaded[0]["Components"]["Agent"]["position"]
+        self.assertEqual((position.x, position.y, position.z),
+                         (1.5, 2, 0))
+
+    def test_non_ascii(self):
+        entity = {"Components": {u"Beschreibung": {u"name": u"Tür",
+                                                   u"größe": 2}}}
+        stream = BytesIO()
+        binary_entities.dump_entities([entity], stream)
+        stream.seek(0)
+        self.assertEqual([entity],
+                         list(binary_entities.load_entities(stream)))
+
+    def test_invalid_header(self):
+        self.assertRaises(binary_entities.BinaryFormatError,
+                          binary_entities.load_entities,
+                          BytesIO(b"--- !Entity"))
+
+    def test_convert(self):
+        binary_stream = BytesIO()
+        binary_entities.yaml_to_binary(ENTITIES_YAML, binary_stream)
+        binary_stream.seek(0)
+        yaml_data = binary_entities.binary_to_yaml(binary_stream)
+        binary_stream = BytesIO()
+        binary_entities.yaml_to_binary(StringIO(yaml_data), binary_stream)
+        binary_stream.seek(0)
+        entities = list(binary_entities.load_entities(binary_stream))
+        self.assertEqual(2, len(entities))
+        agent = entities[0]["Components"]["Agent"]
+        self.assertEqual([1.5, 2.0, 0.0], agent["position"])
+        self.assertEqual(set(["Town"]), agent["knows"])
+        self.assertEqual("Chest", entities[1]["Template"])
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from fife_rpg.components import ComponentManager
+from fife_rpg.components import lockable
+from fife_rpg.components.fifeagent import FifeAgent
+from fife_rpg.systems import SystemManager
+from fife_rpg.world import RPGWorld
+
+# Dummy classes
+
+
+class Settings(object):
+    """Dummy class that acts like the settings as needed"""
+
+    def get(self, section, name, default=None):  # pylint: disable=W0613
+        return default
+
+
+class Application(object):
+    """Dummy class that acts like an RPGApplication as needed"""
+
+    def __init__(self):
+        self.settings = Settings()
+        self.engine = None
+
+
+class Behaviour(object):
+    """Dummy class that acts like a behaviour as needed"""
+
+    def __init__(self):
+        self.actions = []
+
+    def act(self, action, repeating=False):
+        self.actions.append((action, repeating))
+
+
+# Test cases
+
+
+class TestCheckers(unittest.TestCase):
+
+    def setUp(self):
+        ComponentManager.clear_checkers()
+        lockable.Lockable.register()
+        if not FifeAgent.registered_as:
+            FifeAgent.register()
+        self.calls = []
+
+    def tearDown(self):
+        ComponentManager.clear_components()
+        ComponentManager.clear_checkers()
+        SystemManager.clear_systems()
+
+    def check_locked(self, lock):
+        self.calls.append(lock.locked)
+
+    def create_lock(self, world, identifier, behaviour=None):
+        return world.get_or_create_entity(
+            identifier, {lockable.Lockable.registered_as: {"closed": True},
+                         FifeAgent.registered_as: {"behaviour": behaviour}})
+
+    def test_edge_triggered(self):
+        ComponentManager.register_checker(
+            (lockable.Lockable.registered_as,), self.check_locked,
+            {lockable.Lockable.registered_as: ["locked"]})
+        world = RPGWorld(Application())
+        lock = self.create_lock(world, "EdgeLock")
+        lock_data = getattr(lock, lockable.Lockable.registered_as)
+        lock_data.locked = True
+        world.step(0)
+        self.assertEqual(self.calls, [True],
+                         "A change before the first step was missed")
+        world.step(0)
+        self.assertEqual(self.calls, [True],
+                         "The checker ran without a change")
+        lock_data.closed = False
+        world.step(0)
+        self.assertEqual(self.calls, [True],
+                         "The checker ran for an unwatched field")
+        lock_data.locked = False
+        lock_data.locked = True
+        world.step(0)
+        self.assertEqual(self.calls, [True, True],
+                         "The checker did not run once for the changes")
+
+    def test_lockable_checker(self):
+        lockable.register_checkers()
+        world = RPGWorld(Application())
+        behaviour = Behaviour()
+        lock = self.create_lock(world, "Door", behaviour)
+        self.create_lock(world, "Gate")
+        world.step(0)
+        self.assertEqual(behaviour.actions, [("closed", True)],
+                         "The checker did not run for a new lockable")
+        world.step(0)
+        self.assertEqual(len(behaviour.actions), 1,
+                         "The checker ran without a change")
+        getattr(lock, lockable.Lockable.registered_as).closed = False
+        world.step(0)
+        self.assertEqual(behaviour.actions[-1], ("opened", True),
+                         "The checker did not run after opening the lock")
+        getattr(lock, lockable.Lockable.registered_as).locked = True
+        world.step(0)
+        self.assertEqual(len(behaviour.actions), 2,
+                         "The checker ran for an unwatched field")
+        new_behaviour = Behaviour()
+        getattr(lock, FifeAgent.registered_as).behaviour = new_behaviour
+        world.step(0)
+        self.assertEqual(new_behaviour.actions, [("opened", True)],
+                         "The checker did not run for a new behaviour")
+
+    def test_replaced_world(self):
+        watched_fields = {lockable.Lockable.registered_as: ["locked"]}
+        names = (lockable.Lockable.registered_as,)
+        ComponentManager.register_checker(names, self.check_locked,
+                                          watched_fields, on_enter=True)
+        first_world = RPGWorld(Application())
+        queue = first_world.get_checker_queue(names, self.check_locked,
+                                              watched_fields, True)
+        first_world.destroy()
+        second_world = RPGWorld(Application())
+        lock = self.create_lock(second_world, "ReplacedLock")
+        getattr(lock, lockable.Lockable.registered_as).locked = True
+        self.assertEqual(set(), queue.entities,
+                         "The queue of the replaced world was filled")
+        second_world.step(0)
+        self.assertEqual(self.calls, [True])
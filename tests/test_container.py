@@ -16,6 +16,7 @@ import unittest
 
 from bGrease.world import BaseWorld
 
+from fife_rpg.components import ComponentManager
 from fife_rpg.entities import RPGEntity
 from fife_rpg.components import containable, container, general
 
@@ -29,11 +30,11 @@ class TestContainer(unittest.TestCase):
         def configure(self):
             """Set up the world"""
             self.components.general = general.General()
-            general.General.registered_as = "general"
+            general.General.register("general")
             self.components.containable = containable.Containable()
-            containable.Containable.registered_as = "containable"
+            containable.Containable.register("containable")
             self.components.container = container.Container()
-            container.Container.registered_as = "container"
+            container.Container.register("container")
 
         def get_entity(self, identifier):
             """Returns the entity with the identifier
@@ -50,24 +51,40 @@ class TestContainer(unittest.TestCase):
                 return entities.pop()
             return None
 
+    class SharedWorld(BaseWorld):
+
+        """World that uses the component instances of another world"""
+
+        def __init__(self, world):
+            self.shared_world = world
+            BaseWorld.__init__(self)
+
+        def configure(self):
+            """Set up the world"""
+            for name in ("general", "containable", "container"):
+                setattr(self.components, name,
+                        getattr(self.shared_world.components, name))
+
     class Inventory(RPGEntity):
 
         """Enity representing an Iventory"""
 
-        def __init__(self, world, identifier, max_bulk, max_slots):
-            RPGEntity.__init__(self, world, identifier)
-            self.container.max_bulk = max_bulk
-            self.container.max_slots = max_slots
+        def __new__(cls, world, identifier, max_bulk, max_slots):
+            entity = RPGEntity.__new__(cls, world, identifier)
+            entity.container.max_bulk = max_bulk
+            entity.container.max_slots = max_slots
+            return entity
 
     class Item(RPGEntity):
 
-        def __init__(self, world, identifier, bulk, max_stack=1,
-                     start_stack=1, item_type=""):
-            RPGEntity.__init__(self, world, identifier)
-            self.containable.bulk = bulk
-            self.containable.max_stack = max_stack
-            self.containable.current_stack = start_stack
-            self.containable.item_type = item_type
+        def __new__(cls, world, identifier, bulk, max_stack=1,
+                    start_stack=1, item_type=""):
+            entity = RPGEntity.__new__(cls, world, identifier)
+            entity.containable.bulk = bulk
+            entity.containable.max_stack = max_stack
+            entity.containable.current_stack = start_stack
+            entity.containable.item_type = item_type
+            return entity
 
     def reset_gold(self):
         self.gold_1 = self.Item(self.world, "gold_1", 0.25, 100, 20, "Gold")
@@ -104,6 +121,7 @@ class TestContainer(unittest.TestCase):
                                      "Gold")
 
     def tearDown(self):
+        ComponentManager.clear_components()
         self.dagger_1 = None
         self.sword_1 = None
         self.axe_1 = None
@@ -163,6 +181,8 @@ class TestContainer(unittest.TestCase):
         container.put_item(self.inv_no_slots, self.mace_1, 5)
         self.assertEqual(self.mace_1.containable.slot, 2)
         self.assertEqual(container.take_item(self.inv_no_slots, 1), self.axe_2)
+        self.assertEqual(self.mace_1.containable.slot, 2)
+        container.compact_slots(self.inv_no_slots)
         self.assertEqual(self.mace_1.containable.slot, 1)
         self.assertEqual(container.take_item(self.inv_no_slots, 1),
                          self.mace_1)
@@ -297,3 +317,178 @@ class TestContainer(unittest.TestCase):
                           self.inv_25, self.gold_2, 1)
         self.assertEqual(self.gold_3.containable.current_stack, 80)
         self.assertEqual(self.gold_2.containable.current_stack, 50)
+
+    def test_ItemIndex(self):
+        self.assertListEqual(container.get_items(self.inv_25), [])
+        container.put_item(self.inv_25, self.sword_1)
+        container.put_item(self.inv_25, self.paper_1)
+        self.assertEqual(len(container.get_items(self.inv_25)), 2)
+        self.assertListEqual(container.get_items(self.inv_25, "Paper"),
+                             [self.paper_1])
+        self.paper_1.containable.container = self.inv_15.identifier
+        self.assertListEqual(container.get_items(self.inv_25),
+                             [self.sword_1])
+        self.assertListEqual(container.get_items(self.inv_15, "Paper"),
+                             [self.paper_1])
+        self.sword_1.delete()
+        self.assertListEqual(container.get_items(self.inv_25), [])
+
+    def test_ReplacedWorld(self):
+        container.put_item(self.inv_25, self.sword_1)
+        self.assertAlmostEqual(container.get_total_bulk(self.inv_25), 4)
+        world = self.SharedWorld(self.world)
+        inventory = self.Inventory(world, "inv_25", 25, 10)
+        self.assertListEqual(container.get_items(inventory), [])
+        self.assertEqual(container.get_total_bulk(inventory), 0)
+        self.assertEqual(container.get_free_slot(inventory), 0)
+        self.sword_1.containable.slot = 2
+        dagger = self.Item(world, "dagger_1", 2)
+        container.put_item(inventory, dagger)
+        self.assertListEqual(container.get_items(inventory), [dagger])
+        self.assertAlmostEqual(container.get_total_bulk(inventory), 2)
+
+    def test_Totals(self):
+        container.put_item(self.inv_25, self.sword_1)
+        container.put_item(self.inv_25, self.paper_1)
+        self.assertAlmostEqual(container.get_total_bulk(self.inv_25), 4.5)
+        self.paper_1.containable.current_stack = 10
+        self.assertAlmostEqual(container.get_total_bulk(self.inv_25), 5)
+        self.sword_1.containable.weight = 3
+        self.assertEqual(container.get_total_weight(self.inv_25), 3)
+        self.assertEqual(container.get_item(self.inv_25, 1), self.paper_1)
+        self.paper_1.containable.slot = 5
+        self.assertIsNone(container.get_item(self.inv_25, 1))
+        self.assertEqual(container.get_item(self.inv_25, 5), self.paper_1)
+        self.sword_1.delete()
+        self.assertAlmostEqual(container.get_total_bulk(self.inv_25), 1)
+        self.assertEqual(container.get_total_weight(self.inv_25), 0)
+
+    def test_FreeSlots(self):
+        container.put_item(self.inv_25, self.dagger_1)
+        container.put_item(self.inv_25, self.sword_1)
+        container.put_item(self.inv_25, self.axe_1, 4)
+        self.assertEqual(container.get_free_slot(self.inv_25), 2)
+        container.take_item(self.inv_25, 0)
+        self.assertEqual(container.get_free_slot(self.inv_25), 0)
+        container.put_item(self.inv_25, self.dagger_2)
+        self.assertEqual(self.dagger_2.containable.slot, 0)
+        self.assertEqual(container.get_free_slot(self.inv_25), 2)
+        container.put_item(self.inv_no_slots, self.dagger_1)
+        container.put_item(self.inv_no_slots, self.sword_2)
+        container.put_item(self.inv_no_slots, self.mace_1)
+        container.take_item(self.inv_no_slots, 0)
+        self.assertEqual(container.get_free_slot(self.inv_no_slots), 0)
+        container.take_item(self.inv_no_slots, 1)
+        self.assertEqual(self.mace_1.containable.slot, 0)
+        self.assertEqual(container.get_free_slot(self.inv_no_slots), 1)
+
+    def test_Move(self):
+        container.put_item(self.inv_25, self.dagger_1)
+        container.put_item(self.inv_25, self.axe_1, 6)
+        container.put_item(self.inv_no_slots, self.mace_1)
+        container.put_item(self.inv_no_slots, self.axe_1)
+        self.assertEqual(self.axe_1.containable.container, "inv_no_slots")
+        self.assertEqual(self.axe_1.containable.slot, 1)
+        self.assertIsNone(container.get_item(self.inv_25, 6))
+        self.assertEqual(container.get_free_slot(self.inv_25), 1)
+        index = container.get_index(self.inv_no_slots)
+        self.assertEqual(index.end_slot, 2)
+        container.put_item(self.inv_25, self.sword_1, 8)
+        container.transfer_items(
+            self.inv_25, self.inv_no_slots,
+            lambda item: item.containable.bulk > 2)
+        self.assertEqual(self.sword_1.containable.slot, 2)
+        self.assertEqual(index.end_slot, 3,
+                         "The item was indexed at its old slot")
+        self.assertEqual(container.get_free_slot(self.inv_no_slots), 3)
+
+    def test_Transfer(self):
+        container.put_item(self.inv_25, self.gold_1)
+        container.put_item(self.inv_25, self.sword_1)
+        container.put_item(self.inv_25, self.gold_3, 2)
+        container.put_item(self.inv_25, self.paper_1)
+        container.put_item(self.inv_no_slots, self.gold_4)
+        container.put_item(self.inv_no_slots, self.dagger_1)
+        emptied = container.transfer_items(
+            self.inv_25, self.inv_no_slots,
+            lambda item: item.containable.item_type == "Gold")
+        self.assertListEqual(emptied, [self.gold_1])
+        self.assertEqual(self.gold_1.containable.container, "")
+        self.assertEqual(self.gold_4.containable.current_stack, 100)
+        self.assertEqual(self.gold_3.containable.current_stack, 20)
+        self.assertEqual(self.gold_3.containable.container, "inv_no_slots")
+        self.assertEqual(self.gold_3.containable.slot, 2)
+        self.assertEqual(len(container.get_items(self.inv_25)), 2)
+
+        container.put_item(self.inv_15, self.spear_1)
+        container.put_item(self.inv_15, self.mace_1)
+        self.assertRaises(container.BulkLimitError, container.transfer_items,
+                          self.inv_25, self.inv_15)
+        self.assertEqual(self.sword_1.containable.container, "inv_25")
+        container.take_item(self.inv_15, 1)
+        container.put_item(self.inv_15, self.dagger_2)
+        self.assertRaises(container.NoFreeSlotError,
+                          container.transfer_items, self.inv_25, self.inv_15)
+        self.assertEqual(self.paper_1.containable.container, "inv_25")
+        container.take_item(self.inv_15, 1)
+        self.assertListEqual(
+            container.transfer_items(self.inv_25, self.inv_15), [])
+        self.assertListEqual(container.get_items(self.inv_25), [])
+        self.assertEqual(self.sword_1.containable.slot, 1)
+        self.assertEqual(self.paper_1.containable.slot, 2)
+
+    def test_Nested(self):
+        bag = self.Inventory(self.world, "bag", 20, 0)
+        bag.containable.bulk = 2
+        bag.containable.weight = 1
+        pouch = self.Inventory(self.world, "pouch", 5, 0)
+        pouch.containable.weight = 1
+        self.dagger_1.containable.weight = 2
+        self.sword_1.containable.weight = 4
+        container.put_item(bag, self.dagger_1)
+        container.put_item(self.inv_25, bag)
+        self.assertEqual(container.get_total_weight(self.inv_25), 1)
+        self.assertEqual(container.get_total_weight(self.inv_25, True), 3)
+        self.assertEqual(container.get_total_bulk(self.inv_25, True), 4)
+        container.put_item(pouch, self.sword_1)
+        container.put_item(bag, pouch)
+        self.assertEqual(container.get_total_weight(self.inv_25, True), 8)
+        self.sword_1.containable.weight = 5
+        self.assertEqual(container.get_total_weight(self.inv_25, True), 9)
+        container.take_item(pouch, 0)
+        self.assertEqual(container.get_total_weight(self.inv_25, True), 4)
+        container.take_item(self.inv_25, 0)
+        self.assertEqual(container.get_total_weight(self.inv_25, True), 0)
+        self.assertEqual(container.get_total_weight(bag, True), 3)
+
+    def test_Pages(self):
+        container.put_item(self.inv_no_slots, self.sword_1)
+        container.put_item(self.inv_no_slots, self.dagger_1)
+        container.put_item(self.inv_no_slots, self.spear_1)
+        container.put_item(self.inv_no_slots, self.mace_1)
+        self.assertListEqual(
+            container.get_items_page(self.inv_no_slots, 0, 3, "bulk"),
+            [self.dagger_1, self.sword_1, self.mace_1])
+        self.assertListEqual(
+            container.get_items_page(self.inv_no_slots, 1, 3, "bulk"),
+            [self.spear_1])
+        self.assertListEqual(
+            container.get_items_page(self.inv_no_slots, 0, 3, "bulk", True),
+            [self.spear_1, self.mace_1, self.sword_1])
+        self.assertListEqual(
+            container.get_items_page(self.inv_no_slots, 1, 3, "bulk", True),
+            [self.dagger_1])
+        container.put_item(self.inv_no_slots, self.paper_1)
+        self.paper_1.containable.current_stack = 10
+        self.assertListEqual(
+            container.get_items_page(self.inv_no_slots, 0, 2, "bulk"),
+            [self.paper_1, self.dagger_1])
+        container.take_item(self.inv_no_slots, 1)
+        heavy = lambda item: item.containable.bulk > 3
+        self.assertListEqual(
+            container.get_items_page(self.inv_no_slots, 1, 2, "slot",
+                                     item_filter=heavy),
+            [self.mace_1])
+        self.assertEqual(container.count_items(self.inv_no_slots, heavy), 3)
+        self.assertRaises(KeyError, container.get_items_page,
+                          self.inv_no_slots, 0, 2, "colour")
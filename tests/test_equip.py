@@ -12,6 +12,7 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from fife_rpg.components import ComponentManager
 from fife_rpg.components import equip, equipable, general
 
 from bGrease.world import BaseWorld
@@ -27,12 +28,11 @@ class TestEquip(unittest.TestCase):
         def configure(self):
             """Set up the world"""
             self.components.general = general.General()
-            general.General.registered_as = "general"
+            general.General.register("general")
             self.components.equipable = equipable.Equipable()
-            equipable.Equipable.registered_as = "equipable"
+            equipable.Equipable.register("equipable")
             self.components.equip = equip.RPGEquip()
-            equip.RPGEquip.registered_as = "equip"
-            equip.Equip.registered_as = "equip"
+            equip.RPGEquip.register("equip")
 
         def get_entity(self, identifier):
             """Returns the entity with the identifier
@@ -94,6 +94,7 @@ class TestEquip(unittest.TestCase):
         self.assertIsNotNone(self.two_hand_item.equipable.wearer)
 
     def tearDown(self):
+        ComponentManager.clear_components()
         self.world = None
         self.wearer = None
         self.arms_item = None
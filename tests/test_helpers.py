@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import yaml
+
+from fife_rpg import helpers
+
+
+class TestReplaceFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "source")
+        self.destination = os.path.join(self.directory, "destination")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, data):
+        with open(filename, "w") as out:
+            out.write(data)
+
+    def read(self, filename):
+        with open(filename) as in_file:
+            return in_file.read()
+
+    def check_replace(self):
+        self.write(self.source, "first")
+        helpers.replace_file(self.source, self.destination)
+        self.assertEqual("first", self.read(self.destination))
+        self.write(self.source, "second")
+        helpers.replace_file(self.source, self.destination)
+        self.assertEqual("second", self.read(self.destination))
+        self.assertFalse(os.path.exists(self.source))
+
+    def test_replace(self):
+        self.check_replace()
+
+    def test_rename_fallback(self):
+        replace = getattr(os, "replace", None)
+        if replace is not None:
+            del os.replace
+        try:
+            self.check_replace()
+        finally:
+            if replace is not None:
+                os.replace = replace
+
+
+def construct_upper(loader, node):
+    """Constructs an upper case string from a yaml scalar"""
+    return loader.construct_scalar(node).upper()
+
+
+class TestYaml(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        helpers.add_yaml_constructor("!Upper", construct_upper)
+        helpers.add_yaml_constructor("!DoublePoint",
+                                     helpers.double_point_constructor)
+        helpers.add_yaml_constructor("!DoublePoint3D",
+                                     helpers.double_point_3d_constructor)
+        helpers.add_yaml_representer(helpers.VersionedDict,
+                                     helpers.versioned_dict_representer)
+        helpers.add_yaml_representer(helpers.DoublePointYaml,
+                                     helpers.double_point_representer)
+        helpers.add_yaml_representer(helpers.DoublePoint3DYaml,
+                                     helpers.double_point_3d_representer)
+
+    @classmethod
+    def tearDownClass(cls):
+        # The other tags are registered by the world as well
+        for loader in set((helpers.YamlLoader, yaml.SafeLoader)):
+            loader.yaml_constructors.pop("!Upper", None)
+
+    def load_fallback_helpers(self):
+        """Loads a copy of the helpers module as if libyaml was missing"""
+        removed = {}
+        for name in ("CSafeLoader", "CSafeDumper"):
+            if hasattr(yaml, name):
+                removed[name] = getattr(yaml, name)
+                delattr(yaml, name)
+        try:
+            return imp.load_source("fallback_helpers",
+                                   helpers.__file__.replace(".pyc", ".py"))
+        finally:
+            for name, value in removed.items():
+                setattr(yaml, name, value)
+            sys.modules.pop("fallback_helpers", None)
+
+    def test_loader(self):
+        if getattr(yaml, "__with_libyaml__", False):
+            self.assertIs(helpers.YamlLoader, yaml.CSafeLoader)
+            self.assertIs(helpers.YamlDumper, yaml.CSafeDumper)
+        else:
+            self.assertIs(helpers.YamlLoader, yaml.SafeLoader)
+            self.assertIs(helpers.YamlDumper, yaml.SafeDumper)
+        fallback = self.load_fallback_helpers()
+        self.assertIs(fallback.YamlLoader, yaml.SafeLoader)
+        self.assertIs(fallback.YamlDumper, yaml.SafeDumper)
+        fallback.add_yaml_constructor("!Upper", construct_upper)
+        self.assertEqual(["A", "B"],
+                         fallback.load_yaml("[!Upper a, !Upper b]"))
+        self.assertEqual([{"a": 1}, "B"],
+                         list(fallback.load_all_yaml("a: 1\n--- !Upper b")))
+        self.assertEqual({"a": [1, 2]},
+                         fallback.load_yaml(fallback.dump_yaml({"a": [1, 2]})))
+
+    def test_constructor(self):
+        self.assertEqual("A", helpers.load_yaml("!Upper a"))
+        self.assertEqual("A", yaml.safe_load("!Upper a"))
+        self.assertEqual(["A", "B"],
+                         list(helpers.load_all_yaml("!Upper a\n--- !Upper b")))
+
+    def test_double_point(self):
+        for load in (helpers.load_yaml, yaml.safe_load):
+            point = load("!DoublePoint 1.5:2")
+            self.assertIsInstance(point, helpers.DoublePointYaml)
+            self.assertEqual((1.5, 2.0), (point.x, point.y))
+            self.assertEqual(point, load(helpers.dump_yaml(point)))
+            point = load("!DoublePoint3D 1.5:2:-3")
+            self.assertIsInstance(point, helpers.DoublePoint3DYaml)
+            self.assertEqual((1.5, 2.0, -3.0), (point.x, point.y, point.z))
+            self.assertEqual(point, load(helpers.dump_yaml(point)))
+
+    def test_dump_entities(self):
+        versioned = helpers.VersionedDict()
+        versioned["Town"] = 1
+        entities = [
+            {"Template": "Chest",
+             "Components": {"Agent": {"map": "Level1",
+                                      "position": helpers.DoublePoint3DYaml(
+                                          1.5, 2, 0),
+                                      "knows": versioned}}},
+            {"Components": {"General": {"identifier": "Player"}}},
+        ]
+        dumped = helpers.dump_entities(entities)
+        self.assertNotIn("{", dumped, "Mappings should be in block style")
+        loaded = list(helpers.load_all_yaml(dumped))
+        self.assertEqual(entities, loaded)
+        self.assertEqual(entities, list(yaml.safe_load_all(dumped)))
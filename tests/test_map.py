@@ -12,11 +12,19 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import tempfile
 import unittest
 
+from fife import fife
 from fife.fife import DoubleRect, DoublePoint
 
-from fife_rpg.gamemap import GameMap, NoSuchRegionError
+from fife_rpg.components import ComponentManager
+from fife_rpg.components.agent import Agent
+from fife_rpg.components.fifeagent import FifeAgent
+from fife_rpg.gamemap import GameMap, NoSuchRegionError, read_map_id
+from fife_rpg.systems import SystemManager
+from fife_rpg.world import RPGWorld
 
 TEST_LAYER = "TestLayer"
 # Dummy classes
@@ -38,6 +46,13 @@ class FifeLayer(object):
 
     def __init__(self, identifier):
         self.identifier = identifier
+        self.deleted = []
+
+    def getInstance(self, identifier):
+        return identifier
+
+    def deleteInstance(self, instance):
+        self.deleted.append(instance)
 
 class FifeMap(object):
     """Dummy class that acts like a fife map as needed"""
@@ -56,6 +71,69 @@ class FifeMap(object):
         # Being lazy here as this is not part of the actual test
         return self.layers[name]
 
+class LoadedFifeMap(FifeMap, fife.Map):
+    """Dummy class that acts like a loaded fife map as needed"""
+
+    def __init__(self, identifier):  # pylint: disable=W0231
+        FifeMap.__init__(self)
+        self.identifier = identifier
+
+    def getId(self):
+        return self.identifier
+
+    def getCameras(self):
+        return [self.camera]
+
+    def getFilename(self):
+        return "maps/%s.xml" % self.identifier
+
+class FifeModel(object):
+    """Dummy class that acts like a fife model as needed"""
+
+    def __init__(self):
+        self.deleted = []
+
+    def deleteMap(self, fife_map):
+        self.deleted.append(fife_map)
+
+class Engine(object):
+    """Dummy class that acts like a fife engine as needed"""
+
+    def __init__(self):
+        self.model = FifeModel()
+
+    def getModel(self):
+        return self.model
+
+class Location(object):
+    """Dummy class that acts like a fife location as needed"""
+
+    def __init__(self, x_pos, y_pos, z_pos):
+        self.x = x_pos  # pylint: disable=C0103
+        self.y = y_pos  # pylint: disable=C0103
+        self.z = z_pos  # pylint: disable=C0103
+
+class Behaviour(object):
+    """Dummy class that acts like an agent behaviour as needed"""
+
+    def __init__(self, location, rotation):
+        self.location = location
+        self.rotation = rotation
+
+class Settings(object):
+    """Dummy class that acts like the settings as needed"""
+
+    def get(self, section, name, default=None):  # pylint: disable=W0613
+        return default
+
+class Application(object):
+    """Dummy class that acts like an RPGApplication as needed"""
+
+    def __init__(self):
+        self.settings = Settings()
+        self.engine = Engine()
+        self.world = RPGWorld(self)
+
 # Test cases
 
 class Test(unittest.TestCase):
@@ -87,8 +165,8 @@ class Test(unittest.TestCase):
                          "Map.get_layer does not return the correct value")
         self.assertDictEqual(self.regions, rpg_map.regions,
                          "Map.regions does not return the correct value")
-        self.assertDictEqual({}, rpg_map.entities,
-                             "Entities dictionary is not empty")
+        self.assertEqual(set(), rpg_map.entities,
+                         "Entities set is not empty")
         self.assertFalse(rpg_map.is_active,
                          "Map should not be active")
         rpg_map.activate()
@@ -104,3 +182,189 @@ class Test(unittest.TestCase):
                         "50, 50 should not be in region Beta")
         self.assertRaises(NoSuchRegionError,
                           rpg_map.is_in_region, point, "Gamma")
+
+    def test_lazy_regions(self):
+        loaded = []
+
+        def load_regions():
+            loaded.append(True)
+            return self.regions
+
+        rpg_map = GameMap(self.fife_map, self.map_name, "Default",
+                          load_regions, None)
+        self.assertFalse(loaded, "Regions should not be loaded yet")
+        self.assertDictEqual(self.regions, rpg_map.regions,
+                             "Map.regions does not return the correct value")
+        self.assertTrue(rpg_map.is_in_region(DoublePoint(50, 50), "Alpha"),
+                        "50, 50 should be in region Alpha")
+        self.assertEqual(len(loaded), 1, "Regions should be loaded once")
+
+    def test_read_map_id(self):
+        handle, filename = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(handle, "w") as map_file:
+            map_file.write('<?xml version="1.0" encoding="ascii"?>\n'
+                           '<map id="TestMap" format="1.0">\n'
+                           '<layer id="ground"><broken></map>')
+        try:
+            self.assertEqual(read_map_id(filename), "TestMap")
+        finally:
+            os.remove(filename)
+
+
+class TestMapAgents(unittest.TestCase):
+
+    def setUp(self):
+        self.application = Application()
+        self.world = self.application.world
+        self.map_name = "Test"
+        self.rpg_map = GameMap(LoadedFifeMap(self.map_name), self.map_name,
+                               "Default", {}, self.application)
+
+    def tearDown(self):
+        for entity in list(self.world.entities):
+            entity.delete()
+        ComponentManager.clear_components()
+        ComponentManager.clear_checkers()
+        SystemManager.clear_systems()
+
+    def create_agent(self, identifier, map_name="Test", position=(0, 0, 0)):
+        return self.world.get_or_create_entity(
+            identifier, {Agent.registered_as: {"map": map_name,
+                                               "layer": TEST_LAYER,
+                                               "position": position}})
+
+    def test_lookup(self):
+        first = self.create_agent("First")
+        second = self.create_agent("Second", "Other")
+        self.rpg_map.update_entities()
+        self.assertIs(self.rpg_map["First"], first)
+        self.assertRaises(KeyError, self.rpg_map.__getitem__, "Second")
+        getattr(second, Agent.registered_as).map = self.map_name
+        self.assertIs(self.rpg_map["Second"], second)
+        third = self.create_agent("Third")
+        self.assertIs(self.rpg_map["Third"], third)
+        self.assertEqual({first, second, third}, self.rpg_map.entities)
+
+        new_identifier = self.world.rename_entity("First", "Renamed")
+        self.assertIs(self.rpg_map[new_identifier], first)
+        self.assertRaises(KeyError, self.rpg_map.__getitem__, "First")
+
+        layer = self.rpg_map.get_layer(TEST_LAYER)
+        getattr(second, FifeAgent.registered_as).layer = layer
+        self.rpg_map.remove_entity("Second")
+        self.assertEqual(["Second"], layer.deleted)
+        self.assertRaises(KeyError, self.rpg_map.__getitem__, "Second")
+        self.assertEqual("", getattr(second, Agent.registered_as).map)
+
+        delattr(third, Agent.registered_as)
+        self.assertRaises(KeyError, self.rpg_map.__getitem__, "Third")
+        self.assertEqual({first}, self.rpg_map.entities)
+
+    def test_region_states(self):
+        rpg_map = GameMap(LoadedFifeMap("Regions"), "Regions", "Default", {},
+                          self.application)
+        rpg_map.set_region("Square", DoubleRect(0, 0, 10, 10))
+        rpg_map.set_region("Big", DoubleRect(-100, -100, 1000, 1000))
+        inside = self.create_agent("Inside", "Regions", (5, 5, 0))
+        outside = self.create_agent("Outside", "Regions", (50, 50, 0))
+        self.create_agent("Elsewhere", "Other", (5, 5, 0))
+        changes = rpg_map.update_region_states()
+        self.assertEqual(sorted(changes),
+                         [("Inside", frozenset(["Square", "Big"]),
+                           frozenset()),
+                          ("Outside", frozenset(["Big"]), frozenset())])
+        self.assertEqual([], rpg_map.update_region_states(),
+                         "Agents that did not move were reported")
+
+        outside_agent = getattr(outside, Agent.registered_as)
+        outside_agent.position = (5, 5, 0)
+        self.assertEqual([("Outside", frozenset(["Square"]), frozenset())],
+                         rpg_map.update_region_states())
+        outside_agent.position = (6, 6, 0)
+        self.assertEqual([], rpg_map.update_region_states(),
+                         "Moving inside a region was reported")
+
+        getattr(inside, Agent.registered_as).map = "Other"
+        self.assertEqual([("Inside", frozenset(),
+                           frozenset(["Square", "Big"]))],
+                         rpg_map.update_region_states(),
+                         "Leaving the map did not exit the regions")
+
+        rpg_map.remove_region("Big")
+        self.assertEqual([("Outside", frozenset(), frozenset(["Big"]))],
+                         rpg_map.update_region_states(),
+                         "Removing a region did not exit it")
+        rpg_map.set_region("Square", DoubleRect(100, 100, 10, 10))
+        self.assertEqual([("Outside", frozenset(), frozenset(["Square"]))],
+                         rpg_map.update_region_states(),
+                         "Moving a region did not exit it")
+        self.assertEqual(frozenset(), rpg_map.get_agent_regions(outside))
+        rpg_map.set_region("Near", DoubleRect(0, 0, 10, 10))
+        self.assertEqual([("Outside", frozenset(["Near"]), frozenset())],
+                         rpg_map.update_region_states(),
+                         "Adding a region did not enter it")
+
+    def test_unload(self):
+        entity = self.create_agent("Walker")
+        self.rpg_map.update_entities()
+        fifeagent = getattr(entity, FifeAgent.registered_as)
+        fifeagent.layer = self.rpg_map.get_layer(TEST_LAYER)
+        fifeagent.instance = "Walker"
+        fifeagent.behaviour = Behaviour(Location(7.0, 8.0, 0.0), 90)
+        fife_map = self.rpg_map.fife_map
+        self.rpg_map.camera.setEnabled(True)
+        self.assertRaises(RuntimeError, self.rpg_map.unload)
+        self.rpg_map.camera.setEnabled(False)
+        self.rpg_map.unload()
+        self.assertFalse(self.rpg_map.is_loaded)
+        self.assertEqual("maps/Test.xml", self.rpg_map.fife_map)
+        self.assertEqual("Test", self.rpg_map.name)
+        self.assertEqual([fife_map], self.application.engine.model.deleted)
+        agent = getattr(entity, Agent.registered_as)
+        self.assertEqual((7.0, 8.0, 0.0),
+                         (agent.position.x, agent.position.y,
+                          agent.position.z),
+                         "The position was not written back")
+        self.assertEqual(90, agent.rotation,
+                         "The rotation was not written back")
+        self.assertIsNone(fifeagent.layer)
+        self.assertIsNone(fifeagent.instance)
+        self.assertIsNone(fifeagent.behaviour)
+        self.assertEqual(set(), self.rpg_map.entities)
+        self.rpg_map.unload()
+        self.assertEqual(1, len(self.application.engine.model.deleted),
+                         "An unloaded map was unloaded again")
+
+    def test_unload_agent_grid(self):
+        self.rpg_map.set_region("Square", DoubleRect(0, 0, 10, 10))
+        entity = self.create_agent("Walker", position=(5, 5, 0))
+        self.assertEqual([entity],
+                         self.rpg_map.get_agents_in_radius((5, 5), 1))
+        self.assertEqual([("Walker", frozenset(["Square"]), frozenset())],
+                         self.rpg_map.update_region_states())
+        grid = self.rpg_map.get_agent_grid()
+        self.rpg_map.unload()
+        agent = getattr(entity, Agent.registered_as)
+        agent.position = (6, 6, 0)
+        agent.map = "Other"
+        self.assertIsNot(grid, self.rpg_map.get_agent_grid(),
+                         "The agent grid was kept after unloading the map")
+        self.assertEqual([], self.rpg_map.get_agents_in_radius((5, 5), 5))
+        self.assertEqual([("Walker", frozenset(), frozenset(["Square"]))],
+                         self.rpg_map.update_region_states(),
+                         "An agent that left the unloaded map is still in "
+                         "its regions")
+
+    def test_remove_listeners(self):
+        first = self.create_agent("First")
+        self.rpg_map.update_entities()
+        self.rpg_map.remove_listeners()
+        second = self.create_agent("Second")
+        getattr(first, Agent.registered_as).map = "Other"
+        self.assertEqual({first}, self.rpg_map.entities,
+                         "The entities were updated without listeners")
+        self.rpg_map.update_entities()
+        self.assertEqual({second}, self.rpg_map.entities)
+        third = self.create_agent("Third")
+        self.assertIs(self.rpg_map["Third"], third,
+                      "The listeners were not added again")
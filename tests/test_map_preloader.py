@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from fife_rpg.map_preloader import MapPreloader, read_map_files
+
+MAP_XML = """<?xml version="1.0" encoding="ascii"?>
+<map id="%s" format="1.0">
+    <import file="objects/tree.xml" />
+    <import dir="objects/houses" />
+    <layer id="ground" />
+</map>
+"""
+
+
+class GameMap(object):
+    """Dummy class that acts like a GameMap as needed"""
+
+    def __init__(self, filename, loadable=True):
+        self.fife_map = filename
+        self.is_loaded = False
+        self.loadable = loadable
+        self.imported = []
+
+    def import_object_file(self, filename):
+        if not self.loadable:
+            raise RuntimeError("Can't load object file %s" % filename)
+        self.imported.append(os.path.basename(filename))
+
+
+class Application(object):
+    """Dummy class that acts like an RPGApplication as needed"""
+
+    def __init__(self, maps):
+        self.maps = maps
+
+
+class TestMapPreloader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, "objects", "houses"))
+        self.files = {"objects/tree.xml": b"<object />",
+                      "objects/houses/a.xml": b"<object id='a' />",
+                      "objects/houses/b.xml": b"<object id='b' />"}
+        for filename, data in self.files.items():
+            with open(os.path.join(self.directory, filename), "wb") as out:
+                out.write(data)
+        maps = {}
+        for name in ("town", "forest", "broken"):
+            filename = os.path.join(self.directory, name + ".xml")
+            with open(filename, "w") as out:
+                out.write(MAP_XML % name)
+            maps[name] = GameMap(filename, name != "broken")
+        self.application = Application(maps)
+        self.preloader = MapPreloader(self.application)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def wait_for_map(self):
+        for _ in range(500):
+            name = self.preloader.step()
+            if name is not None or not self.preloader.pending:
+                return name
+            time.sleep(0.01)
+        self.fail("The map was not preloaded")
+
+    def test_ReadMapFiles(self):
+        filename = self.application.maps["town"].fife_map
+        self.assertEqual(
+            read_map_files(filename),
+            [os.path.join(self.directory, "objects", name) for name in
+             ("tree.xml", os.path.join("houses", "a.xml"),
+              os.path.join("houses", "b.xml"))])
+
+    def test_Preload(self):
+        self.assertIsNone(self.preloader.step())
+        self.preloader.request("town")
+        self.preloader.request("town")
+        self.assertEqual(self.preloader.pending, set(["town"]))
+        self.assertEqual(self.wait_for_map(), "town")
+        town = self.application.maps["town"]
+        self.assertEqual(town.imported, ["tree.xml", "a.xml", "b.xml"])
+        self.assertFalse(town.is_loaded,
+                         "The map was loaded outside of a map switch")
+        self.assertTrue(self.preloader.is_preloaded("town"))
+        self.assertFalse(self.preloader.pending)
+        self.preloader.request("town")
+        self.assertFalse(self.preloader.pending)
+        self.assertEqual(town.imported, ["tree.xml", "a.xml", "b.xml"])
+        self.assertRaises(LookupError, self.preloader.request, "nowhere")
+
+    def test_OneMapPerStep(self):
+        self.preloader.request("town")
+        self.preloader.request("forest")
+        loaded = [self.wait_for_map()]
+        loaded.append(self.wait_for_map())
+        self.assertEqual(sorted(loaded), ["forest", "town"])
+
+    def test_CancelAndErrors(self):
+        self.preloader.request("forest")
+        self.preloader.cancel("forest")
+        self.preloader.request("broken")
+        self.assertEqual(self.wait_for_map(), "broken")
+        self.assertFalse(self.preloader.is_preloaded("forest"))
+        self.assertEqual(self.application.maps["forest"].imported, [])
+        self.preloader.request("town")
+        os.remove(self.application.maps["town"].fife_map)
+        self.assertIsNone(self.wait_for_map())
+        self.assertFalse(self.preloader.is_preloaded("town"))
+
+    def test_LoadedMap(self):
+        self.preloader.request("town")
+        self.wait_for_files("town")
+        self.application.maps["town"].is_loaded = True
+        self.assertEqual(self.preloader.step(), "town")
+        self.assertEqual(self.application.maps["town"].imported, [])
+
+    def wait_for_files(self, name):
+        for _ in range(500):
+            self.assertIsNone(self.preloader.step(can_load=False))
+            if name in self.preloader.ready:
+                return
+            time.sleep(0.01)
+        self.fail("The map files were not read")
+
+    def test_CanLoad(self):
+        self.preloader.request("town")
+        self.wait_for_files("town")
+        self.assertEqual(self.application.maps["town"].imported, [],
+                         "Objects were imported while loading was not "
+                         "allowed")
+        self.assertEqual(self.preloader.step(), "town")
+        self.assertEqual(len(self.application.maps["town"].imported), 3)
+        self.assertEqual(self.preloader.ready, [])
+
+    def test_FrameBudget(self):
+        self.preloader.frame_budget = 0
+        self.preloader.request("town")
+        self.wait_for_files("town")
+        town = self.application.maps["town"]
+        for count in (1, 2):
+            self.assertIsNone(self.preloader.step())
+            self.assertEqual(len(town.imported), count,
+                             "The frame budget was not kept")
+        self.assertEqual(self.preloader.step(), "town")
+        self.assertEqual(town.imported, ["tree.xml", "a.xml", "b.xml"])
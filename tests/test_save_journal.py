@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fife_rpg.binary_entities import EntityData
+from fife_rpg.save_journal import SaveJournal
+
+
+def get_identifier(entity_dict):
+    return entity_dict["Components"]["General"]["identifier"]
+
+
+def entity(identifier, value):
+    return {"Components": {"General": {"identifier": identifier},
+                           "Test": {"value": value}}}
+
+
+class TestSaveJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "save.sav")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self):
+        journal = SaveJournal(self.filename)
+        entities = journal.load(get_identifier)
+        return journal, dict((get_identifier(entity_dict), entity_dict)
+                             for entity_dict in entities)
+
+    def test_replay(self):
+        journal = SaveJournal(self.filename, 2)
+        journal.write_snapshot([entity("a", 1), entity("b", 2)])
+        journal.write_delta([entity("a", 3)], [])
+        self.assertFalse(journal.needs_compaction)
+        journal.write_delta([entity("c", 4)], ["b"])
+        self.assertTrue(journal.needs_compaction)
+        loaded_journal, entities = self.load()
+        self.assertEqual(2, loaded_journal.delta_count)
+        self.assertEqual({"a": entity("a", 3), "c": entity("c", 4)},
+                         entities)
+        journal.write_snapshot(list(entities.values()))
+        self.assertEqual(0, os.path.getsize(journal.journal_filename))
+        self.assertEqual(entities, self.load()[1])
+
+    def test_interrupted_delta(self):
+        journal = SaveJournal(self.filename)
+        journal.write_snapshot([entity("a", 1)])
+        journal.write_delta([entity("a", 2)], [])
+        journal.write_delta([entity("a", 3)], [])
+        size = os.path.getsize(journal.journal_filename)
+        with open(journal.journal_filename, "r+b") as journal_file:
+            journal_file.truncate(size - 3)
+        loaded_journal, entities = self.load()
+        self.assertEqual(1, loaded_journal.delta_count)
+        self.assertEqual({"a": entity("a", 2)}, entities)
+
+    def test_interrupted_snapshot(self):
+        journal = SaveJournal(self.filename)
+        journal.write_snapshot([entity("a", 1)])
+        journal.write_delta([entity("a", 2)], [])
+        with open(journal.journal_filename, "rb") as journal_file:
+            old_journal = journal_file.read()
+        journal.write_snapshot([entity("a", 2), entity("b", 3)])
+        # The journal was not truncated before the interruption
+        with open(journal.journal_filename, "wb") as journal_file:
+            journal_file.write(old_journal)
+        loaded_journal, entities = self.load()
+        self.assertEqual(0, loaded_journal.delta_count)
+        self.assertEqual({"a": entity("a", 2), "b": entity("b", 3)},
+                         entities)
+        loaded_journal.write_delta([entity("b", 4)], ["a"])
+        loaded_journal, entities = self.load()
+        self.assertEqual(1, loaded_journal.delta_count)
+        self.assertEqual({"b": entity("b", 4)}, entities)
+
+    def test_nested_delta(self):
+        journal = SaveJournal(self.filename)
+        journal.write_snapshot([entity("a", EntityData(entity("b", 1))),
+                                entity("b", 1)])
+        journal.write_delta([entity("b", 2)], [])
+        created = {}
+
+        def create_entity(entity_dict):
+            identifier = get_identifier(entity_dict)
+            if identifier not in created:
+                created[identifier] = entity_dict["Components"]["Test"]
+            return identifier
+        entities = SaveJournal(self.filename).load(get_identifier,
+                                                   create_entity)
+        self.assertEqual({"value": 2}, created["b"],
+                         "The nested entity was created with old data")
+        self.assertIn(entity("a", "b"), entities)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from fife_rpg.systems import GameVariables
+from fife_rpg.systems.scriptingsystem import ScriptingSystem
+
+# Dummy classes
+
+
+class Application(object):
+    """Dummy class that acts like an RPGApplication as needed"""
+
+    def add_map_switch_callback(self, callback):
+        pass
+
+    def add_region_entered_callback(self, callback):
+        pass
+
+    def add_region_exited_callback(self, callback):
+        pass
+
+
+class Systems(object):
+    """Dummy class that acts like the systems of a world as needed"""
+
+
+class World(object):
+    """Dummy class that acts like an RPGWorld as needed"""
+
+    def __init__(self):
+        self.application = Application()
+        self.systems = Systems()
+
+
+class DerivedScriptingSystem(ScriptingSystem):
+    """Scripting system derived from ScriptingSystem"""
+
+
+def command():
+    """Dummy command"""
+
+
+# Test cases
+
+
+class TestScriptingSystem(unittest.TestCase):
+
+    def setUp(self):
+        self.registered_variables = not GameVariables.registered_as
+        if self.registered_variables:
+            GameVariables.register()
+        world = World()
+        self.game_variables = GameVariables()
+        setattr(world.systems, GameVariables.registered_as,
+                self.game_variables)
+        self.system = ScriptingSystem()
+        self.system.set_world(world)
+
+    def tearDown(self):
+        if self.registered_variables:
+            GameVariables.unregister()
+
+    def test_prepare_globals(self):
+        script_globals = self.system.prepare_globals()
+        self.assertIs(script_globals, self.system.prepare_globals(),
+                      "The globals were rebuilt without a change")
+
+        ScriptingSystem.register_command("test_command", command)
+        script_globals = self.system.prepare_globals()
+        self.assertIs(script_globals["test_command"], command,
+                      "The globals were not rebuilt after a new command")
+
+        DerivedScriptingSystem.register_command("derived_command", command,
+                                                "test_module")
+        script_globals = self.system.prepare_globals()
+        self.assertIn("test_module", script_globals,
+                      "The globals were not rebuilt after a new command "
+                      "of a derived class")
+        self.assertIs(script_globals["test_module"].derived_command, command)
+
+        self.game_variables.set_variable("test_variable", 42)
+        script_globals = self.system.prepare_globals()
+        self.assertEqual(script_globals["test_variable"], 42,
+                         "The globals were not rebuilt after a game "
+                         "variable changed")
+        self.assertIs(script_globals, self.system.prepare_globals())
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import random
+import unittest
+
+from fife_rpg.spatial_index import SpatialGrid, RectGrid
+
+
+class TestSpatialGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = SpatialGrid(4.0)
+        self.grid.insert("a", 0.0, 0.0)
+        self.grid.insert("b", 3.0, 4.0)
+        self.grid.insert("c", -10.0, 2.0)
+        self.grid.insert("d", 20.0, 20.0)
+
+    def test_InsertRemove(self):
+        self.assertEqual(len(self.grid), 4)
+        self.assertIn("a", self.grid)
+        self.grid.insert("a", 30.0, -7.5)
+        self.assertEqual(len(self.grid), 4)
+        self.assertEqual(self.grid.get_position("a"), (30.0, -7.5))
+        self.grid.remove("a")
+        self.grid.remove("a")
+        self.assertNotIn("a", self.grid)
+        self.assertEqual(len(self.grid), 3)
+        self.assertRaises(KeyError, self.grid.get_position, "a")
+
+    def test_Rect(self):
+        self.assertEqual(sorted(self.grid.query_rect(0.0, 0.0, 3.0, 4.0)),
+                         ["a", "b"])
+        self.assertEqual(sorted(self.grid.query_rect(-10.0, -1.0, 5.0, 5.0)),
+                         ["c"])
+        self.assertEqual(len(self.grid.query_rect(-1e6, -1e6, 2e6, 2e6)), 4)
+        self.grid.insert("d", 1.0, 1.0)
+        self.assertEqual(sorted(self.grid.query_rect(0.0, 0.0, 3.0, 4.0)),
+                         ["a", "b", "d"])
+
+    def test_Radius(self):
+        self.assertEqual(sorted(self.grid.query_radius(0.0, 0.0, 5.0)),
+                         ["a", "b"])
+        self.assertEqual(sorted(self.grid.query_radius(0.0, 0.0, 4.9)),
+                         ["a"])
+        self.assertEqual(self.grid.query_radius(100.0, 100.0, 1.0), [])
+
+    def test_Nearest(self):
+        self.assertEqual(self.grid.nearest(0.0, 0.0, 2), ["a", "b"])
+        self.assertEqual(self.grid.nearest(19.0, 19.0, 1), ["d"])
+        self.assertEqual(self.grid.nearest(-9.0, 2.0, 10),
+                         ["c", "a", "b", "d"])
+        self.assertEqual(self.grid.nearest(0.0, 0.0, 10, 6.0), ["a", "b"])
+        self.assertEqual(self.grid.nearest(0.0, 0.0, 0), [])
+        self.assertEqual(SpatialGrid().nearest(0.0, 0.0, 3), [])
+
+    def test_Random(self):
+        generator = random.Random(42)
+        grid = SpatialGrid(5.0)
+        points = {}
+        for key in range(500):
+            points[key] = (generator.uniform(-100, 100),
+                           generator.uniform(-100, 100))
+            grid.insert(key, *points[key])
+        for _ in range(20):
+            x_pos = generator.uniform(-120, 120)
+            y_pos = generator.uniform(-120, 120)
+            distances = sorted(
+                (math.hypot(point[0] - x_pos, point[1] - y_pos), key)
+                for key, point in points.items())
+            self.assertEqual(grid.nearest(x_pos, y_pos, 7),
+                             [key for _, key in distances[:7]])
+            self.assertEqual(
+                sorted(grid.query_radius(x_pos, y_pos, 15.0)),
+                sorted(key for distance, key in distances
+                       if distance <= 15.0))
+
+
+class TestRectGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = RectGrid(10.0, max_cells=16)
+        self.grid.insert("small", 0.0, 0.0, 5.0, 5.0)
+        self.grid.insert("wide", -5.0, 2.0, 30.0, 3.0)
+        self.grid.insert("huge", -500.0, -500.0, 1000.0, 1000.0)
+
+    def test_Point(self):
+        self.assertEqual(sorted(self.grid.query_point(1.0, 3.0)),
+                         ["huge", "small", "wide"])
+        self.assertEqual(sorted(self.grid.query_point(5.0, 5.0)),
+                         ["huge", "small", "wide"])
+        self.assertEqual(sorted(self.grid.query_point(20.0, 3.0)),
+                         ["huge", "wide"])
+        self.assertEqual(self.grid.query_point(20.0, 6.0), ["huge"])
+        self.assertEqual(self.grid.query_point(600.0, 0.0), [])
+
+    def test_InsertRemove(self):
+        self.assertEqual(len(self.grid), 3)
+        self.grid.insert("small", 100.0, 100.0, 1.0, 1.0)
+        self.assertEqual(self.grid.get_rect("small"),
+                         (100.0, 100.0, 1.0, 1.0))
+        self.assertEqual(sorted(self.grid.query_point(1.0, 1.0)), ["huge"])
+        self.grid.remove("huge")
+        self.grid.remove("huge")
+        self.assertNotIn("huge", self.grid)
+        self.assertEqual(self.grid.query_point(100.5, 100.5), ["small"])
+        self.grid.remove("small")
+        self.grid.remove("wide")
+        self.assertEqual(len(self.grid), 0)
+        self.assertEqual(self.grid.query_point(1.0, 3.0), [])
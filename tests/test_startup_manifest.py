@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from fife_rpg.helpers import load_yaml
+from fife_rpg.startup_manifest import StartupManifest
+
+
+class TestStartupManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "cache", "manifest.bin")
+        self.sources = {"components.yaml": "Components: {Agent: a.b}\n",
+                        "lock.yaml": "Lock: null\n"}
+        self.parsed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_source(self, source):
+        return self.sources[source]
+
+    def parse(self, data):
+        self.parsed.append(data)
+        return load_yaml(data)
+
+    def create_manifest(self):
+        return StartupManifest(self.filename, self.read_source)
+
+    def test_Cache(self):
+        manifest = self.create_manifest()
+        data = manifest.get("components.yaml", self.parse)
+        self.assertEqual(data, {"Components": {"Agent": "a.b"}})
+        self.assertTrue(manifest.changed)
+        manifest.save()
+        self.assertFalse(manifest.changed)
+        self.assertTrue(os.path.exists(self.filename))
+
+        manifest = self.create_manifest()
+        data = manifest.get("components.yaml", self.parse)
+        data["Components"]["Other"] = "c.d"
+        self.assertEqual(manifest.get("components.yaml", self.parse),
+                         {"Components": {"Agent": "a.b"}})
+        self.assertEqual(len(self.parsed), 1)
+        self.assertFalse(manifest.changed)
+
+    def test_Changed(self):
+        manifest = self.create_manifest()
+        manifest.get("components.yaml", self.parse)
+        manifest.save()
+        self.sources["components.yaml"] = "Components: {Agent: x.y}\n"
+        manifest = self.create_manifest()
+        self.assertEqual(manifest.get("components.yaml", self.parse),
+                         {"Components": {"Agent": "x.y"}})
+        self.assertEqual(len(self.parsed), 2)
+        self.assertTrue(manifest.changed)
+
+    def test_Unpicklable(self):
+        manifest = self.create_manifest()
+        lock = threading.Lock()
+        self.assertIs(manifest.get("lock.yaml", lambda data: lock), lock)
+        manifest.save()
+        manifest = self.create_manifest()
+        self.assertIsNone(manifest.get("lock.yaml", self.parse)["Lock"])
+        self.assertEqual(len(self.parsed), 1)
+
+    def test_Corrupt(self):
+        os.makedirs(os.path.dirname(self.filename))
+        with open(self.filename, "wb") as manifest_file:
+            manifest_file.write(b"not a manifest")
+        manifest = self.create_manifest()
+        self.assertEqual(manifest.get("components.yaml", self.parse),
+                         {"Components": {"Agent": "a.b"}})
+        self.assertEqual(len(self.parsed), 1)
+
+    def test_Unwritable(self):
+        with open(os.path.join(self.directory, "cache"), "w") as out:
+            out.write("not a directory")
+        manifest = self.create_manifest()
+        manifest.get("components.yaml", self.parse)
+        self.assertFalse(manifest.save())
+        self.assertTrue(manifest.changed)
+        self.assertFalse(os.path.exists(self.filename + ".tmp"))
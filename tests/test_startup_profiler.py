@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from fife_rpg import startup_profiler
+from fife_rpg.helpers import load_all_yaml, load_yaml
+from fife_rpg.startup_profiler import StartupProfiler, startup_phase
+
+
+@startup_phase()
+def load_things():
+    load_yaml("a: 1")
+    return list(load_all_yaml("--- 1\n--- 2\n"))
+
+
+@startup_phase("outer")
+def outer():
+    startup_profiler.count("entities", 5)
+    return load_things()
+
+
+class TestStartupProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = StartupProfiler()
+
+    def tearDown(self):
+        self.profiler.stop()
+
+    def test_Inactive(self):
+        self.assertEqual(outer(), [1, 2])
+        with startup_profiler.phase("nothing") as record:
+            self.assertIsNone(record)
+        self.assertEqual(self.profiler.phases, [])
+        self.assertEqual(self.profiler.counts, {})
+
+    def test_Phases(self):
+        self.profiler.start()
+        self.assertTrue(self.profiler.is_running)
+        self.assertEqual(outer(), [1, 2])
+        with startup_profiler.phase("empty"):
+            pass
+        self.profiler.stop()
+        self.assertFalse(self.profiler.is_running)
+        self.assertEqual([(record["name"], record["depth"])
+                          for record in self.profiler.phases],
+                         [("outer", 0), ("load_things", 1), ("empty", 0)])
+        self.assertEqual(self.profiler.phases[0]["counts"],
+                         {"entities": 5, "yaml_documents": 3})
+        self.assertEqual(self.profiler.phases[1]["counts"],
+                         {"yaml_documents": 3})
+        self.assertEqual(self.profiler.phases[2]["counts"], {})
+        self.assertEqual(self.profiler.counts,
+                         {"entities": 5, "yaml_documents": 3})
+        for record in self.profiler.phases:
+            self.assertGreaterEqual(record["wall_time"], 0.0)
+            self.assertGreaterEqual(record["cpu_time"], 0.0)
+        self.assertGreaterEqual(self.profiler.wall_time,
+                                self.profiler.phases[0]["wall_time"])
+
+    def test_Reports(self):
+        self.profiler.start()
+        outer()
+        self.profiler.stop()
+        text = self.profiler.report_text()
+        self.assertIn("  load_things", text)
+        self.assertIn("yaml_documents=3", text)
+        self.assertTrue(text.splitlines()[-1].startswith("Total"))
+        data = json.loads(self.profiler.report_json())
+        self.assertEqual(data["counts"]["entities"], 5)
+        self.assertEqual(len(data["phases"]), 2)
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "startup")
+            self.profiler.dump(filename)
+            with open(filename + ".txt") as text_file:
+                self.assertEqual(text_file.read(), text)
+            with open(filename + ".json") as json_file:
+                self.assertEqual(json.load(json_file), data)
+        finally:
+            shutil.rmtree(directory)
@@ -17,7 +17,9 @@ import unittest
 from bGrease.world import BaseWorld
 
 from fife_rpg.entities import RPGEntity
+from fife_rpg.components import ComponentManager
 from fife_rpg.components import character_statistics, general
+from fife_rpg.systems import SystemManager
 from fife_rpg.systems.character_statistics import (CharacterStatisticSystem, 
                                                    get_stat_cost)
 
@@ -30,11 +32,11 @@ class TestStatistics(unittest.TestCase):
             """Set up the world"""
             self.components.char_stats = (
                                 character_statistics.CharacterStatistics())
-            character_statistics.CharacterStatistics.registered_as = (
-                                                                "char_stats")
+            character_statistics.CharacterStatistics.register("char_stats")
             self.components.general = general.General()
+            general.General.register("general")
             self.systems.char_stats = CharacterStatisticSystem()
-            CharacterStatisticSystem.registered_as = "char_stats"
+            CharacterStatisticSystem.register("char_stats")
 
         def get_entity(self, identifier):
             """Returns the entity with the identifier
@@ -82,6 +84,10 @@ class TestStatistics(unittest.TestCase):
         self.character.char_stats.primary_stats["CO"] = 35
         self.world.systems.char_stats.step(0)
 
+    def tearDown(self):
+        ComponentManager.clear_components()
+        SystemManager.clear_systems()
+
     def test_statistics(self):
         print "Test statistic calculation"
         char_stats = self.character.char_stats
@@ -156,3 +162,61 @@ class TestStatistics(unittest.TestCase):
         can_decrease = char_stats_system.can_decrease_statistic(self.character,
                                                                 "CO")
         self.assertFalse(can_decrease, "Statistic should not be decreasable")
+
+    def test_recalculate_changed(self):
+        char_stats_system = self.world.systems.char_stats
+        char_stats = self.character.char_stats
+        primary_stats = char_stats.primary_stats
+        secondary_stats = char_stats.secondary_stats
+        secondary_stats["LC"] = 0
+        primary_stats["CO"] = 50
+        char_stats_system.step(0)
+        self.assertEqual(secondary_stats["LC"], 0,
+                         "Statistic without changed influences was updated")
+        correct = 0.7 * primary_stats["ST"] + 0.3 * primary_stats["CO"]
+        self.assertEqual(secondary_stats["MD"], correct,
+                         "Secondary statistics are not updated correctly")
+        char_stats_system.add_secondary_statistic(
+                "DMG", "Damage", "Damage done by the character", {"MD": 2})
+        char_stats_system.step(0)
+        self.assertEqual(secondary_stats["LC"],
+                         0.7 * primary_stats["ST"] + 0.3 * primary_stats["FT"],
+                         "Statistics are not recalculated after a change of"
+                         " the statistic definitions")
+        self.assertEqual(secondary_stats["DMG"], correct * 2,
+                         "Dependent secondary statistics are not calculated")
+
+    def test_dependency_order(self):
+        char_stats_system = self.world.systems.char_stats
+        char_stats_system.add_secondary_statistic(
+                "A", "A", "Depends on a later statistic", {"B": 1})
+        char_stats_system.add_secondary_statistic(
+                "B", "B", "Depends on strength", {"ST": 1})
+        dependent = char_stats_system.get_dependent_statistics(["ST"])
+        self.assertEqual(set(dependent), set(["LC", "MD", "SPD", "B", "A"]))
+        self.assertLess(dependent.index("B"), dependent.index("A"),
+                        "A statistic comes before one it depends on")
+        char_stats = self.character.char_stats
+        char_stats.primary_stats["ST"] = 10
+        char_stats_system.step(0)
+        self.assertEqual(char_stats.secondary_stats["A"], 10,
+                         "Secondary statistics are not calculated in the"
+                         " order of their dependencies")
+        char_stats.primary_stats["ST"] = 20
+        char_stats_system.step(0)
+        self.assertEqual(char_stats.secondary_stats["A"], 20,
+                         "Secondary statistics are not calculated in the"
+                         " order of their dependencies")
+
+    def test_removed_entity(self):
+        char_stats_system = self.world.systems.char_stats
+        # pylint: disable=W0212
+        calculated = char_stats_system._CharacterStatisticSystem__calculated
+        # pylint: enable=W0212
+        self.assertIn(self.character, calculated)
+        del self.character.char_stats
+        other = self.Character(self.world, "Other")
+        self.assertNotIn(self.character, calculated,
+                         "The values of a removed entity are still cached")
+        char_stats_system.step(0)
+        self.assertEqual(set([other]), set(calculated.keys()))
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+from fife_rpg import helpers
+from fife_rpg.components import ComponentManager
+from fife_rpg.components.agent import Agent
+from fife_rpg.systems import SystemManager
+from fife_rpg.world import RPGWorld
+
+# Dummy classes
+
+
+class Settings(object):
+    """Dummy class that acts like the settings as needed"""
+
+    def get(self, section, name, default=None):  # pylint: disable=W0613
+        return default
+
+
+class VFS(object):
+    """Dummy class that acts like the fife VFS as needed"""
+
+    def open(self, filename):  # pylint: disable=R0201
+        return open(filename)
+
+
+class Engine(object):
+    """Dummy class that acts like the fife engine as needed"""
+
+    def getVFS(self):  # pylint: disable=C0103,R0201
+        return VFS()
+
+
+class Application(object):
+    """Dummy class that acts like an RPGApplication as needed"""
+
+    def __init__(self):
+        self.settings = Settings()
+        self.engine = Engine()
+
+
+# Test cases
+
+
+class TestWorld(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.world = RPGWorld(Application())
+
+    def tearDown(self):
+        self.delete_entities(self.world)
+        self.world.destroy()
+        ComponentManager.clear_components()
+        ComponentManager.clear_checkers()
+        SystemManager.clear_systems()
+        shutil.rmtree(self.directory)
+
+    def delete_entities(self, world):
+        for entity in list(world.entities):
+            entity.delete()
+        world.step(0)
+
+    def create_agent(self, world, identifier):
+        return world.get_or_create_entity(
+            identifier, {Agent.registered_as: {"map": "Test"}})
+
+    def test_replaced_world(self):
+        self.world.save_checkpoint(os.path.join(self.directory, "first"))
+        self.world.destroy()
+        # pylint: disable=W0212
+        changed_entities = self.world._RPGWorld__changed_entities
+        # pylint: enable=W0212
+        second_world = RPGWorld(Application())
+        try:
+            second_world.save_checkpoint(os.path.join(self.directory,
+                                                      "second"))
+            entity = self.create_agent(second_world, "Changed")
+            getattr(entity, Agent.registered_as).map = "Other"
+            self.assertEqual(set(), changed_entities,
+                             "The replaced world tracked changes")
+        finally:
+            second_world.destroy()
+
+    def test_replaced_world_index(self):
+        first = self.create_agent(self.world, "First")
+        self.assertEqual(set((first,)), self.world.find_entities(
+            Agent.registered_as, "map", "Test"))
+        self.world.destroy()
+        second_world = RPGWorld(Application())
+        try:
+            self.assertEqual(set(), second_world.find_entities(
+                Agent.registered_as, "map", "Test"),
+                "The index contains the entities of the replaced world")
+            second = self.create_agent(second_world, "Second")
+            getattr(first, Agent.registered_as).map = "Other"
+            getattr(first, Agent.registered_as).map = "Test"
+            self.assertEqual(set((second,)), second_world.find_entities(
+                Agent.registered_as, "map", "Test"))
+        finally:
+            self.delete_entities(second_world)
+            second_world.destroy()
+
+    def test_checkpoint_after_delete(self):
+        filename = os.path.join(self.directory, "checkpoint")
+        entity = self.create_agent(self.world, "Deleted")
+        self.create_agent(self.world, "Kept")
+        self.world.save_checkpoint(filename)
+        entity.delete()
+        self.world.step(0)
+        self.world.save_checkpoint(filename)
+        loaded_world = RPGWorld(Application())
+        try:
+            loaded_world.load_checkpoint(filename)
+            self.assertFalse(loaded_world.is_identifier_used("Deleted"))
+            self.assertTrue(loaded_world.is_identifier_used("Kept"))
+        finally:
+            self.delete_entities(loaded_world)
+            loaded_world.destroy()
+
+    def create_chests(self, world):
+        for identifier in ("Chest", "Chest_1", "Chest_5", "Barrel_2"):
+            self.create_agent(world, identifier)
+
+    def check_loaded_numbers(self, load):
+        self.create_chests(self.world)
+        loaded_world = RPGWorld(Application())
+        try:
+            load(loaded_world)
+            self.assertEqual("Chest_6",
+                             loaded_world.create_unique_identifier("Chest"))
+            self.assertEqual("Barrel",
+                             loaded_world.create_unique_identifier("Barrel"))
+            self.create_agent(loaded_world, "Barrel")
+            self.assertEqual("Barrel_3",
+                             loaded_world.create_unique_identifier("Barrel"))
+        finally:
+            self.delete_entities(loaded_world)
+            loaded_world.destroy()
+
+    def test_unique_identifier(self):
+        world = self.world
+        self.assertEqual("Chest", world.create_unique_identifier("Chest"))
+        self.create_agent(world, "Chest")
+        self.assertEqual("Chest_1", world.create_unique_identifier("Chest"))
+        self.assertEqual("Chest_2", world.create_unique_identifier("Chest"))
+        self.create_agent(world, "Chest_4")
+        self.assertEqual("Chest_3", world.create_unique_identifier("Chest"))
+        self.assertEqual("Chest_5", world.create_unique_identifier("Chest"))
+
+    def test_unique_identifier_after_delete(self):
+        world = self.world
+        self.create_agent(world, "Chest")
+        self.create_agent(world, world.create_unique_identifier("Chest"))
+        chest = self.create_agent(world,
+                                  world.create_unique_identifier("Chest"))
+        self.assertEqual("Chest_2", chest.identifier)
+        chest.delete()
+        self.assertFalse(world.is_identifier_used("Chest_2"))
+        self.assertEqual("Chest_3", world.create_unique_identifier("Chest"),
+                         "The number of a deleted entity was reused")
+
+    def test_unique_identifier_after_rename(self):
+        world = self.world
+        self.create_agent(world, "Chest")
+        self.create_agent(world, "Barrel")
+        self.assertEqual("Chest_1", world.rename_entity("Barrel", "Chest"))
+        self.assertFalse(world.is_identifier_used("Barrel"))
+        self.assertEqual("Barrel", world.create_unique_identifier("Barrel"))
+        self.assertEqual("Chest_2", world.create_unique_identifier("Chest"))
+        self.assertEqual("Chest_3", world.rename_entity("Chest_1", "Chest"))
+
+    def test_update_identifier_numbers(self):
+        world = self.world
+        self.create_chests(world)
+        self.create_agent(world, "Chest_x")
+        self.create_agent(world, "_7")
+        world.update_identifier_numbers()
+        self.assertEqual("Chest_6", world.create_unique_identifier("Chest"))
+        self.assertEqual("Barrel", world.create_unique_identifier("Barrel"))
+        self.assertEqual("Chest_x_1",
+                         world.create_unique_identifier("Chest_x"))
+
+    def test_load_and_create_entities(self):
+        filename = os.path.join(self.directory, "entities.yaml")
+
+        def load(world):
+            with open(filename, "w") as entities_file:
+                helpers.dump_entities(list(self.world.entities),
+                                      entities_file)
+            world.load_and_create_entities(filename)
+        self.check_loaded_numbers(load)
+
+    def test_load_entities_binary(self):
+        filename = os.path.join(self.directory, "entities.bin")
+
+        def load(world):
+            self.world.save_entities_binary(filename)
+            world.load_entities_binary(filename)
+        self.check_loaded_numbers(load)
+
+    def test_load_checkpoint(self):
+        filename = os.path.join(self.directory, "checkpoint")
+
+        def load(world):
+            self.world.save_checkpoint(filename)
+            world.load_checkpoint(filename)
+        self.check_loaded_numbers(load)
+
+    def test_entity_yaml(self):
+        entity = self.create_agent(self.world, "Dumped")
+        getattr(entity, Agent.registered_as).position = (
+            helpers.DoublePoint3DYaml(1.5, 2, 0))
+        dumped = helpers.dump_entities([entity])
+        self.assertIn("!Entity", dumped)
+        entity_dict = self.world.create_entity_dictionary(entity)
+        for load in (helpers.load_yaml, yaml.safe_load):
+            entity.delete()
+            entity = load(dumped)
+            self.assertEqual("Dumped", entity.identifier)
+            self.assertIs(entity, self.world.get_entity("Dumped"))
+            self.assertEqual(entity_dict,
+                             self.world.create_entity_dictionary(entity))